@@ -0,0 +1,126 @@
+#!/usr/bin/python
+"""motorsort asset_index.py"""
+
+import os
+import re
+import json
+import threading
+
+# file listing flag aliases, in the flag directory
+COUNTRY_FILE = "country.json"
+
+
+class AssetIndex:
+    """file names in the custom image, track, and flag directories, listed
+    once and matched without case so lookups do not probe the filesystem.
+    refresh() lists a directory again only if its mtime changed."""
+
+    def __init__(self):
+        self.directories = {}
+        self.flag_aliases = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def normalize(name: str) -> str:
+        """case, spaces, dashes, dots, and underscores do not matter"""
+        return re.sub(r"[\s._-]+", " ", name).strip().lower()
+
+    @staticmethod
+    def directory_mtime(directory: str):
+        """mtime of a directory, None if it is missing"""
+        try:
+            return os.stat(directory).st_mtime_ns
+        except OSError:
+            return None
+
+    def list_directory(self, directory: str):
+        """read a directory into the index, call with the lock held"""
+        mtime = self.directory_mtime(directory)
+        files = {}
+        try:
+            for file in sorted(os.listdir(directory)):
+                files.setdefault(self.normalize(file), os.path.join(directory, file))
+        except OSError:
+            pass
+        self.directories[directory] = (mtime, files)
+        self.flag_aliases.pop(directory, None)
+
+    def refresh(self):
+        """list directories again where files were added, removed or renamed"""
+        with self.lock:
+            for directory, (mtime, _) in list(self.directories.items()):
+                if self.directory_mtime(directory) != mtime:
+                    self.list_directory(directory)
+
+    def find(self, directory: str, file_name: str):
+        """returns the path of a file in directory matching file_name, or None"""
+        with self.lock:
+            if directory not in self.directories:
+                self.list_directory(directory)
+            return self.directories[directory][1].get(self.normalize(file_name))
+
+    def find_image(self, image_path: str, race, image_type: str) -> str:
+        """the race name image, else the season image, else the default, e.g.
+        Imola-poster.jpg, 2024-poster.jpg, poster.jpg"""
+        for file_name in (
+            f"{race.get_kv('race_name')}-{image_type}.jpg",
+            f"{race.get_kv('race_season')}-{image_type}.jpg",
+        ):
+            image = self.find(image_path, file_name)
+            if image:
+                return image
+        return self.find(image_path, f"{image_type}.jpg") or str(
+            image_path + "/" + image_type + ".jpg"
+        )
+
+    def find_track(self, track_path: str, race):
+        """the track map for a race name, or None"""
+        return self.find(track_path, race.get_kv("race_name") + ".png")
+
+    def find_flag(self, flag_path: str, race):
+        """the flag for a race name, or a country name or capital alias from
+        country.json, e.g. Netherlands to nl.png. None if there is none"""
+        flag = self.find(flag_path, race.get_kv("race_name") + ".png")
+        if flag:
+            return flag
+        code = self.get_flag_aliases(flag_path).get(
+            self.normalize(race.get_kv("race_name"))
+        )
+        if code:
+            return self.find(flag_path, code + ".png")
+        return None
+
+    def get_flag_aliases(self, flag_path: str) -> dict:
+        """country names and capitals to flag codes, loaded once per listing"""
+        country_file = self.find(flag_path, COUNTRY_FILE)
+        with self.lock:
+            if flag_path not in self.flag_aliases:
+                self.flag_aliases[flag_path] = self.read_flag_aliases(country_file)
+            return self.flag_aliases[flag_path]
+
+    def read_flag_aliases(self, country_file) -> dict:
+        """country names, and capitals shared by no other country, to codes"""
+        if country_file is None:
+            return {}
+        try:
+            with open(country_file, "r", encoding="utf-8") as file:
+                countries = json.load(file)
+        except (OSError, ValueError) as err:
+            print(f"WARNING: Can't read flag aliases: {err}")
+            return {}
+
+        capitals = {}
+        for country in countries:
+            if country.get("capital"):
+                capital = self.normalize(country["capital"])
+                capitals[capital] = None if capital in capitals else country["code"]
+        aliases = {
+            capital: code for capital, code in capitals.items() if code is not None
+        }
+        aliases.update(
+            (self.normalize(country["name"]), country["code"]) for country in countries
+        )
+        return aliases
+
+
+ASSET_INDEX = AssetIndex()
@@ -0,0 +1,183 @@
+#!/usr/bin/python
+"""motorsort config_cache.py"""
+
+import os
+import json
+import hashlib
+from session_matcher import SessionMatcher
+from tokenizer import FileNameTokenizer
+from image_encoding import parse_encoding
+
+# weekend orders find_weekend_order chooses between
+WEEKEND_ORDERS = ("sprint_order", "regular_order", "sportscar_order")
+
+
+class SeriesMatcher:
+    """series_prefix compiled into a prefix trie. Finds the prefix a file
+    name starts with by walking its characters once, where more than one
+    prefix matches the first in series_prefix order is used"""
+
+    # disable too few public methods - pylint: disable=R0903
+
+    def __init__(self, series_prefix: dict):
+        self.series_prefix = series_prefix
+        self.trie = {}
+        for order, prefix in enumerate(series_prefix):
+            node = self.trie
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node.setdefault("", order)
+        self.prefixes = list(series_prefix)
+
+    def match(self, file_name: str):
+        """returns the prefix and race series a file name starts with, or None"""
+        node = self.trie
+        found = node.get("")
+        for char in file_name:
+            node = node.get(char)
+            if node is None:
+                break
+            if "" in node and (found is None or node[""] < found):
+                found = node[""]
+        if found is None:
+            return None
+        prefix = self.prefixes[found]
+        return prefix, self.series_prefix[prefix]
+
+
+class WeekendOrderIndex:
+    """weekend_order compiled into a session to position dict for each order"""
+
+    # disable too few public methods - pylint: disable=R0903
+
+    def __init__(self, weekend_order: dict):
+        self.weekend_order = weekend_order
+        self.positions = {}
+        for order_name, sessions in weekend_order.items():
+            positions = {}
+            for position, session in enumerate(sessions, 1):
+                positions.setdefault(session, position)
+            self.positions[order_name] = positions
+
+    def position(self, order_name: str, session: str) -> int:
+        """returns the 1 based position of a session, ValueError if missing"""
+        try:
+            return self.positions[order_name][session]
+        except KeyError as err:
+            raise ValueError(f"{session} not in {order_name}") from err
+
+
+def validate_lookups(settings: dict) -> list:
+    """returns a problem for each malformed lookup table"""
+    problems = []
+    for key in ("series_prefix", "session_map", "fonts"):
+        if not isinstance(settings[key], dict):
+            problems.append(f"{key} must be a JSON object")
+        elif any(not isinstance(value, str) for value in settings[key].values()):
+            problems.append(f"{key} values must be strings")
+    if isinstance(settings["series_prefix"], dict) and "" in settings["series_prefix"]:
+        problems.append("series_prefix has an empty prefix")
+
+    weekend_order = settings["weekend_order"]
+    if not isinstance(weekend_order, dict):
+        return problems + ["weekend_order must be a JSON object"]
+    for order_name in WEEKEND_ORDERS:
+        sessions = weekend_order.get(order_name)
+        if not isinstance(sessions, list):
+            problems.append(f"weekend_order is missing the {order_name} list")
+        elif len(set(sessions)) != len(sessions):
+            problems.append(f"weekend_order {order_name} lists a session twice")
+    return problems
+
+
+def is_within(path: str, parent: str) -> bool:
+    """True if path is parent or a path under it"""
+    path, parent = os.path.realpath(path), os.path.realpath(parent)
+    return os.path.commonpath([path, parent]) == parent
+
+
+def validate_settings(settings: dict) -> list:
+    """returns a problem for each setting that would fail a run"""
+    problems = validate_lookups(settings)
+    for key in ("copy_workers", "pipeline_workers", "render_workers", "render_batch"):
+        if settings[key] < 0:
+            problems.append(f"{key} must be 0 or more")
+    if settings["render_backend"] not in ("imagemagick", "pillow"):
+        problems.append(f"unknown render backend: {settings['render_backend']}")
+    for key in ("poster_encoding", "background_encoding"):
+        try:
+            parse_encoding(settings[key])
+        except ValueError as err:
+            problems.append(f"{key}: {err}")
+    # a cache prunes its directory, it must not hold the media
+    for key in ("render_cache", "layer_cache"):
+        for path_key in ("destination_path", "source_path"):
+            if settings[key] and is_within(settings[path_key], settings[key]):
+                problems.append(f"{key} can't be or contain {path_key}")
+    return problems
+
+
+def compile_lookups(settings: dict) -> dict:
+    """add the compiled lookup tables parse_race uses to settings, and a
+    version that changes with them"""
+    settings["lookup_version"] = hashlib.sha1(
+        json.dumps(
+            [
+                settings[key]
+                for key in (
+                    "series_prefix",
+                    "session_map",
+                    "weekend_order",
+                    "sprint_weekends",
+                )
+            ]
+        ).encode()
+    ).hexdigest()
+    settings["series_matcher"] = SeriesMatcher(settings["series_prefix"])
+    settings["session_matcher"] = SessionMatcher(settings["session_map"])
+    settings["weekend_order_index"] = WeekendOrderIndex(settings["weekend_order"])
+    settings["tokenizer"] = FileNameTokenizer(
+        settings["series_matcher"], settings["session_matcher"]
+    )
+    return settings
+
+
+class ConfigCache:
+    """settings loaded once, and again when config.ini or one of the json
+    files changes. A reload that fails keeps the last good settings"""
+
+    def __init__(self, load):
+        self.load = load
+        self.settings = None
+        self.mtimes = {}
+
+    @staticmethod
+    def file_mtimes(config_files) -> dict:
+        """mtime of each config file, None if it is missing"""
+        mtimes = {}
+        for config_file in config_files:
+            try:
+                mtimes[config_file] = os.stat(config_file).st_mtime_ns
+            except OSError:
+                mtimes[config_file] = None
+        return mtimes
+
+    def get(self) -> dict:
+        """returns the settings, reloaded if a config file changed"""
+        if self.settings is None:
+            self.settings = self.load()
+            self.mtimes = self.file_mtimes(self.settings["config_files"])
+            return self.settings
+
+        mtimes = self.file_mtimes(self.mtimes)
+        if mtimes == self.mtimes:
+            return self.settings
+        self.mtimes = mtimes
+        try:
+            self.settings = self.load()
+        except SystemExit as err:
+            print(f"{err} Keeping the last config.")
+            return self.settings
+        self.mtimes = self.file_mtimes(self.settings["config_files"])
+        print("Reloaded config.")
+        return self.settings
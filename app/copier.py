@@ -0,0 +1,119 @@
+#!/usr/bin/python
+"""motorsort copier.py, copy large files between pools"""
+
+import os
+import errno
+import fcntl
+import shutil
+import hashlib
+
+# linux/fs.h, share the source extents on filesystems that support it
+FICLONE = 0x40049409
+# largest single copy_file_range or sendfile call
+CHUNK_SIZE = 64 * 1024 * 1024
+# compared before resuming a partial copy
+RESUME_CHECK_SIZE = 1024 * 1024
+# kernel side copying is not supported between these files
+UNSUPPORTED = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP)
+
+
+def partial_name(destination: str) -> str:
+    """hidden temporary name a copy is written to before the rename"""
+    folder, file_name = os.path.split(destination)
+    return os.path.join(folder, f".{file_name}.part")
+
+
+def reflink(source_fd: int, destination_fd: int) -> bool:
+    """clone the whole source, returns False if the filesystem can't"""
+    try:
+        fcntl.ioctl(destination_fd, FICLONE, source_fd)
+    except OSError:
+        return False
+    return True
+
+
+def sendfile_at(source_fd: int, destination_fd: int, offset: int, count: int):
+    """sendfile writes at the destination position, move it to offset"""
+    os.lseek(destination_fd, offset, os.SEEK_SET)
+    return os.sendfile(destination_fd, source_fd, offset, count)
+
+
+def copy_range(source_fd: int, destination_fd: int, offset: int, size: int):
+    """copy source bytes from offset to size in the kernel where possible,
+    falling back from copy_file_range to sendfile to read and write"""
+    methods = [
+        lambda count: os.copy_file_range(
+            source_fd, destination_fd, count, offset, offset
+        ),
+        lambda count: sendfile_at(source_fd, destination_fd, offset, count),
+    ]
+    while offset < size:
+        count = min(CHUNK_SIZE, size - offset)
+        if methods:
+            try:
+                copied = methods[0](count)
+            except OSError as err:
+                if err.errno not in UNSUPPORTED:
+                    raise
+                methods.pop(0)
+                continue
+        else:
+            os.lseek(destination_fd, offset, os.SEEK_SET)
+            copied = os.write(destination_fd, os.pread(source_fd, count, offset))
+        if copied == 0:
+            raise OSError(errno.EIO, "source file shrank while copying")
+        offset += copied
+
+
+def resume_offset(source_fd: int, partial_fd: int, source_size: int) -> int:
+    """bytes of an earlier partial copy that can be kept, 0 to start over"""
+    partial_size = os.fstat(partial_fd).st_size
+    if partial_size > source_size:
+        return 0
+    check_size = min(RESUME_CHECK_SIZE, partial_size)
+    check_offset = partial_size - check_size
+    if os.pread(source_fd, check_size, check_offset) != os.pread(
+        partial_fd, check_size, check_offset
+    ):
+        return 0
+    return partial_size
+
+
+def file_digest(path: str) -> str:
+    """blake2b digest of a file"""
+    digest = hashlib.blake2b()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def copy_file(source: str, destination: str, verify: bool = False) -> int:
+    """copy source to destination through a partial file that is renamed
+    into place when complete. An interrupted copy resumes where it stopped.
+    Returns the bytes written by this call."""
+    partial = partial_name(destination)
+    source_fd = os.open(source, os.O_RDONLY)
+    try:
+        source_size = os.fstat(source_fd).st_size
+        partial_fd = os.open(partial, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            offset = resume_offset(source_fd, partial_fd, source_size)
+            os.ftruncate(partial_fd, offset)
+            if offset == 0 and reflink(source_fd, partial_fd):
+                offset = source_size
+            written = source_size - offset
+            copy_range(source_fd, partial_fd, offset, source_size)
+            os.fsync(partial_fd)
+        finally:
+            os.close(partial_fd)
+    finally:
+        os.close(source_fd)
+
+    if verify and file_digest(source) != file_digest(partial):
+        os.remove(partial)
+        raise OSError(errno.EIO, "copy does not match source: " + source)
+
+    shutil.copystat(source, partial)
+    os.replace(partial, destination)
+    return written
@@ -0,0 +1,114 @@
+#!/usr/bin/python
+"""motorsort image_encoding.py"""
+
+import os
+
+# formats posters and backgrounds can be written as, by file extension
+IMAGE_FORMATS = ("png", "jpg", "webp")
+# the file names media servers read as folder images, without extension
+IMAGE_NAMES = ("show", "background")
+# encoding options and the largest value each takes, flags take none
+ENCODING_OPTIONS = {"quality": 100, "compress_level": 9, "progressive": 0, "strip": 0}
+# pillow's jpeg quality before encodings were configurable
+PILLOW_JPEG_QUALITY = 92
+# the poster_encoding and background_encoding defaults
+POSTER_ENCODING = {"format": "png"}
+BACKGROUND_ENCODING = {"format": "jpg"}
+
+
+def parse_encoding(text: str) -> dict:
+    """parse an encoding setting, a format and options separated by spaces,
+    e.g. "webp quality=80 strip". Raises ValueError if it can't be read"""
+    words = text.split()
+    if not words or words[0].lower() not in IMAGE_FORMATS:
+        raise ValueError(f"unknown image format: {text!r}")
+
+    encoding = {"format": words[0].lower()}
+    for word in words[1:]:
+        key, _, value = word.partition("=")
+        if key not in ENCODING_OPTIONS:
+            raise ValueError(f"unknown encoding option: {word}")
+        if not ENCODING_OPTIONS[key]:
+            if value:
+                raise ValueError(f"{key} takes no value: {word}")
+            encoding[key] = True
+        elif value.isdigit() and int(value) <= ENCODING_OPTIONS[key]:
+            encoding[key] = int(value)
+        else:
+            raise ValueError(f"{key} must be 0 to {ENCODING_OPTIONS[key]}: {word}")
+    return encoding
+
+
+def image_file_name(name: str, encoding: dict) -> str:
+    """file name of a folder image, e.g. show.webp"""
+    return f"{name}.{encoding['format']}"
+
+
+def is_folder_image(file_name: str) -> bool:
+    """True if file_name is a poster or background in any format"""
+    name, extension = os.path.splitext(file_name)
+    return name in IMAGE_NAMES and extension[1:] in IMAGE_FORMATS
+
+
+def spec_encoding(encoding: dict) -> dict:
+    """the options of an encoding, set on an image spec. The format is the
+    extension of its destination"""
+    return {key: value for key, value in encoding.items() if key != "format"}
+
+
+def convert_options(spec: dict, reset: bool = False) -> list:
+    """imagemagick convert arguments for the encoding of a spec. Settings
+    last until they are changed, with reset the settings a spec does not
+    use are set back to their defaults, for commands writing several specs"""
+    encoding = spec.get("encoding", {})
+    extension = os.path.splitext(spec["destination"])[1].lower()
+    cmd = []
+    # png takes -quality as zlib level and filter, set by compress_level
+    if "quality" in encoding and extension != ".png":
+        cmd.extend(["-quality", str(encoding["quality"])])
+    elif reset:
+        cmd.append("+quality")
+    if encoding.get("progressive") and extension in (".jpg", ".jpeg"):
+        cmd.extend(["-interlace", "Plane"])
+    elif reset:
+        cmd.append("+interlace")
+    if "compress_level" in encoding and extension == ".png":
+        cmd.extend(["-define", f"png:compression-level={encoding['compress_level']}"])
+    elif reset:
+        cmd.extend(["+define", "png:compression-level"])
+    if encoding.get("strip"):
+        cmd.append("-strip")
+    return cmd
+
+
+def pillow_save_options(spec: dict) -> dict:
+    """Image.save arguments for the encoding of a spec"""
+    encoding = spec.get("encoding", {})
+    extension = os.path.splitext(spec["destination"])[1].lower()
+    save_options = {}
+    if extension in (".jpg", ".jpeg"):
+        save_options["quality"] = encoding.get("quality", PILLOW_JPEG_QUALITY)
+        save_options["progressive"] = encoding.get("progressive", False)
+    elif extension == ".webp" and "quality" in encoding:
+        save_options["quality"] = encoding["quality"]
+    elif extension == ".png" and "compress_level" in encoding:
+        save_options["compress_level"] = encoding["compress_level"]
+    if encoding.get("strip"):
+        save_options["icc_profile"] = None
+        save_options["exif"] = b""
+    return save_options
+
+
+def remove_other_formats(destination: str):
+    """remove a folder image in the formats other than destination's, e.g.
+    show.png once show.webp is written"""
+    name, extension = os.path.splitext(destination)
+    for image_format in IMAGE_FORMATS:
+        if f".{image_format}" == extension.lower():
+            continue
+        try:
+            os.remove(f"{name}.{image_format}")
+        except FileNotFoundError:
+            continue
+        except OSError as err:
+            raise SystemExit("ERROR: Can't remove image: ") from err
@@ -0,0 +1,148 @@
+#!/usr/bin/python
+"""motorsort metrics.py, run counters and stage timings"""
+
+import os
+import bisect
+import threading
+from time import perf_counter
+from contextlib import contextmanager
+
+
+class Metrics:
+    """counters and per stage latency histograms for a motorsort run"""
+
+    # histogram bucket upper bounds in seconds
+    buckets = (0.0001, 0.001, 0.01, 0.1, 0.5, 1.0, 5.0, 30.0, 120.0, 600.0)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.stages = {}
+
+    def count(self, name: str, value: int = 1):
+        """add value to a counter"""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, stage: str, seconds: float):
+        """record the time one pass through a stage took"""
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = {
+                    "count": 0,
+                    "sum": 0.0,
+                    "max": 0.0,
+                    "buckets": [0] * len(self.buckets),
+                }
+            timing = self.stages[stage]
+            timing["count"] += 1
+            timing["sum"] += seconds
+            timing["max"] = max(timing["max"], seconds)
+            bucket = bisect.bisect_left(self.buckets, seconds)
+            if bucket < len(self.buckets):
+                timing["buckets"][bucket] += 1
+
+    @contextmanager
+    def timer(self, stage: str):
+        """time the enclosed block as one pass through stage"""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, perf_counter() - start)
+
+    def reset(self):
+        """clear all counters and timings"""
+        with self.lock:
+            self.counters = {}
+            self.stages = {}
+
+    def summary(self) -> str:
+        """human readable end of run summary"""
+        with self.lock:
+            lines = [
+                "Summary: "
+                + " ".join(
+                    f"{name}={value}" for name, value in sorted(self.counters.items())
+                )
+            ]
+            for stage, timing in sorted(self.stages.items()):
+                lines.append(
+                    f"Stage {stage}: count={timing['count']}"
+                    f" total={timing['sum']:.3f}s"
+                    f" mean={timing['sum'] / timing['count']:.4f}s"
+                    f" max={timing['max']:.4f}s"
+                )
+        return "\n".join(lines)
+
+    def prometheus(self) -> str:
+        """metrics in the prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE motorsort_{name}_total counter")
+                lines.append(f"motorsort_{name}_total {value}")
+
+            lines.append("# TYPE motorsort_stage_seconds histogram")
+            for stage, timing in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, timing["buckets"]):
+                    cumulative += count
+                    lines.append(
+                        f'motorsort_stage_seconds_bucket{{stage="{stage}",le="{bound}"}}'
+                        f" {cumulative}"
+                    )
+                lines.append(
+                    f'motorsort_stage_seconds_bucket{{stage="{stage}",le="+Inf"}}'
+                    f" {timing['count']}"
+                )
+                lines.append(
+                    f'motorsort_stage_seconds_sum{{stage="{stage}"}} {timing["sum"]:.6f}'
+                )
+                lines.append(
+                    f'motorsort_stage_seconds_count{{stage="{stage}"}} {timing["count"]}'
+                )
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, metrics_file: str):
+        """write the prometheus text file, e.g. for a node exporter textfile
+        collector, replacing it atomically"""
+        temp_file = metrics_file + ".tmp"
+        try:
+            with open(temp_file, "w", encoding="utf-8") as file:
+                file.write(self.prometheus())
+            os.replace(temp_file, metrics_file)
+        except OSError as err:
+            print(f"WARNING: Can't write metrics file: {err}")
+
+
+METRICS = Metrics()
+
+
+def serve_metrics(port: int):
+    """serve /metrics on a background thread, returns the server. http.server
+    is imported here, runs without a metrics port do not load it"""
+    # pylint: disable=import-outside-toplevel
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        """serve METRICS at /metrics"""
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            """return the prometheus text for /metrics, 404 otherwise"""
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = METRICS.prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            """keep scrapes out of the container log"""
+
+    server = ThreadingHTTPServer(("", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
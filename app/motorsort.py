@@ -5,237 +5,992 @@ images. For use with a PLEX personal media server. 17 Dec 2023"""
 import os
 import re
 import json
-from shutil import which, copy2
+import queue
+import fnmatch
+import threading
 from datetime import datetime
-from configparser import ConfigParser
-from poster_maker import create_poster_image, create_background_image
-from weekend import Weekend
-
-
-def get_file_list(source_path, file_prefix, file_types) -> list:
-    """return path & name of files matching extensions and prefix lists"""
+from configparser import ConfigParser, Error as ConfigParserError
+from concurrent.futures import ThreadPoolExecutor
+from weekend import Weekend, DESTINATION_INDEX
+from state_index import StateIndex
+from session_matcher import SessionMatcher
+from config_cache import (
+    SeriesMatcher,
+    WeekendOrderIndex,
+    validate_settings,
+    compile_lookups,
+)
+from metrics import METRICS, serve_metrics
+from copier import copy_file
+from asset_index import ASSET_INDEX
+from tokenizer import (
+    FileNameTokenizer,
+    YEAR_PATTERN,
+    ROUND_PATTERN,
+    split_year,
+    split_round,
+    split_series,
+)
+from watermark import Watermark, render_inputs
+from image_encoding import parse_encoding
+
+
+def ignore_pattern(ignore_paths) -> re.Pattern:
+    """compile file and directory name globs into one case insensitive regex"""
+    globs = [glob.strip() for glob in ignore_paths if glob.strip()]
+    if not globs:
+        return re.compile("(?!)")
+    return re.compile(
+        "|".join(fnmatch.translate(glob) for glob in globs), re.IGNORECASE
+    )
+
+
+def iter_file_batches(source_path, file_prefix, file_types, ignore=None):
+    """yield the sorted matching files of each directory under source_path as
+    it is read. Ignored directories are not entered, and entry types come
+    from the directory listing so files are not stat'ed during the walk"""
 
     if not os.path.isdir(str(source_path)):
         raise SystemExit("ERROR, can't find source path: " + source_path)
 
-    file_list = []
-    for root, _, files in os.walk(source_path):
-        for file in files:
-            if file.endswith(file_types) and file.startswith(file_prefix):
-                file_list.append(os.path.join(root, file))
+    directories = [source_path]
+    while directories:
+        directory = directories.pop()
+        batch, sub_directories = [], []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if ignore is not None and ignore.match(entry.name):
+                        continue
+                    if entry.is_dir():
+                        # like os.walk, symlinked directories are not followed
+                        if not entry.is_symlink():
+                            sub_directories.append(entry.path)
+                    elif entry.name.endswith(file_types) and entry.name.startswith(
+                        file_prefix
+                    ):
+                        batch.append(entry.path)
+        except OSError as err:
+            print(f"ERROR: Can't read directory, skipping: {directory} {err}")
+            continue
+        # walk sub directories in name order
+        directories.extend(sorted(sub_directories, reverse=True))
+        if batch:
+            yield sorted(batch)
 
-    return sorted(file_list)
 
+def walk_source_path(settings: dict):
+    """iter_file_batches over the configured source path"""
+    return iter_file_batches(
+        settings["source_path"],
+        settings["file_prefix"],
+        settings["file_types"],
+        settings["ignore_pattern"],
+    )
 
-def find_sprint_weekends(source_file_names, weekends):
-    """search for sprint weekends before parsing names"""
 
-    sprint_weekends = []
-    # add sprint weekends from list in config.ini
+def is_source_file(path: str, settings: dict) -> bool:
+    """True if the walk of the source path would find this file"""
+    parts = os.path.relpath(path, settings["source_path"]).split(os.sep)
+    return (
+        parts[-1].endswith(settings["file_types"])
+        and parts[-1].startswith(settings["file_prefix"])
+        and not any(settings["ignore_pattern"].match(part) for part in parts)
+    )
+
+
+def get_file_list(source_path, file_prefix, file_types, ignore=None) -> list:
+    """return path & name of files matching extensions and prefix lists"""
+    return sorted(
+        source_file_name
+        for batch in iter_file_batches(source_path, file_prefix, file_types, ignore)
+        for source_file_name in batch
+    )
+
+
+def config_sprint_weekends(weekends) -> set:
+    """season and round of each sprint weekend listed in config.ini as
+    season-round, e.g. 2024-05"""
+    sprint_weekends = set()
     for sprint_event in weekends:
-        sprint_weekends.append((str(datetime.now().year), sprint_event))
+        race_season, _, race_round = sprint_event.strip().rpartition("-")
+        if not race_round:
+            continue
+        if not race_season:
+            # round only entries from older config files
+            race_season = str(datetime.now().year)
+            print(
+                f"WARNING: Sprint weekend has no season, using {race_season}-{race_round}"
+            )
+        sprint_weekends.add((race_season, race_round))
+    return sprint_weekends
 
-    # search files for other sprint weekends
-    for source_file_name in source_file_names:
-        race_season, race_round = "", ""
 
+def scan_sprint_weekends(source_file_names) -> set:
+    """season and round of each sprint session in a list of file names"""
+    sprint_weekends = set()
+    for source_file_name in source_file_names:
         if "sprint" in source_file_name.lower():
-
-            race_year = re.search("(20|19)[0-9][0-9]", source_file_name)
+            race_season, race_round = "", ""
+            race_year = YEAR_PATTERN.search(source_file_name)
             if race_year:
                 race_season = race_year.group()
-            r_round = re.search("Round.?[0-9][0-9]", source_file_name)
+            r_round = ROUND_PATTERN.search(source_file_name)
             if r_round:
                 race_round = r_round.group()[-2:]
+            sprint_weekends.add((race_season, race_round))
+    return sprint_weekends
 
-            if (race_season, race_round) not in sprint_weekends:
-                sprint_weekends.append((race_season, race_round))
 
-    return sprint_weekends
+def find_sprint_weekends(source_file_names, weekends) -> set:
+    """search for sprint weekends before parsing names"""
+    return config_sprint_weekends(weekends) | scan_sprint_weekends(source_file_names)
+
+
+def update_sprint_weekends(source_file_names, settings: dict, state_index) -> tuple:
+    """add sprint weekends from files new to the state index, so only new
+    files are searched. Returns the sprint weekends and the sorted Formula 1
+    files from weekends that just became sprint weekends, these are marked
+    for sorting again in sprint weekend order"""
+    sprint_weekends = config_sprint_weekends(settings["sprint_weekends"])
+    if state_index.sprint_weekends is None:
+        # index saved before sprint weekends were kept, search every file once
+        state_index.add_sprint_weekends(scan_sprint_weekends(source_file_names))
+        return sprint_weekends | state_index.sprint_weekends, []
+
+    new_sprint_weekends = (
+        scan_sprint_weekends(
+            [name for name in source_file_names if state_index.get_entry(name) is None]
+        )
+        - sprint_weekends
+        - state_index.sprint_weekends
+    )
+    state_index.add_sprint_weekends(new_sprint_weekends)
+    resort_file_names = state_index.invalidate_weekends(
+        new_sprint_weekends, "Formula 1"
+    )
+    return sprint_weekends | state_index.sprint_weekends, resort_file_names
 
 
 def find_race_year(race: object) -> str:
     """Search for a four digit year, save to object, return remaining right
     side of string."""
-    filename = race.get_kv("race_info")
-    race_year = re.search("(20|19)[0-9][0-9]", filename)
-    if race_year:
-        race.set_kv("race_season", race_year.group())
-        race.set_kv("race_info", filename.replace(race_year.group(), "", 1))
-    else:
-        race.set_kv("race_season", "1970")
+    race_season, race_info = split_year(race.get_kv("race_info"))
+    race.set_kv("race_season", race_season)
+    race.set_kv("race_info", race_info)
 
 
 def find_race_round(race: object) -> str:
     """Search for Round??, save to object, return remaining right side of
     string."""
-    filename = race.get_kv("race_info")
-    race_round = re.search("Round.?[0-9][0-9]", filename)
-    if race_round:
-        race.set_kv("race_round", race_round.group()[-2:])
-        race.set_kv("race_info", filename.replace(race_round.group(), "", 1))
-    else:
-        race.set_kv("race_round", "00")
+    race_round, race_info = split_round(race.get_kv("race_info"))
+    race.set_kv("race_round", race_round)
+    race.set_kv("race_info", race_info)
 
 
 def find_race_series(race: object, series_prefix: list) -> str:
     """Search for race series prefix, safe to object, return remaining right
-    side of string"""
-    filename = race.get_kv("race_info")
-    for key in series_prefix.keys():
-        if filename.startswith(key):
-            race.set_kv("race_series", series_prefix[key])
-            race.set_kv("race_info", filename.replace(key, "", 1))
-            break
-
-
-def find_race_session(race: object, session_map: list) -> str:
-    """find race session from dict, sort filename by name, info, and details"""
-    race_name = ""
-    race_session = ""
-    race_info = ""
-    for key in session_map.keys():
-        if key in race.get_kv("race_info").replace(".", " ").lower():
-            if len(race_session) <= len(key):
-                race_session = session_map[key]
-                race_details = re.split(
-                    key,
-                    race.get_kv("race_info").replace(".", " ").lower(),
-                    flags=re.IGNORECASE,
-                )
-                race_name = race_details[0].title()
-                race_info = race_details[-1].upper()
-                # print(
-                #     f">>key>> {session_map[key]} >race_name> {race_name} >race_info> {race_info}"
-                # )
+    side of string.
+    series_prefix is a SeriesMatcher, or a dict that is compiled for this call"""
+    if isinstance(series_prefix, dict):
+        series_prefix = SeriesMatcher(series_prefix)
+
+    race_series, race_info = split_series(race.get_kv("race_info"), series_prefix)
+    if race_series is not None:
+        race.set_kv("race_series", race_series)
+        race.set_kv("race_info", race_info)
+
+
+def find_race_session(race: object, session_map) -> str:
+    """find race session from dict, sort filename by name, info, and details.
+    session_map is a SessionMatcher, or a dict that is compiled for this call"""
+    if isinstance(session_map, dict):
+        session_map = SessionMatcher(session_map)
+
+    race_name, race_session, race_info = session_map.match(race.get_kv("race_info"))
     race.set_kv("race_name", race_name)
     race.set_kv("race_session", race_session)
     race.set_kv("race_info", race_info)
 
 
-def find_weekend_order(race: object, sprint_weekends: list, the_weekend_order: list):
-    """sort race session by race series order"""
+def set_race_tokens(race, tokens):
+    """save the fields of a tokenized file name to a race, the series is
+    left unset if no prefix matched"""
+    for key, value in zip(tokens._fields, tokens):
+        if value is not None:
+            race.set_kv(key, value)
+
+
+def find_weekend_order(race: object, sprint_weekends: set, the_weekend_order: list):
+    """sort race session by race series order. the_weekend_order is a
+    WeekendOrderIndex, or a dict that is compiled for this call"""
+    if isinstance(the_weekend_order, dict):
+        the_weekend_order = WeekendOrderIndex(the_weekend_order)
 
-    sort_order = the_weekend_order["sportscar_order"]
+    sort_order = "sportscar_order"
 
     if race.get_kv("race_series") == "Formula 1":
         if (race.get_kv("race_season"), race.get_kv("race_round")) in sprint_weekends:
-            sort_order = the_weekend_order["sprint_order"]
+            sort_order = "sprint_order"
         else:
-            sort_order = the_weekend_order["regular_order"]
+            sort_order = "regular_order"
     try:
-        wknd_order = sort_order.index(race.get_kv("race_session"))
+        wknd_order = the_weekend_order.position(sort_order, race.get_kv("race_session"))
     except ValueError as err:
         raise ValueError("not found in weekend order") from err
 
-    race.set_kv("weekend_order", str(wknd_order + 1).zfill(2))
+    race.set_kv("weekend_order", str(wknd_order).zfill(2))
+
+
+def parse_file_name(
+    race, series_prefix, session_map, sprint_weekends, the_weekend_order, file_name
+):
+    # disable too many arguments - pylint: disable=R0913,R0917
+    """parse a source file name into race fields, raises ValueError if the
+    session is not found in the weekend order. The lookups are compiled
+    for this call if given as dicts"""
+    if isinstance(series_prefix, dict):
+        series_prefix = SeriesMatcher(series_prefix)
+    if isinstance(session_map, dict):
+        session_map = SessionMatcher(session_map)
+
+    set_race_tokens(
+        race, FileNameTokenizer(series_prefix, session_map).tokenize(file_name)
+    )
+    find_weekend_order(race, sprint_weekends, the_weekend_order)
+
+
+def parse_error(err: Exception) -> str:
+    """the reason parse_race raised an error"""
+    if isinstance(err, KeyError):
+        return "race series not found"
+    return "session not found in weekend order"
+
 
+def parse_race(race, settings: dict, sprint_weekends, file_name: str):
+    """parse a source file name with the compiled tokenizer and weekend
+    order from settings"""
+    set_race_tokens(race, settings["tokenizer"].tokenize(file_name))
+    find_weekend_order(race, sprint_weekends, settings["weekend_order_index"])
 
-def link_files(race, source_file_name: str, copy_files: bool):
+
+def move_sorted_file(old_destination: str, destination: str):
+    """rename a file sorted under a name that is no longer current"""
+    if not os.path.exists(old_destination):
+        return
+    try:
+        if os.path.exists(destination):
+            os.remove(old_destination)
+        else:
+            os.replace(old_destination, destination)
+    except OSError as err:
+        raise SystemExit("ERROR: Can't rename file: ") from err
+    print("Renamed: " + os.path.basename(destination))
+
+
+def link_files(race, source_file_name: str, copy_files: bool, verify: bool = False):
     """hardlink or copy files to final destination"""
     if copy_files:
         try:
-            copy2(source_file_name, race.get_destination_full_path())
+            with METRICS.timer("copy"):
+                copied = copy_file(
+                    source_file_name, race.get_destination_full_path(), verify
+                )
         except OSError as err:
             raise SystemExit("ERROR: Can't copy file: ") from err
+        METRICS.count("files_copied")
+        METRICS.count("bytes_copied", copied)
         print("Copied: " + race.get_final_file_name())
     else:
         try:
-            os.link(source_file_name, race.get_destination_full_path())
+            with METRICS.timer("link"):
+                os.link(source_file_name, race.get_destination_full_path())
         except OSError as err:
             raise SystemExit("ERROR: Can't link file: ") from err
+        METRICS.count("files_linked")
         print("Linked: " + race.get_final_file_name())
 
 
-def build_images(race, font_list, track_path, flag_path, image_path):
-    """generate folder images"""
+def build_images(
+    race, font_list, track_path, flag_path, image_path, renderer=None, encodings=None
+):
+    # disable too many arguments - pylint: disable=R0913,R0917
+    """generate folder images, encodings maps show and background to their
+    parsed encoding"""
+    # pylint: disable=import-outside-toplevel
+    from poster_maker import create_poster_image, create_background_image
+
+    encodings = encodings or {}
+
     try:
         os.makedirs(race.get_destination_folder(), exist_ok=True)
     except OSError as err:
         raise SystemExit("ERROR: Can't create path: ") from err
 
-    create_poster_image(race, font_list, track_path, flag_path, image_path)
-    create_background_image(race, font_list, image_path)
+    create_poster_image(
+        race,
+        font_list,
+        track_path,
+        flag_path,
+        image_path,
+        renderer,
+        encodings.get("show"),
+    )
+    create_background_image(
+        race, font_list, image_path, renderer, encodings.get("background")
+    )
+
+
+def render_folder(race, settings: dict):
+    """build the images of a destination folder with the configured renderer"""
+    build_images(
+        race,
+        settings["fonts"],
+        settings["track_path"],
+        settings["flag_path"],
+        settings["image_path"],
+        get_renderer(settings),
+        {
+            "show": parse_encoding(settings["poster_encoding"]),
+            "background": parse_encoding(settings["background_encoding"]),
+        },
+    )
+
+
+def wait_for_renders(renders: dict) -> list:
+    """wait for queued image renders, returns an error for each failure"""
+    render_errors = []
+    for destination_folder, render in renders.items():
+        try:
+            render.result()
+        except (SystemExit, OSError) as err:
+            render_error = (
+                f"ERROR: Can't create images for {os.path.basename(destination_folder)}:"
+                f" {err} {err.__cause__ or ''}".rstrip()
+            )
+            print(render_error)
+            render_errors.append(render_error)
+            METRICS.count("render_errors")
+    return render_errors
+
+
+def wait_for_copies(copies: dict, state_index, sprint_weekends: set) -> list:
+    """wait for queued copies and record each finished file in the state
+    index, returns an error for each failure. Failed copies are retried and
+    resume on the next run."""
+    copy_errors = []
+    late_sprint_weekends = set()
+    for destination, queued in copies.items():
+        copy, source_file_name, source_stat, race, weekend = queued
+        try:
+            copy.result()
+        except (SystemExit, OSError) as err:
+            copy_error = (
+                f"ERROR: Can't copy {os.path.basename(destination)}:"
+                f" {err} {err.__cause__ or ''}".rstrip()
+            )
+            print(copy_error)
+            copy_errors.append(copy_error)
+            METRICS.count("copy_errors")
+            continue
 
+        state_index.record(source_file_name, source_stat, race)
+        if weekend in sprint_weekends:
+            late_sprint_weekends.add(weekend)
+
+    # a sprint session was found while copying, rename these on the next run
+    state_index.invalidate_weekends(late_sprint_weekends, "Formula 1")
+    return copy_errors
+
+
+def get_renderer(settings: dict):
+    """returns the configured image renderer, created on first use so runs
+    that render nothing do not need it, or the poster_maker import"""
+    # pylint: disable=import-outside-toplevel
+    from poster_maker import make_renderer
+    from render_cache import RenderCache, CachedRenderer
+
+    if "renderer" not in settings:
+        if settings["render_cache"]:
+            settings["renderer"] = CachedRenderer(
+                RenderCache(settings["render_cache"]).load(),
+                settings["render_backend"],
+                settings["font_path"],
+                settings["render_batch"],
+                settings["layer_cache"],
+            )
+        else:
+            settings["renderer"] = make_renderer(
+                settings["render_backend"],
+                settings["font_path"],
+                settings["render_batch"],
+                settings["layer_cache"],
+            )
+    return settings["renderer"]
+
+
+def refresh_images(settings: dict, state_index) -> list:
+    """render the images of sorted folders again where their inputs changed,
+    e.g. a new custom image, track map, or font. Folders are only checked
+    when render_inputs changed since the last refresh, new folders get their
+    images when they are written. Needs the render cache, returns render
+    errors"""
+    if not settings["render_cache"]:
+        return []
+    # created here, not by each worker
+    render_cache = get_renderer(settings).render_cache
+    signature = render_inputs(settings)
+    if render_cache.inputs_current(signature):
+        return []
+
+    # one race from each sorted folder is enough to build its images
+    races = {}
+    for entry in state_index.entries.values():
+        races.setdefault(os.path.dirname(entry["destination"]), entry["race"])
+
+    renders = {}
+    with ThreadPoolExecutor(max_workers=max(settings["render_workers"], 1)) as pool:
+        for destination_folder, race_fields in races.items():
+            if not os.path.isdir(destination_folder):
+                continue
+            race = Weekend(settings["destination_path"])
+            for key, value in race_fields.items():
+                race.set_kv(key, value)
+            renders[destination_folder] = pool.submit(render_folder, race, settings)
+        render_errors = wait_for_renders(renders)
+    # check every folder again on the next run if one failed
+    if not render_errors:
+        render_cache.record_inputs(signature)
+    return render_errors
+
+
+def write_quarantine(quarantine_file: str, state_index):
+    """list the source files that could not be parsed, grouped by reason"""
+    lines = []
+    for reason, source_file_names in state_index.failed_by_reason().items():
+        lines.append(f"{reason} ({len(source_file_names)})")
+        lines.extend(f"  {source_file_name}" for source_file_name in source_file_names)
+    temp_file = quarantine_file + ".tmp"
+    try:
+        with open(temp_file, "w", encoding="utf-8") as file:
+            file.write("".join(line + "\n" for line in lines))
+        os.replace(temp_file, quarantine_file)
+    except OSError as err:
+        raise SystemExit("ERROR: Can't write quarantine file: ") from err
+
+
+def save_state(settings: dict, state_index):
+    """write the state index, the quarantine file when set, and the render
+    cache manifest. The image caches are pruned when the run rendered"""
+    state_index.save()
+    if settings["quarantine_file"]:
+        write_quarantine(settings["quarantine_file"], state_index)
+    if getattr(settings.get("renderer"), "render_cache", None) is not None:
+        settings["renderer"].render_cache.prune()
+        settings["renderer"].render_cache.save()
+    if "renderer" in settings and settings["layer_cache"]:
+        # pylint: disable=import-outside-toplevel
+        from poster_maker import LayerCache
+
+        LayerCache(settings["layer_cache"]).prune()
+
+
+def optional_path(base_path: str, path: str) -> str:
+    """path within base_path, or empty, turning its feature off, when path
+    is empty or blank"""
+    path = path.strip()
+    return os.path.join(base_path, path) if path else ""
+
+
+def read_config(config: ConfigParser) -> dict:
+    """settings from config.ini, with environment variable overrides. Run
+    state is kept in state_path, a mounted volume, and the image caches in
+    the destination so their images can be hardlinked"""
+    destination_path = os.getenv(
+        "MEDIA_DESTINATION_PATH", config.get("paths", "destination_path")
+    )
+    state_path = os.getenv(
+        "STATE_PATH", config.get("paths", "state_path", fallback="/custom")
+    )
+    settings = {
+        "source_path": os.getenv(
+            "MEDIA_SOURCE_PATH", config.get("paths", "source_path")
+        ),
+        "destination_path": destination_path,
+        "file_prefix": tuple(config.get("config", "file_prefix").split(",")),
+        "file_types": tuple(config.get("config", "file_types").split(",")),
+        "sprint_weekends": config.get("config", "sprint_weekends").split(","),
+        "ignore_pattern": ignore_pattern(
+            config.get(
+                "config",
+                "ignore_paths",
+                fallback=".*,sample,samples,*.part,*.partial,_UNPACK_*,_FAILED_*",
+            ).split(",")
+        ),
+        "copy_files": os.getenv("COPY_FILES", config.get("config", "copy_files"))
+        == "True",  # str -> bool
+        "copy_workers": int(
+            os.getenv(
+                "COPY_WORKERS", config.get("config", "copy_workers", fallback="2")
+            )
+        ),
+        "copy_verify": os.getenv(
+            "COPY_VERIFY", config.get("config", "copy_verify", fallback="False")
+        )
+        == "True",
+        "pipeline_workers": int(
+            os.getenv(
+                "PIPELINE_WORKERS",
+                config.get("config", "pipeline_workers", fallback="0"),
+            )
+        ),
+        "state_index": os.path.join(
+            state_path,
+            config.get("config", "state_index", fallback="state_index.json"),
+        ),
+        "track_path": config.get("paths", "track_path"),
+        "flag_path": config.get("paths", "flag_path"),
+        "image_path": config.get("paths", "image_path"),
+        "render_workers": int(
+            os.getenv(
+                "RENDER_WORKERS", config.get("config", "render_workers", fallback="4")
+            )
+        ),
+        "render_batch": int(
+            os.getenv(
+                "RENDER_BATCH", config.get("config", "render_batch", fallback="0")
+            )
+        ),
+        "render_backend": os.getenv(
+            "RENDER_BACKEND",
+            config.get("config", "render_backend", fallback="imagemagick"),
+        ),
+        "font_path": config.get("paths", "font_path"),
+        "poster_encoding": os.getenv(
+            "POSTER_ENCODING", config.get("config", "poster_encoding", fallback="png")
+        ),
+        "background_encoding": os.getenv(
+            "BACKGROUND_ENCODING",
+            config.get("config", "background_encoding", fallback="jpg"),
+        ),
+        "render_cache": optional_path(
+            destination_path,
+            os.getenv(
+                "RENDER_CACHE",
+                config.get(
+                    "config", "render_cache", fallback=".motorsort/render_cache"
+                ),
+            ),
+        ),
+        "layer_cache": optional_path(
+            destination_path,
+            os.getenv(
+                "LAYER_CACHE",
+                config.get("config", "layer_cache", fallback=".motorsort/layer_cache"),
+            ),
+        ),
+        "watermark": optional_path(
+            state_path,
+            os.getenv(
+                "WATERMARK",
+                config.get("config", "watermark", fallback="watermark.json"),
+            ),
+        ),
+        "quarantine_file": os.getenv(
+            "QUARANTINE_FILE", config.get("config", "quarantine_file", fallback="")
+        ),
+        "metrics_file": os.getenv(
+            "METRICS_FILE", config.get("config", "metrics_file", fallback="")
+        ),
+        "metrics_port": int(
+            os.getenv(
+                "METRICS_PORT", config.get("config", "metrics_port", fallback="0")
+            )
+        ),
+    }
 
-def main():
-    # disable too many local variables - pylint: disable=R0914
-    """Pull configurations, call functions to parse, build images,
-    and link files."""
+    return settings
 
-    if not which("convert"):
-        raise SystemExit("ERROR: Imagemagick convert not found in path.")
 
+def load_settings(compiled: bool = True) -> dict:
+    """read config.ini and the json lookup files into a settings dict, with
+    the lookup tables compiled unless compiled is False. Problems are
+    reported before any file is sorted"""
+    config_path = os.getenv("CONFIG_PATH", "/config")
+    config_file = f"{config_path}/config.ini"
     config = ConfigParser()
-    config.read(f"{os.getenv('CONFIG_PATH', '/config')}/config.ini")
+    if not config.read(config_file):
+        raise SystemExit("ERROR: Unable to read config.ini file: " + config_file)
+    try:
+        settings = read_config(config)
+        json_files = {
+            key: config.get("json", key)
+            for key in ("series_prefix", "weekend_order", "session_map", "fonts")
+        }
+    except (ConfigParserError, ValueError) as err:
+        raise SystemExit(f"ERROR: Bad config.ini: {err}") from err
+
+    # watched for changes by ConfigCache
+    settings["config_files"] = [config_file, *json_files.values()]
+    for key, json_file in json_files.items():
+        try:
+            with open(json_file, "r", encoding="utf-8") as file:
+                settings[key] = json.load(file)
+        except (OSError, ValueError) as err:
+            raise SystemExit(f"ERROR: Can't read {key} file: {json_file}") from err
+
+    problems = validate_settings(settings)
+    if problems:
+        raise SystemExit("ERROR: Bad config: " + ", ".join(problems))
+    return compile_lookups(settings) if compiled else settings
+
+
+def queue_render(race, settings: dict, queues: dict):
+    """create a new destination folder and queue its images"""
+    destination_folder = race.get_destination_folder()
+    get_renderer(settings)
+    # create the folder now so linking does not wait on the render
     try:
-        source_path = os.getenv("MEDIA_SOURCE_PATH", config.get("paths", "source_path"))
+        os.makedirs(destination_folder, exist_ok=True)
     except OSError as err:
-        raise SystemExit("ERROR: Unable to read config.ini file: ") from err
+        raise SystemExit("ERROR: Can't create path: ") from err
+    DESTINATION_INDEX.add(destination_folder)
+    queues["renders"][destination_folder] = queues["render_pool"].submit(
+        render_folder, race, settings
+    )
 
-    file_prefix = tuple(config.get("config", "file_prefix").split(","))
-    file_types = tuple(config.get("config", "file_types").split(","))
-    spnt_weekends = config.get("config", "sprint_weekends").split(",")
 
-    with open(config.get("json", "series_prefix"), "r", encoding="utf-8") as file:
-        series_prefix = json.load(file)
-    with open(config.get("json", "weekend_order"), "r", encoding="utf-8") as file:
-        the_weekend_order = json.load(file)
-    with open(config.get("json", "session_map"), "r", encoding="utf-8") as file:
-        session_map = json.load(file)
-    with open(config.get("json", "fonts"), "r", encoding="utf-8") as file:
-        font_list = json.load(file)
+def stat_source_file(source_file_name: str):
+    """returns the stat of a source file, or None if it can't be read"""
+    METRICS.count("files_seen")
+    try:
+        return os.stat(source_file_name)
+    except OSError:
+        print(f"ERROR: Can't read file, skipping: {source_file_name}")
+        METRICS.count("files_failed")
+        return None
+
+
+def parse_source_file(
+    source_file_name, source_stat, settings, sprint_weekends, state_index
+):
+    # disable too many arguments - pylint: disable=R0913,R0917
+    """parse a new or changed source file, returns the race, or None to skip
+    the file"""
+    if source_stat is None:
+        return None
+
+    # already sorted and unchanged, skip without parsing
+    if state_index.is_current(source_file_name, source_stat):
+        METRICS.count("files_skipped")
+        return None
+    # failed before and unchanged, skip without parsing or logging again
+    if state_index.is_failed(source_file_name, source_stat, settings["lookup_version"]):
+        METRICS.count("files_quarantined")
+        return None
+
+    race = Weekend(settings["destination_path"])
+    try:
+        with METRICS.timer("parse"):
+            parse_race(race, settings, sprint_weekends, source_file_name)
+    except (ValueError, KeyError) as err:
+        print(f"ERROR: Can't parse file, skipping: {source_file_name}")
+        METRICS.count("files_failed")
+        state_index.record_failure(
+            source_file_name,
+            source_stat,
+            settings["lookup_version"],
+            race,
+            parse_error(err),
+        )
+        return None
+    METRICS.count("files_parsed")
+    return race
+
+
+def queue_copy(race, source_file_name: str, source_stat, settings, queues: dict):
+    # disable too many arguments - pylint: disable=R0913,R0917
+    """queue a copy, the file is recorded in the state index once it finishes"""
+    weekend = (race.get_kv("race_season"), race.get_kv("race_round"))
+    queues["copies"][race.get_destination_full_path()] = (
+        queues["copy_pool"].submit(
+            link_files, race, source_file_name, True, settings["copy_verify"]
+        ),
+        source_file_name,
+        source_stat,
+        race,
+        # checked again when the copy finishes, a sprint may be found meanwhile
+        None if weekend in queues["sprint_weekends"] else weekend,
+    )
+
+
+def plan_destination(race, settings: dict, queues: dict) -> str:
+    """choose the destination folder, creating it and queueing its images if
+    it is new. Returns the folder"""
+    with METRICS.timer("destination"):
+        destination_folder = race.get_destination_folder()
+    if destination_folder not in queues["renders"] and not os.path.exists(
+        destination_folder
+    ):
+        queue_render(race, settings, queues)
+    return destination_folder
+
+
+def sort_file(source_file_name: str, settings: dict, state_index, queues: dict):
+    """parse a source file, queue images for a new destination folder, and
+    link or queue a copy of the file"""
+    # print(f"> Source file name: {source_file_name}")
+    source_stat = stat_source_file(source_file_name)
+    race = parse_source_file(
+        source_file_name, source_stat, settings, queues["sprint_weekends"], state_index
+    )
+    if race is None:
+        return
+    plan_destination(race, settings, queues)
+
+    # sorted before under another name, e.g. now a sprint weekend
+    entry = state_index.get_entry(source_file_name)
+    destination = race.get_destination_full_path()
+    if entry and entry["destination"] != destination:
+        move_sorted_file(entry["destination"], destination)
+
+    if destination in queues["copies"] or os.path.exists(destination):
+        state_index.record(source_file_name, source_stat, race)
+    elif settings["copy_files"]:
+        queue_copy(race, source_file_name, source_stat, settings, queues)
+    else:
+        link_files(race, source_file_name, False)
+        state_index.record(source_file_name, source_stat, race)
+
+
+def process_files(source_batches, settings, state_index) -> list:
+    """parse, build images, and link each new or changed source file, one
+    batch at a time. Sprint weekends are updated from each batch before it
+    is parsed. Images render and copies run in worker pools while linking
+    continues, returns render and copy errors"""
+    # list the destination again, folders may have changed since the last run
+    DESTINATION_INDEX.clear()
+    ASSET_INDEX.refresh()
+    with ThreadPoolExecutor(
+        max_workers=max(settings["render_workers"], 1)
+    ) as render_pool, ThreadPoolExecutor(
+        max_workers=max(settings["copy_workers"], 1)
+    ) as copy_pool:
+        queues = {
+            "render_pool": render_pool,
+            "renders": {},
+            "copy_pool": copy_pool,
+            "copies": {},
+            "sprint_weekends": set(),
+        }
+        for source_batch in source_batches:
+            with METRICS.timer("sprint_weekends"):
+                queues["sprint_weekends"], resort = update_sprint_weekends(
+                    source_batch, settings, state_index
+                )
+            for source_file_name in sorted(set(source_batch).union(resort)):
+                sort_file(source_file_name, settings, state_index, queues)
 
-    source_file_names = get_file_list(source_path, file_prefix, file_types)
-    sprint_weekends = find_sprint_weekends(source_file_names, spnt_weekends)
+        return wait_for_renders(queues["renders"]) + wait_for_copies(
+            queues["copies"], state_index, queues["sprint_weekends"]
+        )
 
-    # main loop
-    for source_file_name in source_file_names:
-        # print(f"> Source file name: {source_file_name}")
-        race = Weekend(
-            os.getenv("MEDIA_DESTINATION_PATH", config.get("paths", "destination_path"))
+
+def read_ahead(items, size: int):
+    """yield items produced by a background thread through a bounded queue"""
+    buffer = queue.Queue(maxsize=max(size, 1))
+    done = object()
+
+    def produce():
+        try:
+            for item in items:
+                buffer.put(item)
+        except BaseException as err:  # pylint: disable=broad-exception-caught
+            buffer.put(err)
+        buffer.put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item = buffer.get()
+        if item is done:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+def write_folder(destination_folder: str, planned: list, settings: dict) -> tuple:
+    """link or copy the files planned for one destination folder in order,
+    so each folder has a single writer. Returns the planned files written and
+    an error, or None"""
+    written = []
+    try:
+        for race, source_file_name, source_stat, old_destination in planned:
+            destination = race.get_destination_full_path()
+            if old_destination and old_destination != destination:
+                move_sorted_file(old_destination, destination)
+            if not os.path.exists(destination):
+                link_files(
+                    race,
+                    source_file_name,
+                    settings["copy_files"],
+                    settings["copy_verify"],
+                )
+            written.append((race, source_file_name, source_stat, old_destination))
+    except SystemExit as err:
+        return written, (
+            f"ERROR: Can't sort into {os.path.basename(destination_folder)}:"
+            f" {err} {err.__cause__ or ''}".rstrip()
+        )
+    return written, None
+
+
+def plan_batch(source_files, settings: dict, state_index, queues: dict) -> dict:
+    """parse (name, stat) pairs and choose their destinations in order.
+    Returns the files to write grouped by destination folder"""
+    folders = {}
+    for source_file_name, source_stat in source_files:
+        race = parse_source_file(
+            source_file_name,
+            source_stat,
+            settings,
+            queues["sprint_weekends"],
+            state_index,
+        )
+        if race is None:
+            continue
+        destination_folder = plan_destination(race, settings, queues)
+        entry = state_index.get_entry(source_file_name)
+        folders.setdefault(destination_folder, []).append(
+            (race, source_file_name, source_stat, entry and entry["destination"])
         )
+    return folders
+
+
+def write_batch(folders: dict, settings: dict, state_index, io_pool) -> list:
+    """write each destination folder on a worker and record what was written.
+    Returns sort errors"""
+    writers = [
+        io_pool.submit(write_folder, destination_folder, planned, settings)
+        for destination_folder, planned in folders.items()
+    ]
+    # record the batch before the next one updates sprint weekends
+    return record_written([writer.result() for writer in writers], state_index)
+
+
+def record_written(results: list, state_index) -> list:
+    """record the files write_folder wrote in the state index, returns its
+    errors"""
+    errors = []
+    for written, error in results:
+        for race, source_file_name, source_stat, _ in written:
+            state_index.record(source_file_name, source_stat, race)
+        if error:
+            print(error)
+            errors.append(error)
+    return errors
+
+
+def process_files_pipelined(source_batches, settings, state_index) -> list:
+    """process_files with file i/o spread over pipeline_workers threads. The
+    walk reads ahead through a bounded queue and each batch is stat'ed in
+    parallel. Parsing and folder selection stay in this thread so names are
+    the same as a sequential run, then each destination folder is written by
+    one worker. Returns render and sort errors"""
+    DESTINATION_INDEX.clear()
+    ASSET_INDEX.refresh()
+    errors = []
+    with ThreadPoolExecutor(
+        max_workers=max(settings["render_workers"], 1)
+    ) as render_pool, ThreadPoolExecutor(
+        max_workers=max(settings["pipeline_workers"], 1)
+    ) as io_pool:
+        queues = {"render_pool": render_pool, "renders": {}, "sprint_weekends": set()}
+        for source_batch in read_ahead(source_batches, settings["pipeline_workers"]):
+            with METRICS.timer("sprint_weekends"):
+                queues["sprint_weekends"], resort = update_sprint_weekends(
+                    source_batch, settings, state_index
+                )
+            source_file_names = sorted(set(source_batch).union(resort))
+            folders = plan_batch(
+                zip(
+                    source_file_names, io_pool.map(stat_source_file, source_file_names)
+                ),
+                settings,
+                state_index,
+                queues,
+            )
+            errors += write_batch(folders, settings, state_index, io_pool)
+
+        return errors + wait_for_renders(queues["renders"])
 
-        file_name_path, file_extension = os.path.splitext(source_file_name)
-        race.set_kv("file_extension", file_extension)
-        race.set_kv("race_info", os.path.basename(file_name_path))
 
-        # print(source_file_name)
+def sort_source_path(settings, state_index) -> list:
+    """sort every file under the source path as each directory is read,
+    returns any render or copy errors"""
+    source_file_names = []
+
+    def source_batches():
+        batches = walk_source_path(settings)
+        while True:
+            with METRICS.timer("walk"):
+                source_batch = next(batches, None)
+            if source_batch is None:
+                return
+            source_file_names.extend(source_batch)
+            yield source_batch
+
+    if settings["pipeline_workers"] > 0:
+        errors = process_files_pipelined(source_batches(), settings, state_index)
+    else:
+        errors = process_files(source_batches(), settings, state_index)
+    state_index.prune(source_file_names)
+    with METRICS.timer("refresh_images"):
+        errors += refresh_images(settings, state_index)
 
-        find_race_year(race)
-        find_race_series(race, series_prefix)
-        find_race_round(race)
-        find_race_session(race, session_map)
+    save_state(settings, state_index)
 
+    return errors
+
+
+def start_metrics(settings: dict):
+    """serve metrics over http when a metrics port is set"""
+    if settings["metrics_port"]:
         try:
-            find_weekend_order(race, sprint_weekends, the_weekend_order)
-        except ValueError:
-            print(f"ERROR: Can't parse file, skipping: {source_file_name}")
-            continue
+            serve_metrics(settings["metrics_port"])
+        except OSError as err:
+            raise SystemExit("ERROR: Can't serve metrics: ") from err
 
-        filename = race.get_kv("race_name")
-        # print(f">>>> filename: {filename}")
-        if race.get_kv("race_series") == "Formula 1":
-            race.set_kv("race_name", filename.replace("Usa", "", 1))
-        if race.get_kv("race_series") == "World Endurance Championship":
-            race.set_kv("race_name", filename.replace("France", "", 1))
-
-        if not os.path.exists(race.get_destination_folder()):
-            build_images(
-                race,
-                font_list,
-                config.get("paths", "track_path"),
-                config.get("paths", "flag_path"),
-                config.get("paths", "image_path"),
-            )
 
-        if not os.path.exists(race.get_destination_full_path()):
-            link_files(
-                race,
-                source_file_name,
-                os.getenv("COPY_FILES", config.get("config", "copy_files"))
-                == "True",  # str -> bool
-            )
+def report_metrics(settings: dict):
+    """print the run summary and write the metrics file when set"""
+    print(METRICS.summary())
+    if settings["metrics_file"]:
+        METRICS.write_prometheus(settings["metrics_file"])
+
+
+def main():
+    """Pull configurations, call functions to parse, build images,
+    and link files."""
+
+    settings = load_settings(compiled=False)
+    # nothing new since the last run, exit before the lookups are compiled
+    # or the state index is read
+    watermark = Watermark(settings["watermark"]) if settings["watermark"] else None
+    if watermark and watermark.check(settings):
+        print("No changes since the last run.")
+        return 0
+
+    compile_lookups(settings)
+    start_metrics(settings)
+    state_index = StateIndex(settings["state_index"]).load()
+    with METRICS.timer("run"):
+        errors = sort_source_path(settings, state_index)
+    report_metrics(settings)
+    if watermark:
+        watermark.update(settings, state_index, errors)
+    if errors:
+        raise SystemExit(f"ERROR: {len(errors)} image renders or copies failed.")
 
     return 0
 
@@ -0,0 +1,161 @@
+#!/usr/bin/python
+"""motorsort orchestrator.py, sort the source path on an asyncio event loop"""
+
+import asyncio
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from motorsort import (
+    load_settings,
+    walk_source_path,
+    update_sprint_weekends,
+    stat_source_file,
+    plan_batch,
+    write_folder,
+    record_written,
+    wait_for_renders,
+    refresh_images,
+    save_state,
+    get_renderer,
+)
+from poster_maker import ImageMagickRenderer, with_layers, require_convert
+from weekend import DESTINATION_INDEX
+from state_index import StateIndex
+from metrics import METRICS
+from asset_index import ASSET_INDEX
+
+
+class AsyncImageMagickRenderer(ImageMagickRenderer):
+    """run imagemagick convert as an asyncio subprocess. render() may be
+    called from any thread, the subprocess is started on the event loop and
+    at most render_workers run at the same time"""
+
+    def __init__(self, loop, render_workers: int):
+        self.loop = loop
+        self.semaphore = asyncio.Semaphore(max(render_workers, 1))
+
+    async def render_async(self, spec: dict):
+        """write the image described by spec"""
+        cmd = self.command(spec)
+        async with self.semaphore:
+            process = await asyncio.create_subprocess_exec(
+                *cmd, stdout=asyncio.subprocess.DEVNULL
+            )
+            returncode = await process.wait()
+        if returncode:
+            raise SystemExit("ERROR Imagemagic exit code: ") from (
+                subprocess.CalledProcessError(returncode, cmd)
+            )
+
+    def render(self, spec: dict):
+        """write the image described by spec, blocks the calling thread"""
+        asyncio.run_coroutine_threadsafe(self.render_async(spec), self.loop).result()
+
+
+def use_async_renderer(settings: dict, loop):
+    """render with asyncio subprocesses when the backend is imagemagick.
+    Batched renders share one convert command, they keep the thread pool
+    renderer"""
+    if settings["render_backend"] != ImageMagickRenderer.name:
+        return
+    require_convert()
+    if settings["render_batch"] > 1:
+        return
+    renderer = with_layers(
+        AsyncImageMagickRenderer(loop, settings["render_workers"]),
+        settings["layer_cache"],
+    )
+    if settings["render_cache"]:
+        get_renderer(settings).backend_renderer = renderer
+    else:
+        settings["renderer"] = renderer
+
+
+def next_batch(batches):
+    """read the next source directory, None when the walk is done"""
+    with METRICS.timer("walk"):
+        return next(batches, None)
+
+
+async def sort_batches(settings: dict, state_index, queues: dict, io_pool) -> tuple:
+    """sort each source directory while the next one is read. Returns the
+    source files seen and any sort errors"""
+    loop = asyncio.get_running_loop()
+    batches = walk_source_path(settings)
+    source_file_names = []
+    errors = []
+    reading = loop.run_in_executor(io_pool, next_batch, batches)
+    while (source_batch := await reading) is not None:
+        reading = loop.run_in_executor(io_pool, next_batch, batches)
+        source_file_names.extend(source_batch)
+
+        # both read the destination, keep the event loop free
+        with METRICS.timer("sprint_weekends"):
+            queues["sprint_weekends"], resort = await loop.run_in_executor(
+                io_pool, update_sprint_weekends, source_batch, settings, state_index
+            )
+        names = sorted(set(source_batch).union(resort))
+        stats = await asyncio.gather(
+            *(loop.run_in_executor(io_pool, stat_source_file, name) for name in names)
+        )
+        folders = await loop.run_in_executor(
+            io_pool, plan_batch, list(zip(names, stats)), settings, state_index, queues
+        )
+        # one writer per destination folder, recorded before the next batch
+        results = await asyncio.gather(
+            *(
+                loop.run_in_executor(io_pool, write_folder, folder, planned, settings)
+                for folder, planned in folders.items()
+            )
+        )
+        errors += record_written(results, state_index)
+    return source_file_names, errors
+
+
+async def run_once(config: dict = None) -> list:
+    """sort the source path once. Renders run as asyncio subprocesses and
+    file i/o on a thread pool, overlapped with reading the next directory.
+    config is a settings dict from load_settings(), read from config.ini and
+    the environment if None. Returns render and sort errors, an error that
+    stops the sort, e.g. a bad config, is returned instead of exiting"""
+    try:
+        return await sort_once(config)
+    except SystemExit as err:
+        error = f"{err} {err.__cause__ or ''}".rstrip()
+        print(error)
+        return [error]
+
+
+async def sort_once(config: dict = None) -> list:
+    """run_once, an error that stops the sort raises SystemExit"""
+    loop = asyncio.get_running_loop()
+    settings = dict(config or await loop.run_in_executor(None, load_settings))
+    # the renderer is made for this event loop
+    settings.pop("renderer", None)
+    use_async_renderer(settings, loop)
+    state_index = await loop.run_in_executor(
+        None, StateIndex(settings["state_index"]).load
+    )
+
+    DESTINATION_INDEX.clear()
+    await loop.run_in_executor(None, ASSET_INDEX.refresh)
+    with ThreadPoolExecutor(
+        max_workers=max(settings["render_workers"], 1)
+    ) as render_pool, ThreadPoolExecutor(
+        max_workers=max(settings["pipeline_workers"], settings["copy_workers"], 1)
+    ) as io_pool:
+        queues = {"render_pool": render_pool, "renders": {}, "sprint_weekends": set()}
+        source_file_names, errors = await sort_batches(
+            settings, state_index, queues, io_pool
+        )
+        renders = [asyncio.wrap_future(render) for render in queues["renders"].values()]
+        if renders:
+            await asyncio.wait(renders)
+        errors += wait_for_renders(queues["renders"])
+
+    state_index.prune(source_file_names)
+    with METRICS.timer("refresh_images"):
+        errors += await loop.run_in_executor(
+            None, refresh_images, settings, state_index
+        )
+    await loop.run_in_executor(None, save_state, settings, state_index)
+    return errors
@@ -0,0 +1,144 @@
+#!/usr/bin/python
+"""classify file names into a source to destination plan without touching
+the filesystem"""
+
+import sys
+import csv
+import json
+import argparse
+from typing import NamedTuple
+from motorsort import (
+    load_settings,
+    get_file_list,
+    find_sprint_weekends,
+    parse_race,
+    parse_error,
+)
+from weekend import Weekend, DestinationIndex
+
+
+class ParsedRace(NamedTuple):
+    """one classified file name"""
+
+    source: str
+    race_series: str
+    race_season: str
+    race_round: str
+    race_name: str
+    race_session: str
+    race_info: str
+    weekend_order: str
+    file_extension: str
+    final_file_name: str
+    destination_folder: str
+    destination: str
+    error: str
+
+
+def parse_name(name: str, settings: dict, sprint_weekends, destination_index):
+    """classify a single file name, errors are returned in the error field"""
+    race = Weekend(settings["destination_path"], destination_index)
+    try:
+        parse_race(race, settings, sprint_weekends, name)
+    except (ValueError, KeyError) as err:
+        error = parse_error(err)
+    else:
+        destination_folder = race.get_destination_folder()
+        # later files for the same season-round use this folder, as in a run
+        destination_index.add(destination_folder)
+        return ParsedRace(
+            name,
+            *(race.get_kv(key) for key in ParsedRace._fields[1:9]),
+            race.get_final_file_name(),
+            destination_folder,
+            race.get_destination_full_path(),
+            "",
+        )
+
+    return ParsedRace(
+        name,
+        *(getattr(race, key) or "" for key in ParsedRace._fields[1:9]),
+        "",
+        "",
+        "",
+        error,
+    )
+
+
+def iter_plan(names, settings: dict, sprint_weekends=None, destination_index=None):
+    """yield a ParsedRace for each name. Sprint weekends are found from the
+    names themselves unless given. The destination is not read unless a
+    destination index is given."""
+    if sprint_weekends is None:
+        sprint_weekends = find_sprint_weekends(names, settings["sprint_weekends"])
+    if destination_index is None:
+        destination_index = DestinationIndex(read_destination=False)
+    for name in names:
+        yield parse_name(name, settings, sprint_weekends, destination_index)
+
+
+def parse_many(names, settings: dict, sprint_weekends=None) -> list:
+    """classify a batch of file names, returns a list of ParsedRace"""
+    names = list(names)
+    return list(iter_plan(names, settings, sprint_weekends))
+
+
+def read_names(plan_file: str) -> list:
+    """file names, one per line, from a file or - for stdin"""
+    if plan_file == "-":
+        return [line.rstrip("\n") for line in sys.stdin if line.strip()]
+    try:
+        with open(plan_file, "r", encoding="utf-8") as file:
+            return [line.rstrip("\n") for line in file if line.strip()]
+    except OSError as err:
+        raise SystemExit("ERROR: Can't read plan file: " + plan_file) from err
+
+
+def write_plan(plan, output, output_format: str) -> int:
+    """write plan rows as json lines or csv, returns the number of rows"""
+    count = 0
+    if output_format == "csv":
+        writer = csv.writer(output)
+        writer.writerow(ParsedRace._fields)
+        for count, parsed_race in enumerate(plan, 1):
+            writer.writerow(parsed_race)
+    else:
+        for count, parsed_race in enumerate(plan, 1):
+            output.write(json.dumps(parsed_race._asdict()) + "\n")
+    return count
+
+
+def main(argv=None):
+    """print the plan for a list of names, or for the source path"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
+        "--plan",
+        metavar="FILE",
+        help="classify the file names in FILE, one per line, - for stdin",
+    )
+    source.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="classify the files under the source path without linking",
+    )
+    parser.add_argument("--format", choices=("jsonl", "csv"), default="jsonl")
+    args = parser.parse_args(argv)
+
+    settings = load_settings()
+    if args.plan:
+        names = read_names(args.plan)
+    else:
+        names = get_file_list(
+            settings["source_path"],
+            settings["file_prefix"],
+            settings["file_types"],
+            settings["ignore_pattern"],
+        )
+
+    write_plan(iter_plan(names, settings), sys.stdout, args.format)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
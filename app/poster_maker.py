@@ -2,21 +2,665 @@
 """builds poster using imagemagic"""
 
 import os
+import re
+import json
+import math
+import hashlib
+import time
+import threading
 import subprocess
+from shutil import which
+from concurrent.futures import Future, wait
+from metrics import METRICS
+from asset_index import ASSET_INDEX
+from image_encoding import (
+    POSTER_ENCODING,
+    BACKGROUND_ENCODING,
+    image_file_name,
+    spec_encoding,
+    convert_options,
+    pillow_save_options,
+    remove_other_formats,
+)
+
+# Pillow, imported by load_pillow when a pillow renderer is made
+# pylint: disable-next=invalid-name
+Image = ImageChops = ImageColor = ImageDraw = ImageFilter = ImageFont = None
+
+
+def load_pillow() -> bool:
+    """import Pillow on first use, only the pillow renderer needs it.
+    Returns False if it is not installed"""
+    # pylint: disable=global-statement,import-outside-toplevel,invalid-name
+    global Image, ImageChops, ImageColor, ImageDraw, ImageFilter, ImageFont
+    if Image is None:
+        try:
+            from PIL import (
+                Image,
+                ImageChops,
+                ImageColor,
+                ImageDraw,
+                ImageFilter,
+                ImageFont,
+            )
+        except ImportError:
+            return False
+    return True
+
+
+def file_fingerprint(path: str) -> list:
+    """path, size and mtime of an input file, a missing file is None"""
+    try:
+        input_stat = os.stat(path)
+    except OSError:
+        return [path, None]
+    return [path, input_stat.st_size, input_stat.st_mtime_ns]
+
+
+def stored_files(cache_path: str, extensions) -> list:
+    """key and path of each file in a cache's own layout, a key-named file
+    in the shard directory of its first two characters, with an extension
+    matching one of the extensions patterns. Anything else in cache_path is
+    not the cache's to remove"""
+    pattern = re.compile(r"([0-9a-f]{32})\.(" + "|".join(extensions) + ")")
+    files = []
+    try:
+        shards = [
+            entry.path
+            for entry in os.scandir(cache_path)
+            if entry.is_dir(follow_symlinks=False)
+            and re.fullmatch(r"[0-9a-f]{2}", entry.name)
+        ]
+    except OSError:
+        return files
+    for shard in shards:
+        try:
+            with os.scandir(shard) as entries:
+                for entry in entries:
+                    match = pattern.fullmatch(entry.name)
+                    if (
+                        match
+                        and match.group(1)[:2] == os.path.basename(shard)
+                        and entry.is_file(follow_symlinks=False)
+                    ):
+                        files.append((match.group(1), entry.path))
+        except OSError:
+            continue
+    return files
 
 
 if __name__ == "__main__":
     print("Designed to be called by motorsort")
 
 
-def create_background_image(race, font_name, image_path):
+class ImageMagickRenderer:
+    """render image specs by running imagemagick convert"""
+
+    name = "imagemagick"
+
+    @staticmethod
+    def operations(spec: dict, registered=None) -> list:
+        """convert arguments that read and draw the image described by spec.
+        Input files in registered are read from the name they map to"""
+        registered = registered or {}
+        cmd = [registered.get(spec["base_image"], spec["base_image"])]
+
+        # a layer from the layer cache is already resized
+        if spec["size"]:
+            width, height = spec["size"]
+            cmd.extend(["-resize", f"{width}x{height}!"])
+
+        if spec["blur"]:
+            cmd.extend(["-blur", spec["blur"]])
+
+        for overlay in spec["overlays"]:
+            cmd.extend(
+                [
+                    registered.get(overlay["image"], overlay["image"]),
+                    "-compose",
+                    "Src_Over",
+                    "-gravity",
+                    overlay["gravity"],
+                    "-geometry",
+                    overlay["geometry"],
+                    "-background",
+                    "None",
+                    "-composite",
+                ]
+            )
+
+        for annotation in spec["annotations"]:
+            cmd.extend(
+                [
+                    "-gravity",
+                    annotation["gravity"],
+                    "-font",
+                    annotation["font"],
+                    "-pointsize",
+                    annotation["pointsize"],
+                ]
+            )
+            if annotation.get("interline_spacing"):
+                cmd.extend(["-interline-spacing", annotation["interline_spacing"]])
+            cmd.extend(
+                [
+                    "-fill",
+                    annotation["fill"],
+                    "-stroke",
+                    annotation["stroke"],
+                    "-strokewidth",
+                    annotation["strokewidth"],
+                    "-annotate",
+                    annotation["offset"],
+                    annotation["text"],
+                ]
+            )
+
+        return cmd
+
+    @staticmethod
+    def command(spec: dict) -> list:
+        """build the imagemagick convert command for an image spec"""
+        return [
+            "convert",
+            *ImageMagickRenderer.operations(spec),
+            *convert_options(spec),
+            spec["destination"],
+        ]
+
+    def render(self, spec: dict):
+        """write the image described by spec"""
+        try:
+            subprocess.check_output(self.command(spec))
+        except subprocess.CalledProcessError as err:
+            raise SystemExit("ERROR Imagemagic exit code: ") from err
+
+
+class BatchImageMagickRenderer(ImageMagickRenderer):
+    """render image specs queued by every render worker with one convert
+    command per batch. Input files used by more than one spec in a batch,
+    e.g. a season background, are decoded once and read from memory. If a
+    batch fails its specs are rendered one at a time, so each error is
+    reported for the image that caused it"""
+
+    def __init__(self, batch_size: int, batch_wait: float = 0.1):
+        self.batch_size = batch_size
+        # seconds a partial batch waits for more specs
+        self.batch_wait = batch_wait
+        self.lock = threading.Lock()
+        self.pending = []
+
+    @staticmethod
+    def batch_command(specs: list) -> list:
+        """build one convert command that writes every spec. Drawing
+        settings are kept inside each spec's parentheses, encoding settings
+        follow them so they apply to its -write"""
+        if len(specs) == 1:
+            return ImageMagickRenderer.command(specs[0])
+        uses = {}
+        for spec in specs:
+            for image in [spec["base_image"]] + [
+                overlay["image"] for overlay in spec["overlays"]
+            ]:
+                uses[image] = uses.get(image, 0) + 1
+
+        cmd = ["convert", "-respect-parentheses"]
+        registered = {}
+        for image, count in uses.items():
+            if count > 1:
+                registered[image] = f"mpr:input{len(registered)}"
+                cmd.extend([image, "-write", registered[image], "+delete"])
+
+        # reset encoding settings between specs only if one sets them
+        reset = any(spec.get("encoding") for spec in specs)
+        for number, spec in enumerate(specs, 1):
+            cmd.extend(["(", *ImageMagickRenderer.operations(spec, registered), ")"])
+            cmd.extend(convert_options(spec, reset))
+            if number < len(specs):
+                cmd.extend(["-write", spec["destination"], "+delete"])
+        cmd.append(specs[-1]["destination"])
+        return cmd
+
+    def take_batch(self) -> list:
+        """the pending specs, up to batch_size. Call with the lock held"""
+        batch = self.pending[: self.batch_size]
+        del self.pending[: self.batch_size]
+        return batch
+
+    def run_batch(self, batch: list):
+        """render a batch, then set the result of each spec"""
+        try:
+            subprocess.check_output(
+                self.batch_command([spec for spec, _ in batch]),
+                stderr=subprocess.STDOUT,
+            )
+        except (subprocess.CalledProcessError, OSError):
+            METRICS.count("render_batches_failed")
+            for spec, rendered in batch:
+                try:
+                    ImageMagickRenderer.render(self, spec)
+                # any error, e.g. OSError, must reach the waiting worker
+                except BaseException as err:  # pylint: disable=broad-exception-caught
+                    rendered.set_exception(err)
+                else:
+                    rendered.set_result(None)
+            return
+        METRICS.count("render_batches")
+        for _, rendered in batch:
+            rendered.set_result(None)
+
+    def render(self, spec: dict):
+        """queue spec and wait for the batch it is rendered in. The worker
+        that fills a batch, or finds its spec still queued after
+        batch_wait, runs the batch"""
+        rendered = Future()
+        with self.lock:
+            self.pending.append((spec, rendered))
+            batch = self.take_batch() if len(self.pending) >= self.batch_size else None
+        if batch is None and not wait([rendered], self.batch_wait).done:
+            with self.lock:
+                if any(queued is rendered for _, queued in self.pending):
+                    batch = self.take_batch()
+        if batch:
+            self.run_batch(batch)
+        rendered.result()
+
+
+class FontFiles:
+    """the font files under a font path by fontconfig style name, e.g.
+    Titillium-Web-Bold, read on first use. Reading names needs Pillow"""
+
+    def __init__(self, font_path):
+        self.font_path = font_path
+        self.lock = threading.Lock()
+        self.files = None
+
+    def all_files(self) -> list:
+        """every font file under the font path"""
+        return sorted(
+            os.path.join(root, file)
+            for root, _, files in os.walk(self.font_path)
+            for file in files
+            if file.lower().endswith((".ttf", ".otf"))
+        )
+
+    def find(self, font_name: str):
+        """returns the font file for a name, None if there is none"""
+        with self.lock:
+            if self.files is None:
+                self.files = {}
+                for font_file in self.all_files() if load_pillow() else []:
+                    try:
+                        family, style = ImageFont.truetype(font_file).getname()
+                    except OSError:
+                        continue
+                    full_name = f"{family}-{style}".replace(" ", "-")
+                    self.files.setdefault(full_name.lower(), font_file)
+        return self.files.get(font_name.lower())
+
+
+class PillowRenderer:
+    """render image specs in process with Pillow. Base images, overlays and
+    fonts are decoded once and kept in memory for the following renders."""
+
+    name = "pillow"
+
+    def __init__(self, font_path):
+        if not load_pillow():
+            raise SystemExit("ERROR: Pillow not installed, can't use pillow renderer.")
+        self.font_path = font_path
+        self.lock = threading.Lock()
+        self.images = {}
+        self.fonts = {}
+        self.font_files = FontFiles(font_path)
+
+    def load_image(self, path, size=None, blur=None):
+        """returns a decoded, resized and blurred image, shared between renders"""
+        key = (path, os.stat(path).st_mtime_ns, size, blur)
+        with self.lock:
+            if key not in self.images:
+                with Image.open(path) as source:
+                    image = source.convert("RGBA")
+                if size:
+                    image = image.resize(size, Image.Resampling.LANCZOS)
+                if blur:
+                    sigma = float(blur.split("x")[-1])
+                    image = image.filter(ImageFilter.GaussianBlur(sigma))
+                self.images[key] = image
+            return self.images[key]
+
+    def clear(self):
+        """drop the decoded images, e.g. between renders that share none"""
+        with self.lock:
+            self.images.clear()
+
+    def find_font_file(self, font_name: str) -> str:
+        """map a fontconfig style name, e.g. Titillium-Web-Bold, to a font file"""
+        font_file = self.font_files.find(font_name)
+        if font_file is None:
+            raise SystemExit(f"ERROR: Can't find font: {font_name}")
+        return font_file
+
+    def load_font(self, font_name: str, size: int):
+        """returns a loaded font at a pixel size, shared between renders"""
+        key = (font_name, size)
+        if key not in self.fonts:
+            font = ImageFont.truetype(self.find_font_file(font_name), size)
+            with self.lock:
+                self.fonts.setdefault(key, font)
+        return self.fonts[key]
+
+    def render(self, spec: dict):
+        """write the image described by spec"""
+        try:
+            image = self.load_image(
+                spec["base_image"], spec["size"] and tuple(spec["size"]), spec["blur"]
+            ).copy()
+
+            for overlay in spec["overlays"]:
+                layer = self.load_image(overlay["image"])
+                position = gravity_position(
+                    overlay["gravity"], image.size, layer.size, overlay["geometry"]
+                )
+                image.alpha_composite(layer, dest=clip_position(position))
+
+            for annotation in spec["annotations"]:
+                self.annotate(image, annotation)
+
+            image.convert("RGB").save(spec["destination"], **pillow_save_options(spec))
+        except OSError as err:
+            raise SystemExit("ERROR Pillow can't render image: ") from err
+
+    def annotate(self, image, annotation: dict):
+        """draw text the way imagemagick -annotate does, with the stroke
+        centered on the glyph outline"""
+        font = self.load_font(annotation["font"], int(annotation["pointsize"]))
+        anchor, xy, align = text_anchor(
+            annotation["gravity"], image.size, annotation["offset"]
+        )
+        ascent, descent = font.getmetrics()
+        line_height = ascent + descent + int(annotation.get("interline_spacing", 0))
+
+        def text_mask(stroke_width):
+            mask = Image.new("L", image.size, 0)
+            ImageDraw.Draw(mask).multiline_text(
+                xy,
+                annotation["text"],
+                fill=255,
+                font=font,
+                anchor=anchor,
+                align=align,
+                spacing=line_height
+                - font.getbbox("A", stroke_width=stroke_width)[3]
+                - stroke_width,
+                stroke_width=stroke_width,
+                stroke_fill=255,
+            )
+            return mask
+
+        glyphs = text_mask(0)
+        if annotation["fill"] != "none":
+            image.paste(ImageColor.getrgb(annotation["fill"]), mask=glyphs)
+
+        stroke_width = int(annotation["strokewidth"])
+        if annotation["stroke"] != "none" and stroke_width > 0:
+            outer = text_mask(math.ceil(stroke_width / 2))
+            inner = erode(glyphs, stroke_width // 2)
+            image.paste(
+                ImageColor.getrgb(annotation["stroke"]),
+                mask=ImageChops.subtract(outer, inner),
+            )
+
+
+def parse_geometry(geometry: str) -> tuple:
+    """split an imagemagick offset such as +10-20 into integers"""
+    offsets = re.fullmatch(r"([+-]\d+)([+-]\d+)", geometry)
+    return int(offsets.group(1)), int(offsets.group(2))
+
+
+def gravity_position(gravity: str, canvas_size, item_size, geometry: str) -> tuple:
+    """top left corner of an item placed with imagemagick gravity and geometry"""
+    x_offset, y_offset = parse_geometry(geometry)
+    free_width = canvas_size[0] - item_size[0]
+    free_height = canvas_size[1] - item_size[1]
+    return {
+        "NorthWest": (x_offset, y_offset),
+        "NorthEast": (free_width - x_offset, y_offset),
+        "SouthWest": (x_offset, free_height - y_offset),
+        "SouthEast": (free_width - x_offset, free_height - y_offset),
+        "Center": (free_width // 2 + x_offset, free_height // 2 + y_offset),
+    }[gravity]
+
+
+def text_anchor(gravity: str, canvas_size, geometry: str) -> tuple:
+    """Pillow anchor, position and alignment for imagemagick gravity and offset"""
+    x_offset, y_offset = parse_geometry(geometry)
+    width, height = canvas_size
+    return {
+        "NorthWest": ("la", (x_offset, y_offset), "left"),
+        "NorthEast": ("ra", (width - x_offset, y_offset), "right"),
+        "SouthWest": ("ld", (x_offset, height - y_offset), "left"),
+        "SouthEast": ("rd", (width - x_offset, height - y_offset), "right"),
+        "Center": ("mm", (width / 2 + x_offset, height / 2 + y_offset), "center"),
+    }[gravity]
+
+
+def clip_position(position) -> tuple:
+    """alpha_composite only accepts positive destinations"""
+    return max(position[0], 0), max(position[1], 0)
+
+
+def erode(mask, radius: int):
+    """shrink a mask by radius pixels, working only on its bounding box"""
+    bbox = mask.getbbox()
+    if radius < 1 or not bbox:
+        return mask
+    box = (
+        max(bbox[0] - radius, 0),
+        max(bbox[1] - radius, 0),
+        min(bbox[2] + radius, mask.width),
+        min(bbox[3] + radius, mask.height),
+    )
+    eroded = Image.new("L", mask.size, 0)
+    eroded.paste(mask.crop(box).filter(ImageFilter.MinFilter(2 * radius + 1)), box)
+    return eroded
+
+
+class LayerCache:
+    """base images resized, blurred and composited with their overlays, kept
+    on disk under a hash of the input files and parameters. Posters of the
+    same venue share the blurred base and track map, so a new event only
+    draws its title and round number on a stored layer"""
+
+    # layers are read back once per image, fast zlib beats a smaller file
+    compress_level = 1
+    # layers not drawn on for this long are removed by prune
+    max_age_days = 30
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        # layer key to when its modified time was last set
+        self.touched = {}
+
+    @staticmethod
+    def has_layer(spec: dict) -> bool:
+        """True if the spec resizes, blurs, or composites its base image"""
+        return bool(spec["size"] or spec["blur"] or spec["overlays"])
+
+    @staticmethod
+    def layer_key(spec: dict, backend: str) -> str:
+        """hash of everything that changes the layer, annotations excluded"""
+        inputs = {
+            "base_image": file_fingerprint(spec["base_image"]),
+            "size": spec["size"] and list(spec["size"]),
+            "blur": spec["blur"],
+            "overlays": [
+                {**overlay, "image": file_fingerprint(overlay["image"])}
+                for overlay in spec["overlays"]
+            ],
+            "backend": backend,
+        }
+        return hashlib.sha256(
+            json.dumps(inputs, sort_keys=True).encode("utf-8")
+        ).hexdigest()[:32]
+
+    def layer_file(self, key: str) -> str:
+        """path of the stored layer for a layer key, png so it stays lossless"""
+        return os.path.join(self.cache_path, key[:2], key + ".png")
+
+    def key_lock(self, key: str):
+        """lock held while a layer is rendered, so it is rendered once"""
+        with self.lock:
+            return self.key_locks.setdefault(key, threading.Lock())
+
+    def apply(self, spec: dict, renderer) -> dict:
+        """returns spec drawn on its stored layer, rendering the layer with
+        renderer first if it is missing"""
+        if not self.has_layer(spec):
+            return spec
+        key = self.layer_key(spec, renderer.name)
+        layer = self.layer_file(key)
+        with self.key_lock(key):
+            if os.path.isfile(layer):
+                self.mark_used(key)
+            else:
+                self.render_layer(spec, renderer, layer)
+                self.touched[key] = time.time()
+        return {**spec, "base_image": layer, "size": None, "blur": None, "overlays": []}
+
+    def render_layer(self, spec: dict, renderer, layer: str):
+        """render the layer of spec to a temporary file, then move it into
+        place. A failed render leaves no temporary file behind"""
+        try:
+            os.makedirs(os.path.dirname(layer), exist_ok=True)
+        except OSError as err:
+            raise SystemExit("ERROR: Can't create layer cache: ") from err
+        temp_file = f"{layer}.{threading.get_ident()}.tmp.png"
+        try:
+            renderer.render(
+                {
+                    **spec,
+                    "annotations": [],
+                    "encoding": {"compress_level": self.compress_level},
+                    "destination": temp_file,
+                }
+            )
+            os.replace(temp_file, layer)
+        except BaseException:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+        METRICS.count("layers_rendered")
+
+    def mark_used(self, key: str):
+        """set the modified time of a stored layer when it is used, at most
+        once a day, prune keeps layers used recently"""
+        now = time.time()
+        with self.lock:
+            if now - self.touched.get(key, 0) < 86400:
+                return
+            self.touched[key] = now
+        try:
+            os.utime(self.layer_file(key))
+        except OSError:
+            return
+
+    def prune(self):
+        """remove layers not used for max_age_days, and temporary files left
+        by renders that were killed"""
+        cutoff = time.time() - self.max_age_days * 86400
+        for _, path in stored_files(self.cache_path, ("png", r"png\.\d+\.tmp\.png")):
+            try:
+                if os.stat(path).st_mtime < cutoff:
+                    os.remove(path)
+            except OSError:
+                continue
+
+
+class LayeredRenderer:
+    """renderer that draws annotations on layers from a layer cache"""
+
+    # disable too few public methods - pylint: disable=R0903
+
+    def __init__(self, renderer, layer_cache: LayerCache):
+        self.renderer = renderer
+        self.layer_cache = layer_cache
+        self.name = renderer.name
+
+    def __getattr__(self, name):
+        """other attributes, e.g. find_font_file, are the backend's"""
+        return getattr(self.renderer, name)
+
+    def render(self, spec: dict):
+        """write the image described by spec"""
+        self.renderer.render(self.layer_cache.apply(spec, self.renderer))
+
+
+def with_layers(renderer, layer_path: str):
+    """returns renderer drawing on cached layers, unchanged if layer_path
+    is empty"""
+    if not layer_path:
+        return renderer
+    return LayeredRenderer(renderer, LayerCache(layer_path))
+
+
+DEFAULT_RENDERER = ImageMagickRenderer()
+
+
+def require_convert():
+    """stop before any render when imagemagick is not installed"""
+    if not which("convert"):
+        raise SystemExit("ERROR: Imagemagick convert not found in path.")
+
+
+def make_renderer(
+    backend: str, font_path: str, batch_size: int = 0, layer_path: str = ""
+):
+    """returns the renderer for a config render_backend name. Imagemagick
+    renders are batched when batch_size is more than one, and drawn on
+    cached layers when layer_path is set"""
+    if backend == ImageMagickRenderer.name:
+        require_convert()
+        if batch_size > 1:
+            return with_layers(BatchImageMagickRenderer(batch_size), layer_path)
+        return with_layers(DEFAULT_RENDERER, layer_path)
+    if backend == PillowRenderer.name:
+        # pillow keeps decoded base images in memory, reading layers back
+        # from disk measured slower than resizing them again
+        return PillowRenderer(font_path)
+    raise SystemExit(f"ERROR: Unknown render backend: {backend}")
+
+
+def is_cached(renderer) -> bool:
+    """True if the renderer checks image inputs through a render cache"""
+    return getattr(renderer, "render_cache", None) is not None
+
+
+def render_image(spec: dict, renderer=None) -> bool:
+    """render a spec, timed per backend. Returns False if a render cache
+    found the destination current"""
+    renderer = renderer or DEFAULT_RENDERER
+    if is_cached(renderer):
+        return renderer.render(spec)
+    with METRICS.timer("render_" + renderer.name):
+        renderer.render(spec)
+    METRICS.count("images_rendered")
+    return True
+
+
+def create_background_image(race, font_name, image_path, renderer=None, encoding=None):
     """generates images with imageconvert"""
 
+    encoding = encoding or BACKGROUND_ENCODING
     destination_folder = race.get_destination_folder()
-    background_destination = str(race.get_destination_folder() + "/background.jpg")
+    background_destination = str(
+        race.get_destination_folder() + "/" + image_file_name("background", encoding)
+    )
 
-    # if image already exists, dont recreate
-    if os.path.isfile(background_destination):
+    # if image already exists, dont recreate unless its inputs changed
+    if os.path.isfile(background_destination) and not is_cached(renderer):
         return 0
 
     # build path if not found
@@ -26,50 +670,42 @@ def create_background_image(race, font_name, image_path):
         raise SystemExit("ERROR, can't create path: ") from err
 
     # prefer race name to race year to default
-    background_image = str(
-        image_path + "/" + race.get_kv("race_name") + "-background.jpg"
-    )
-    if not os.path.isfile(background_image):
-        background_image = str(
-            image_path + "/" + race.get_kv("race_season") + "-background.jpg"
-        )
-    if not os.path.isfile(background_image):
-        background_image = str(image_path + "/background.jpg")
-
-    generate_background_cmd = [
-        "convert",
-        background_image,
-        "-resize",
-        "1920x1080!",
-        "-gravity",
-        "NorthEast",
-        "-font",
-        font_name["titi-bold"],
-        "-pointsize",
-        "280",
-        "-fill",
-        "none",
-        "-stroke",
-        "white",
-        "-strokewidth",
-        "14",
-        "-annotate",
-        "+160+160",
-        race.get_kv("race_round"),
-        background_destination,
-    ]
+    background_image = ASSET_INDEX.find_image(image_path, race, "background")
 
-    try:
-        subprocess.check_output(generate_background_cmd)
-    except subprocess.CalledProcessError as err:
-        raise SystemExit("ERROR Imagemagic exit code: ") from err
-    print("Background: " + os.path.basename(race.get_destination_folder()))
+    background_spec = {
+        "base_image": background_image,
+        "size": (1920, 1080),
+        "blur": None,
+        "overlays": [],
+        "annotations": [
+            {
+                "gravity": "NorthEast",
+                "font": font_name["titi-bold"],
+                "pointsize": "280",
+                "fill": "none",
+                "stroke": "white",
+                "strokewidth": "14",
+                "offset": "+160+160",
+                "text": race.get_kv("race_round"),
+            }
+        ],
+        "destination": background_destination,
+    }
+    # only set when used, so render cache keys of default images stay the same
+    if spec_encoding(encoding):
+        background_spec["encoding"] = spec_encoding(encoding)
+
+    if render_image(background_spec, renderer):
+        remove_other_formats(background_destination)
+        print("Background: " + os.path.basename(race.get_destination_folder()))
 
     return 0
 
 
-def create_poster_image(race, font_name, track_path, flag_path, image_path):
-    # disable too many local variables - pylint: disable=R0914
+def create_poster_image(
+    race, font_name, track_path, flag_path, image_path, renderer=None, encoding=None
+):
+    # disable too many arguments and local variables - pylint: disable=R0913,R0914,R0917
     """generates images with imageconvert"""
 
     # format title depending on race series
@@ -99,13 +735,16 @@ def create_poster_image(race, font_name, track_path, flag_path, image_path):
         race_name_annotate_offset = "+20+10"
         point_size_base = 130
 
+    encoding = encoding or POSTER_ENCODING
     destination_folder = race.get_destination_folder()
-    race_poster_destination = str(race.get_destination_folder() + "/show.png")
-    track_map_image = str(track_path + "/" + race.get_kv("race_name") + ".png")
-    race_flag = str(flag_path + "/" + race.get_kv("race_name").lower() + ".png")
+    race_poster_destination = str(
+        race.get_destination_folder() + "/" + image_file_name("show", encoding)
+    )
+    track_map_image = ASSET_INDEX.find_track(track_path, race)
+    race_flag = ASSET_INDEX.find_flag(flag_path, race)
 
-    # if image already exists, dont recreate
-    if os.path.isfile(race_poster_destination):
+    # if image already exists, dont recreate unless its inputs changed
+    if os.path.isfile(race_poster_destination) and not is_cached(renderer):
         return
 
     # build path if not found
@@ -115,104 +754,60 @@ def create_poster_image(race, font_name, track_path, flag_path, image_path):
         raise SystemExit("ERROR, can't create path: ") from err
 
     # prefer race name to race year to default
-    poster_image = str(image_path + "/" + race.get_kv("race_name") + "-poster.jpg")
-    if not os.path.isfile(poster_image):
-        poster_image = str(
-            image_path + "/" + race.get_kv("race_season") + "-poster.jpg"
-        )
-    if not os.path.isfile(poster_image):
-        poster_image = str(image_path + "/poster.jpg")
-
-    # use simplified fill colors
-    fill_color = "white"
-    stroke_color = "black"
+    poster_image = ASSET_INDEX.find_image(image_path, race, "poster")
 
     # adjust race_name size if larger than the min, which is
     # the 'championship' part of the WEC title text.
     point_size = str(point_size_base - (max(len(race.get_kv("race_name")), 12) * 5))
 
-    # start building up the imagemagic command
-    generate_race_poster_cmd = ["convert", poster_image, "-resize", "600x900!"]
-
-    # if a map is available
-    if os.path.isfile(track_map_image):
-        generate_race_poster_cmd.extend(
-            [
-                "-blur",
-                "0x4",
-                track_map_image,
-                "-compose",
-                "Src_Over",
-                "-gravity",
-                "Center",
-                "-geometry",
-                "+0+80",
-                "-background",
-                "None",
-                "-composite",
-            ]
+    poster_spec = {
+        "base_image": poster_image,
+        "size": (600, 900),
+        "blur": None,
+        "overlays": [],
+        "annotations": [
+            {
+                "gravity": "NorthWest",
+                "font": race_name_font,
+                "pointsize": point_size,
+                "interline_spacing": race_name_interline_spacing,
+                "fill": "white",
+                "stroke": "black",
+                "strokewidth": "1",
+                "offset": race_name_annotate_offset,
+                "text": full_race_name,
+            },
+            {
+                "gravity": "SouthEast",
+                "font": font_name["titi-bold"],
+                "pointsize": "115",
+                "fill": "none",
+                "stroke": "white",
+                "strokewidth": "2",
+                "offset": "+10-20",
+                "text": race.get_kv("race_round"),
+            },
+        ],
+        "destination": race_poster_destination,
+    }
+    if spec_encoding(encoding):
+        poster_spec["encoding"] = spec_encoding(encoding)
+
+    # blur the base image behind a track map if one is available
+    if track_map_image:
+        poster_spec["blur"] = "0x4"
+        poster_spec["overlays"].append(
+            {"image": track_map_image, "gravity": "Center", "geometry": "+0+80"}
         )
 
     # add country flag if available
-    if os.path.isfile(race_flag):
-        generate_race_poster_cmd.extend(
-            [
-                race_flag,
-                "-gravity",
-                "SouthWest",
-                "-geometry",
-                "+20+20",
-                "-compose",
-                "Src_Over",
-                "-background",
-                "None",
-                "-composite",
-            ]
+    if race_flag:
+        poster_spec["overlays"].append(
+            {"image": race_flag, "gravity": "SouthWest", "geometry": "+20+20"}
         )
 
-    # add the rest of the imagemagic command
-    generate_race_poster_cmd.extend(
-        [
-            "-gravity",
-            "NorthWest",
-            "-font",
-            race_name_font,
-            "-pointsize",
-            point_size,
-            "-interline-spacing",
-            race_name_interline_spacing,
-            "-fill",
-            fill_color,
-            "-stroke",
-            stroke_color,
-            "-strokewidth",
-            "1",
-            "-annotate",
-            race_name_annotate_offset,
-            full_race_name,
-            "-gravity",
-            "SouthEast",
-            "-font",
-            font_name["titi-bold"],
-            "-pointsize",
-            "115",
-            "-fill",
-            "none",
-            "-stroke",
-            "white",
-            "-strokewidth",
-            "2",
-            "-annotate",
-            "+10-20",
-            race.get_kv("race_round"),
-            race_poster_destination,
-        ]
-    )
-
-    try:
-        subprocess.check_output(generate_race_poster_cmd)
-    except subprocess.CalledProcessError as err:
-        raise SystemExit("ERROR Imagemagic exit code: ") from err
-    print("Poster: " + os.path.basename(race.get_destination_folder()))
+    if render_image(poster_spec, renderer):
+        remove_other_formats(race_poster_destination)
+        print("Poster: " + os.path.basename(race.get_destination_folder()))
 
     return
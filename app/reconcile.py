@@ -0,0 +1,395 @@
+#!/usr/bin/python
+"""compare the sorted destination with the names the source files should
+have now, then rename, link, and remove files to match"""
+
+import os
+import sys
+import argparse
+from typing import NamedTuple
+from motorsort import (
+    load_settings,
+    get_file_list,
+    link_files,
+    render_folder,
+    save_state,
+)
+from planner import iter_plan
+from weekend import Weekend, DestinationIndex
+from state_index import StateIndex
+from image_encoding import is_folder_image
+
+
+class DestinationScan(NamedTuple):
+    """the series folders motorsort writes, read once"""
+
+    media: dict  # media file path to (device, inode)
+    images: dict  # event folder to its image files
+    folders: dict  # series folder to its event folder names
+
+
+class Reconciliation(NamedTuple):
+    """changes that make the destination match the source files"""
+
+    current: list  # planned files already in place
+    renames: list  # (old destination, destination) pairs
+    missing: list  # planned files to link or copy
+    stale: list  # older names of current source files, to remove
+    orphaned_images: list  # images in folders left with no media files
+    untracked: list  # media files no current source file was sorted to
+    conflicts: list  # planned files whose name is taken by an untracked file,
+    # or planned for more than one source file
+
+
+def scan_destination(settings: dict) -> DestinationScan:
+    """list each series folder and its event folders in one pass. Inodes
+    come from the directory listing and devices from each folder, files
+    are not stat'ed"""
+    scan = DestinationScan({}, {}, {})
+    for series_name in sorted(set(settings["series_prefix"].values())):
+        series_path = settings["destination_path"] + "/" + series_name
+        try:
+            with os.scandir(series_path) as series_entries:
+                event_folders = [
+                    entry.name for entry in series_entries if entry.is_dir()
+                ]
+        except OSError:
+            continue
+        scan.folders[series_path] = event_folders
+        for folder_name in event_folders:
+            destination_folder = series_path + "/" + folder_name
+            try:
+                device = os.stat(destination_folder).st_dev
+                with os.scandir(destination_folder) as entries:
+                    for entry in entries:
+                        if is_folder_image(entry.name):
+                            scan.images.setdefault(destination_folder, []).append(
+                                entry.path
+                            )
+                        elif entry.name.endswith(settings["file_types"]):
+                            scan.media[entry.path] = (device, entry.inode())
+            except OSError:
+                continue
+    return scan
+
+
+def stat_sources(source_file_names) -> dict:
+    """stat each source file, unreadable files are left out"""
+    source_stats = {}
+    for source_file_name in source_file_names:
+        try:
+            source_stats[source_file_name] = os.stat(source_file_name)
+        except OSError:
+            print(f"ERROR: Can't read file, skipping: {source_file_name}")
+    return source_stats
+
+
+def file_id(source_stat) -> tuple:
+    """device and inode of a file, equal for hardlinks of one file"""
+    return (source_stat.st_dev, source_stat.st_ino)
+
+
+def make_plan(settings: dict, source_stats: dict, scan: DestinationScan) -> tuple:
+    """destination of each source file, named against the scanned folders.
+    Returns destinations to ParsedRace, and the destinations planned for
+    more than one source file, which are left out of the plan"""
+    destination_index = DestinationIndex()
+    for series_path, folder_names in scan.folders.items():
+        destination_index.set_folders(series_path, folder_names)
+
+    plan = {}
+    duplicates = set()
+    for parsed_race in iter_plan(
+        list(source_stats), settings, destination_index=destination_index
+    ):
+        if parsed_race.error:
+            print(f"ERROR: Can't parse file, skipping: {parsed_race.source}")
+            continue
+        if parsed_race.destination in plan:
+            print(
+                f"ERROR: {parsed_race.source} and "
+                f"{plan[parsed_race.destination].source} have the same name, "
+                f"skipping: {parsed_race.destination}"
+            )
+            duplicates.add(parsed_race.destination)
+            continue
+        plan[parsed_race.destination] = parsed_race
+    for destination in duplicates:
+        del plan[destination]
+    return plan, sorted(duplicates)
+
+
+def find_current(plan, source_stats, scan, copy_files) -> list:
+    """planned files already in place. A hardlink is checked by device and
+    inode, a copy is taken as current by name"""
+    return [
+        destination
+        for destination, parsed_race in sorted(plan.items())
+        if destination in scan.media
+        and (
+            copy_files
+            or scan.media[destination] == file_id(source_stats[parsed_race.source])
+        )
+    ]
+
+
+def find_old_destinations(plan, source_stats, scan, state_index, current) -> dict:
+    # disable too many arguments - pylint: disable=R0913,R0917
+    """scanned files each source file is already in under another name: its
+    hardlinks, and the destination saved in the state index. Returns source
+    files to their old destinations"""
+    planned = {parsed_race.source for parsed_race in plan.values()}
+    by_inode = {}
+    for path, media_id in scan.media.items():
+        by_inode.setdefault(media_id, []).append(path)
+
+    old_destinations = {}
+    for source_file_name in planned:
+        paths = set(by_inode.get(file_id(source_stats[source_file_name]), ()))
+        entry = state_index.get_entry(source_file_name)
+        if entry and entry["destination"] in scan.media:
+            paths.add(entry["destination"])
+        old_destinations[source_file_name] = sorted(paths.difference(current))
+    return old_destinations
+
+
+def reconcile(
+    plan, source_stats, scan, state_index, copy_files, duplicates=()
+) -> Reconciliation:
+    # disable too many arguments - pylint: disable=R0913,R0917
+    """diff the plan with the scanned destination, duplicates are
+    destinations make_plan found for more than one source file"""
+    result = Reconciliation([], [], [], [], [], [], [])
+    result.current.extend(find_current(plan, source_stats, scan, copy_files))
+    current = set(result.current)
+    old_destinations = find_old_destinations(
+        plan, source_stats, scan, state_index, current
+    )
+    moved = set()
+    for destination, parsed_race in sorted(plan.items()):
+        if destination in current:
+            continue
+        old_destination = next(
+            (
+                path
+                for path in old_destinations[parsed_race.source]
+                if path not in moved
+            ),
+            None,
+        )
+        if old_destination:
+            result.renames.append((old_destination, destination))
+            moved.add(old_destination)
+        else:
+            result.missing.append(destination)
+
+    result.stale.extend(
+        sorted(
+            {path for paths in old_destinations.values() for path in paths}.difference(
+                moved
+            )
+        )
+    )
+    moved.update(result.stale)
+    result.untracked.extend(sorted(set(scan.media).difference(plan, moved, duplicates)))
+    result.conflicts.extend(duplicates)
+
+    drop_conflicts(result, scan, moved)
+    result.orphaned_images.extend(find_orphaned_images(result, scan))
+    return result
+
+
+def drop_conflicts(result: Reconciliation, scan: DestinationScan, moved: set):
+    """leave out planned files whose name is taken by a file that is not
+    moved or removed"""
+    for destination in [new for _, new in result.renames] + result.missing:
+        if destination in scan.media and destination not in moved:
+            result.conflicts.append(destination)
+    conflicts = set(result.conflicts)
+    result.renames[:] = [
+        rename for rename in result.renames if rename[1] not in conflicts
+    ]
+    result.missing[:] = [
+        destination for destination in result.missing if destination not in conflicts
+    ]
+
+
+def find_orphaned_images(result: Reconciliation, scan: DestinationScan) -> list:
+    """images in folders holding no media files once the changes are made"""
+    orphaned_images = []
+    kept_media = set(scan.media).difference(
+        result.stale, [old_destination for old_destination, _ in result.renames]
+    )
+    kept_media.update(result.missing, [new for _, new in result.renames])
+    kept_folders = {os.path.dirname(path) for path in kept_media}
+    for destination_folder, images in sorted(scan.images.items()):
+        if destination_folder not in kept_folders:
+            orphaned_images.extend(sorted(images))
+    return orphaned_images
+
+
+def rename_files(renames):
+    """rename files a folder at a time, through one handle per folder"""
+    batches = {}
+    for old_destination, destination in renames:
+        batches.setdefault(
+            (os.path.dirname(old_destination), os.path.dirname(destination)), []
+        ).append((os.path.basename(old_destination), os.path.basename(destination)))
+
+    for (old_folder, destination_folder), names in sorted(batches.items()):
+        try:
+            os.makedirs(destination_folder, exist_ok=True)
+            old_folder_fd = os.open(old_folder, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                folder_fd = os.open(destination_folder, os.O_RDONLY | os.O_DIRECTORY)
+                try:
+                    for old_name, new_name in names:
+                        os.rename(
+                            old_name,
+                            new_name,
+                            src_dir_fd=old_folder_fd,
+                            dst_dir_fd=folder_fd,
+                        )
+                finally:
+                    os.close(folder_fd)
+            finally:
+                os.close(old_folder_fd)
+        except OSError as err:
+            raise SystemExit("ERROR: Can't rename file: ") from err
+
+
+def apply_renames(renames):
+    """rename files, through a temporary name where one takes the name of
+    another being renamed"""
+    old_destinations = {old_destination for old_destination, _ in renames}
+    direct, to_temporary, from_temporary = [], [], []
+    for old_destination, destination in renames:
+        if destination in old_destinations:
+            folder, name = os.path.split(old_destination)
+            temporary = f"{folder}/.{name}.reconcile"
+            to_temporary.append((old_destination, temporary))
+            from_temporary.append((temporary, destination))
+        else:
+            direct.append((old_destination, destination))
+    rename_files(to_temporary + direct)
+    rename_files(from_temporary)
+    for _, destination in renames:
+        print("Renamed: " + os.path.basename(destination))
+
+
+def remove_files(paths, label: str):
+    """remove files, and their event folders if left empty"""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as err:
+            raise SystemExit("ERROR: Can't remove file: ") from err
+        print(f"{label}: {os.path.basename(path)}")
+    for folder in sorted({os.path.dirname(path) for path in paths}, reverse=True):
+        try:
+            os.rmdir(folder)
+        except OSError:
+            continue
+
+
+def make_race(parsed_race, settings: dict) -> Weekend:
+    """a Weekend with the fields of a planned file"""
+    race = Weekend(settings["destination_path"], DestinationIndex(False))
+    for key in StateIndex.race_fields:
+        race.set_kv(key, getattr(parsed_race, key))
+    # keep the folder the plan chose, it may differ from the race name
+    race.destination_index.set_folders(
+        os.path.dirname(parsed_race.destination_folder),
+        [os.path.basename(parsed_race.destination_folder)],
+    )
+    return race
+
+
+def apply(result: Reconciliation, plan, source_stats, settings, state_index):
+    # disable too many arguments - pylint: disable=R0913,R0917
+    """rename, link, and remove files, then record every planned file in
+    the state index"""
+    remove_files(result.stale, "Removed")
+    apply_renames(result.renames)
+
+    new_folders = {}
+    for destination in result.missing:
+        race = make_race(plan[destination], settings)
+        if not os.path.isdir(race.get_destination_folder()):
+            new_folders.setdefault(race.get_destination_folder(), race)
+            try:
+                os.makedirs(race.get_destination_folder())
+            except OSError as err:
+                raise SystemExit("ERROR: Can't create path: ") from err
+        link_files(
+            race,
+            plan[destination].source,
+            settings["copy_files"],
+            settings["copy_verify"],
+        )
+    remove_files(result.orphaned_images, "Removed image")
+
+    for race in new_folders.values():
+        render_folder(race, settings)
+
+    for destination in (
+        result.current + result.missing + [new for _, new in result.renames]
+    ):
+        parsed_race = plan[destination]
+        state_index.record(
+            parsed_race.source,
+            source_stats[parsed_race.source],
+            make_race(parsed_race, settings),
+        )
+    state_index.prune(source_stats)
+    save_state(settings, state_index)
+
+
+def print_report(result: Reconciliation):
+    """print the changes, and counts of each kind"""
+    for old_destination, destination in result.renames:
+        print(f"rename: {old_destination} -> {destination}")
+    for kind in ("missing", "stale", "orphaned_images", "conflicts"):
+        for path in getattr(result, kind):
+            print(f"{kind}: {path}")
+    print(
+        "Reconcile: "
+        + " ".join(f"{kind}={len(paths)}" for kind, paths in result._asdict().items())
+    )
+
+
+def main(argv=None):
+    """reconcile the destination with the source path"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--apply",
+        action="store_true",
+        help="make the changes, otherwise only list them",
+    )
+    args = parser.parse_args(argv)
+
+    settings = load_settings()
+    state_index = StateIndex(settings["state_index"]).load()
+    source_stats = stat_sources(
+        get_file_list(
+            settings["source_path"],
+            settings["file_prefix"],
+            settings["file_types"],
+            settings["ignore_pattern"],
+        )
+    )
+    scan = scan_destination(settings)
+    plan, duplicates = make_plan(settings, source_stats, scan)
+    result = reconcile(
+        plan, source_stats, scan, state_index, settings["copy_files"], duplicates
+    )
+
+    print_report(result)
+    if args.apply:
+        apply(result, plan, source_stats, settings, state_index)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+#!/usr/bin/python
+"""re-encode the posters and backgrounds of the sorted destination, or
+compare the bytes and encode time of other encodings on them"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+from typing import NamedTuple
+from motorsort import load_settings, refresh_images, save_state
+from reconcile import scan_destination
+from poster_maker import make_renderer
+from render_cache import RenderCache
+from state_index import StateIndex
+from image_encoding import (
+    IMAGE_NAMES,
+    parse_encoding,
+    image_file_name,
+    spec_encoding,
+    remove_other_formats,
+)
+
+
+class EncodingResult(NamedTuple):
+    """bytes and time of one encoding over the images of one name"""
+
+    name: str  # show or background
+    setting: str  # the encoding setting, e.g. webp quality=80
+    files: int  # images encoded, hardlinked copies once
+    bytes_before: int
+    bytes_after: int
+    seconds: float
+
+
+def find_images(settings: dict) -> dict:
+    """image name to groups of image paths, one group per inode so images
+    hardlinked by the render cache are encoded once"""
+    scan = scan_destination(settings)
+    images = {name: {} for name in IMAGE_NAMES}
+    for paths in scan.images.values():
+        for path in paths:
+            name = os.path.splitext(os.path.basename(path))[0]
+            try:
+                path_stat = os.stat(path)
+            except OSError:
+                continue
+            images[name].setdefault((path_stat.st_dev, path_stat.st_ino), []).append(
+                path
+            )
+    return {name: list(groups.values()) for name, groups in images.items()}
+
+
+def encode(renderer, source: str, destination: str, encoding: dict) -> float:
+    """write source to destination with encoding, returns the seconds taken"""
+    spec = {
+        "base_image": source,
+        "size": None,
+        "blur": None,
+        "overlays": [],
+        "annotations": [],
+        "encoding": spec_encoding(encoding),
+        "destination": destination,
+    }
+    started = time.perf_counter()
+    renderer.render(spec)
+    seconds = time.perf_counter() - started
+    # each image is read once, do not keep it decoded
+    if hasattr(renderer, "clear"):
+        renderer.clear()
+    return seconds
+
+
+def compare(renderer, name: str, groups: list, setting: str) -> EncodingResult:
+    """encode one image of each group to a temporary file"""
+    encoding = parse_encoding(setting)
+    bytes_before = bytes_after = 0
+    seconds = 0.0
+    with tempfile.TemporaryDirectory() as temp_path:
+        destination = os.path.join(temp_path, image_file_name(name, encoding))
+        for paths in groups:
+            seconds += encode(renderer, paths[0], destination, encoding)
+            bytes_before += os.path.getsize(paths[0])
+            bytes_after += os.path.getsize(destination)
+    return EncodingResult(
+        name, setting, len(groups), bytes_before, bytes_after, seconds
+    )
+
+
+def replace_image(renderer, source: str, destination: str, encoding: dict) -> float:
+    """encode source over destination through a temporary file, returns the
+    seconds taken"""
+    temp_file = destination + ".tmp" + os.path.splitext(destination)[1]
+    seconds = encode(renderer, source, temp_file, encoding)
+    try:
+        os.replace(temp_file, destination)
+    except OSError as err:
+        raise SystemExit("ERROR: Can't replace image: ") from err
+    return seconds
+
+
+def reencode(renderer, name: str, groups: list, setting: str) -> tuple:
+    """re-encode each group in place, renaming images to the format of
+    setting. Groups already in that format are skipped, lossy images are
+    not encoded from themselves again. Returns the EncodingResult and the
+    destinations changed"""
+    encoding = parse_encoding(setting)
+    file_name = image_file_name(name, encoding)
+    groups = [
+        paths
+        for paths in groups
+        if any(os.path.basename(path) != file_name for path in paths)
+    ]
+    bytes_before = bytes_after = 0
+    seconds = 0.0
+    changed = []
+    for paths in groups:
+        bytes_before += os.path.getsize(paths[0])
+        first = os.path.join(os.path.dirname(paths[0]), file_name)
+        seconds += replace_image(renderer, paths[0], first, encoding)
+        bytes_after += os.path.getsize(first)
+        for path in paths:
+            destination = os.path.join(os.path.dirname(path), file_name)
+            if destination != first:
+                RenderCache.link(first, destination)
+            remove_other_formats(destination)
+            changed.extend([path, destination])
+        print(f"Encoded: {first}")
+    return (
+        EncodingResult(name, setting, len(groups), bytes_before, bytes_after, seconds),
+        changed,
+    )
+
+
+def reencode_all(renderer, images: dict, configured: dict) -> list:
+    """re-encode the images of each name with its configured setting,
+    returns the EncodingResults"""
+    return [
+        reencode(renderer, name, groups, configured[name])[0]
+        for name, groups in images.items()
+    ]
+
+
+def rerender(settings: dict) -> int:
+    """render the images of sorted folders again from their custom images
+    and track maps with the configured encodings, through the render cache.
+    Returns the number of folders that failed"""
+    state_index = StateIndex(settings["state_index"]).load()
+    render_errors = refresh_images(settings, state_index)
+    save_state(settings, state_index)
+    return len(render_errors)
+
+
+def megabytes(size: int) -> str:
+    """size in megabytes for the report"""
+    return f"{size / 1_000_000:.2f}MB"
+
+
+def print_report(results: list):
+    """print the bytes saved and encode time of each setting"""
+    for result in results:
+        saved = result.bytes_before - result.bytes_after
+        print(
+            f"{result.name} {result.setting}: files={result.files}"
+            f" before={megabytes(result.bytes_before)}"
+            f" after={megabytes(result.bytes_after)}"
+            f" saved={megabytes(saved)}"
+            f" ({100 * saved / max(result.bytes_before, 1):.1f}%)"
+            f" time={result.seconds:.2f}s"
+            f" ({result.seconds / max(result.files, 1):.3f}s per file)"
+        )
+
+
+def main(argv=None):
+    """compare encodings on the destination images, or re-encode them"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    for name, setting in (("poster", "show"), ("background", "background")):
+        parser.add_argument(
+            f"--{name}",
+            action="append",
+            dest=setting,
+            metavar="ENCODING",
+            help=f"{name} encoding to compare, e.g. 'webp quality=80',"
+            f" may be given more than once, default {name}_encoding",
+        )
+    parser.add_argument(
+        "--sample",
+        type=int,
+        default=0,
+        help="compare on this many images of each name, default all",
+    )
+    parser.add_argument(
+        "--apply",
+        action="store_true",
+        help="write the images with poster_encoding and background_encoding,"
+        " rendered again through the render cache when it is on",
+    )
+    args = parser.parse_args(argv)
+    if args.apply and (args.show or args.background):
+        parser.error("--apply uses poster_encoding and background_encoding")
+
+    settings = load_settings()
+    configured = {
+        "show": settings["poster_encoding"],
+        "background": settings["background_encoding"],
+    }
+    try:
+        for setting in (args.show or []) + (args.background or []):
+            parse_encoding(setting)
+    except ValueError as err:
+        parser.error(str(err))
+
+    if args.apply and settings["render_cache"]:
+        return 1 if rerender(settings) else 0
+    renderer = make_renderer(settings["render_backend"], settings["font_path"])
+    images = find_images(settings)
+    if args.apply:
+        print_report(reencode_all(renderer, images, configured))
+        return 0
+
+    results = []
+    for name, groups in images.items():
+        for setting in getattr(args, name) or [configured[name]]:
+            results.append(
+                compare(renderer, name, groups[: args.sample or None], setting)
+            )
+    print_report(results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+#!/usr/bin/python
+"""motorsort render_cache.py"""
+
+import os
+import json
+import hashlib
+import threading
+from shutil import copy2
+from poster_maker import (
+    FontFiles,
+    make_renderer,
+    render_image,
+    file_fingerprint,
+    stored_files,
+    load_pillow,
+)
+from image_encoding import IMAGE_FORMATS
+
+
+class RenderCache:
+    """rendered images stored once per set of inputs. Each image is kept under
+    a hash of its spec and input files and hardlinked into every folder that
+    uses it, the manifest records which inputs each destination was made from"""
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.manifest_file = os.path.join(cache_path, "manifest.json")
+        self.inputs_file = os.path.join(cache_path, "inputs")
+        self.manifest = {}
+        self.lock = threading.Lock()
+        self.changed = False
+
+    def load(self):
+        """read the manifest from disk, start empty if missing or unreadable"""
+        try:
+            with open(self.manifest_file, "r", encoding="utf-8") as file:
+                self.manifest = json.load(file)
+        except FileNotFoundError:
+            self.manifest = {}
+        except (OSError, ValueError) as err:
+            print(f"WARNING: Can't read render cache, rebuilding: {err}")
+            self.manifest = {}
+        self.changed = False
+        return self
+
+    def save(self):
+        """write the manifest to disk if it changed, replacing it atomically"""
+        with self.lock:
+            if not self.changed:
+                return
+            temp_file = self.manifest_file + ".tmp"
+            try:
+                os.makedirs(self.cache_path, exist_ok=True)
+                with open(temp_file, "w", encoding="utf-8") as file:
+                    json.dump(self.manifest, file, separators=(",", ":"))
+                os.replace(temp_file, self.manifest_file)
+            except OSError as err:
+                raise SystemExit("ERROR: Can't write render cache: ") from err
+            self.changed = False
+
+    def inputs_current(self, signature: str) -> bool:
+        """True if the images of sorted folders were last refreshed from
+        inputs with this signature"""
+        try:
+            with open(self.inputs_file, "r", encoding="utf-8") as file:
+                return file.read() == signature
+        except OSError:
+            return False
+
+    def record_inputs(self, signature: str):
+        """save the signature of the inputs sorted folders were refreshed from"""
+        temp_file = self.inputs_file + ".tmp"
+        try:
+            os.makedirs(self.cache_path, exist_ok=True)
+            with open(temp_file, "w", encoding="utf-8") as file:
+                file.write(signature)
+            os.replace(temp_file, self.inputs_file)
+        except OSError as err:
+            raise SystemExit("ERROR: Can't write render cache: ") from err
+
+    def prune(self):
+        """remove stored images no destination was made from"""
+        with self.lock:
+            keys = set(self.manifest.values())
+        for key, path in stored_files(self.cache_path, IMAGE_FORMATS):
+            if key in keys:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+
+    def input_key(self, spec: dict, backend: str, input_files=()) -> str:
+        """hash of everything that changes the rendered image"""
+        inputs = {key: value for key, value in spec.items() if key != "destination"}
+        inputs["backend"] = backend
+        inputs["format"] = os.path.splitext(spec["destination"])[1].lower()
+        inputs["files"] = [
+            file_fingerprint(path)
+            for path in [spec["base_image"]]
+            + [overlay["image"] for overlay in spec["overlays"]]
+            + list(input_files)
+        ]
+        return hashlib.sha256(
+            json.dumps(inputs, sort_keys=True).encode("utf-8")
+        ).hexdigest()[:32]
+
+    def store_file(self, key: str, destination: str) -> str:
+        """path of the stored image for an input key"""
+        extension = os.path.splitext(destination)[1].lower()
+        return os.path.join(self.cache_path, key[:2], key + extension)
+
+    def is_current(self, destination: str, key: str) -> bool:
+        """True if destination exists and was made from these inputs. An image
+        made before the cache is taken as current and recorded"""
+        with self.lock:
+            recorded_key = self.manifest.get(destination)
+            if not os.path.isfile(destination):
+                return False
+            if recorded_key is None:
+                self.manifest[destination] = key
+                self.changed = True
+                return True
+            return recorded_key == key
+
+    def record(self, destination: str, key: str):
+        """save the input key a destination image was made from"""
+        with self.lock:
+            self.manifest[destination] = key
+            self.changed = True
+
+    @staticmethod
+    def link(store_file: str, destination: str):
+        """hardlink a stored image into place, copy across filesystems"""
+        temp_file = destination + ".tmp"
+        try:
+            try:
+                os.link(store_file, temp_file)
+            except FileExistsError:
+                os.remove(temp_file)
+                os.link(store_file, temp_file)
+            except OSError:
+                copy2(store_file, temp_file)
+            os.replace(temp_file, destination)
+        except OSError as err:
+            raise SystemExit("ERROR: Can't link cached image: ") from err
+
+
+class CachedRenderer:
+    """renderer that skips images whose inputs have not changed and renders
+    identical images once. The backend renderer is created on first render."""
+
+    def __init__(
+        self,
+        render_cache: RenderCache,
+        backend: str,
+        font_path: str,
+        batch_size=0,
+        layer_path="",
+    ):
+        # disable too many arguments - pylint: disable=R0913,R0917
+        self.render_cache = render_cache
+        self.name = backend
+        self.batch_size = batch_size
+        self.layer_path = layer_path
+        self.backend_renderer = None
+        self.lock = threading.Lock()
+        self.fonts = FontFiles(font_path)
+
+    def get_backend_renderer(self):
+        """returns the backend renderer, created on first use"""
+        with self.lock:
+            if self.backend_renderer is None:
+                self.backend_renderer = make_renderer(
+                    self.name, self.fonts.font_path, self.batch_size, self.layer_path
+                )
+            return self.backend_renderer
+
+    def font_files(self, spec: dict) -> list:
+        """font files under font_path used by a spec, for either backend.
+        Without Pillow to read font names every font file there is used,
+        fonts imagemagick finds elsewhere are left out"""
+        if not load_pillow():
+            return self.fonts.all_files()
+        font_files = [
+            self.fonts.find(annotation["font"])
+            for annotation in spec["annotations"]
+            if "font" in annotation
+        ]
+        return [font_file for font_file in font_files if font_file]
+
+    def render(self, spec: dict) -> bool:
+        """write the image described by spec from the cache, rendering it
+        first if needed. Returns False if the destination was current"""
+        key = self.render_cache.input_key(spec, self.name, self.font_files(spec))
+        destination = spec["destination"]
+        if self.render_cache.is_current(destination, key):
+            return False
+
+        store_file = self.render_cache.store_file(key, destination)
+        if not os.path.isfile(store_file):
+            try:
+                os.makedirs(os.path.dirname(store_file), exist_ok=True)
+            except OSError as err:
+                raise SystemExit("ERROR: Can't create render cache: ") from err
+            # keep the extension, imagemagick picks the format from it
+            temp_file = f"{store_file}.{threading.get_ident()}.tmp" + (
+                os.path.splitext(destination)[1]
+            )
+            render_image(
+                {**spec, "destination": temp_file}, self.get_backend_renderer()
+            )
+            os.replace(temp_file, store_file)
+
+        self.render_cache.link(store_file, destination)
+        self.render_cache.record(destination, key)
+        return True
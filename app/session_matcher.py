@@ -0,0 +1,77 @@
+#!/usr/bin/python
+"""motorsort session_matcher.py"""
+
+import re
+
+
+def trie_pattern(keys) -> str:
+    """build a regex that matches the longest of keys at a position, nested
+    by common prefix so each character is tested once"""
+    trie = {}
+    for key in keys:
+        node = trie
+        for char in key:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def node_pattern(node) -> str:
+        branches = [
+            re.escape(char) + node_pattern(child)
+            for char, child in sorted(node.items())
+            if char
+        ]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        # a key ends here, longer keys are still tried first
+        if "" in node:
+            return f"(?:{pattern})?"
+        return pattern
+
+    return node_pattern(trie)
+
+
+class SessionMatcher:
+    """session_map compiled once. Finds every session key in a file name with
+    a single regex scan, then picks the key the same way the original search
+    over session_map did."""
+
+    def __init__(self, session_map: dict):
+        self.session_map = session_map
+        self.key_order = {key: order for order, key in enumerate(session_map)}
+        keys = [key for key in session_map if key]
+        # searched again from the next character after each match, so
+        # overlapping keys are all found. Not a zero width lookahead, the
+        # regex engine skips ahead to characters a key can start with
+        self.pattern = re.compile(trie_pattern(keys))
+        # a key found at a position also means every key inside it was found
+        self.contained_keys = {
+            key: [other for other in keys if other in key] for key in keys
+        }
+        self.split_patterns = {key: re.compile(key, re.IGNORECASE) for key in keys}
+
+    def find_keys(self, race_info: str) -> list:
+        """returns every session key found in race_info, in session_map order"""
+        found = set()
+        search = self.pattern.search
+        match = search(race_info)
+        while match:
+            found.update(self.contained_keys[match.group()])
+            match = search(race_info, match.start() + 1)
+        return sorted(found, key=self.key_order.get)
+
+    def match(self, race_info: str) -> tuple:
+        """returns race_name, race_session and the remaining race_info"""
+        race_info = race_info.replace(".", " ").lower()
+        race_session = ""
+        session_key = None
+        for key in self.find_keys(race_info):
+            if len(race_session) <= len(key):
+                race_session = self.session_map[key]
+                session_key = key
+
+        if session_key is None:
+            return "", "", ""
+
+        race_details = self.split_patterns[session_key].split(race_info)
+        return race_details[0].title(), race_session, race_details[-1].upper()
@@ -34,6 +34,13 @@ if [ ! -f /custom/fonts.json ]; then
     cp /config/fonts.json /custom/fonts.json
 fi
 
+# in watch mode sort new files as they arrive instead of sleeping
+#
+if [ "$WATCH_MODE" == "True" ]; then
+    echo "$(date): Starting in watch mode"
+    exec python watcher.py
+fi
+
 # if env var set use that, otherwise use default
 #
 if [ ! $SLEEP_SECONDS ]; then
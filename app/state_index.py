@@ -0,0 +1,181 @@
+#!/usr/bin/python
+"""motorsort state_index.py"""
+
+import os
+import json
+from weekend import Weekend
+
+
+class StateIndex:
+    """persistent record of source files that have already been sorted"""
+
+    # weekend fields saved with each entry
+    race_fields = Weekend.fields
+
+    # weekend fields saved with each failed file, enough to retry it when
+    # its weekend becomes a sprint weekend
+    failed_fields = ("race_series", "race_season", "race_round")
+
+    # index file layout, older files hold only the entries
+    version = 2
+
+    def __init__(self, index_file):
+        self.index_file = index_file
+        self.entries = {}
+        self.sprint_weekends = set()
+        # source files that could not be parsed, skipped until they or the
+        # lookup tables change
+        self.failed = {}
+        self.changed = False
+
+    def load(self):
+        """read the index from disk, start empty if missing or unreadable"""
+        self.entries = {}
+        self.sprint_weekends = set()
+        self.failed = {}
+        try:
+            with open(self.index_file, "r", encoding="utf-8") as file:
+                index = json.load(file)
+        except FileNotFoundError:
+            index = {"version": self.version, "entries": {}, "sprint_weekends": []}
+        except (OSError, ValueError) as err:
+            print(f"WARNING: Can't read state index, rebuilding: {err}")
+            index = {"version": self.version, "entries": {}, "sprint_weekends": []}
+
+        if index.get("version") == self.version:
+            self.entries = index["entries"]
+            self.sprint_weekends = {
+                tuple(sprint_weekend) for sprint_weekend in index["sprint_weekends"]
+            }
+            self.failed = index.get("failed", {})
+        else:
+            # sprint weekends were not saved, they are found again on next sort
+            self.entries = index
+            self.sprint_weekends = None
+        self.changed = False
+        return self
+
+    def save(self):
+        """write the index to disk if it changed, replacing it atomically"""
+        if not self.changed:
+            return
+
+        temp_file = self.index_file + ".tmp"
+        try:
+            with open(temp_file, "w", encoding="utf-8") as file:
+                json.dump(
+                    {
+                        "version": self.version,
+                        "entries": self.entries,
+                        "sprint_weekends": sorted(self.sprint_weekends or ()),
+                        "failed": self.failed,
+                    },
+                    file,
+                    separators=(",", ":"),
+                )
+            os.replace(temp_file, self.index_file)
+        except OSError as err:
+            raise SystemExit("ERROR: Can't write state index: ") from err
+        self.changed = False
+
+    @staticmethod
+    def file_signature(source_stat) -> list:
+        """inode, size, and mtime identify an unchanged source file"""
+        return [source_stat.st_ino, source_stat.st_size, source_stat.st_mtime_ns]
+
+    def is_current(self, source_file_name: str, source_stat) -> bool:
+        """True if the source file was sorted, has not changed since, and its
+        link or copy in the destination is still there"""
+        entry = self.entries.get(source_file_name)
+        if entry is None or entry["signature"] != self.file_signature(source_stat):
+            return False
+        return os.path.exists(entry.get("destination", ""))
+
+    def get_entry(self, source_file_name: str) -> dict:
+        """returns the saved entry for a source file, or None"""
+        return self.entries.get(source_file_name)
+
+    def record(self, source_file_name: str, source_stat, race):
+        """save a sorted source file with its parsed fields and destination"""
+        self.entries[source_file_name] = {
+            "signature": self.file_signature(source_stat),
+            "race": {key: race.get_kv(key) for key in self.race_fields},
+            "destination": race.get_destination_full_path(),
+        }
+        self.failed.pop(source_file_name, None)
+        self.changed = True
+
+    def is_failed(self, source_file_name: str, source_stat, version: str) -> bool:
+        """True if the source file could not be parsed, and neither it nor
+        the lookup tables, identified by version, changed since"""
+        failure = self.failed.get(source_file_name)
+        if failure is None:
+            return False
+        return failure["version"] == version and failure[
+            "signature"
+        ] == self.file_signature(source_stat)
+
+    def record_failure(
+        self, source_file_name: str, source_stat, version: str, race, reason: str
+    ):
+        # disable too many arguments - pylint: disable=R0913,R0917
+        """save a source file that could not be parsed, and why"""
+        self.failed[source_file_name] = {
+            "signature": self.file_signature(source_stat),
+            "version": version,
+            "reason": reason,
+            "race": {key: getattr(race, key) or "" for key in self.failed_fields},
+        }
+        self.changed = True
+
+    def failed_by_reason(self) -> dict:
+        """failed source files grouped by reason"""
+        reasons = {}
+        for source_file_name, failure in sorted(self.failed.items()):
+            reasons.setdefault(failure["reason"], []).append(source_file_name)
+        return dict(sorted(reasons.items()))
+
+    def prune(self, source_file_names):
+        """drop entries for source files that no longer exist"""
+        keep = set(source_file_names)
+        for records in (self.entries, self.failed):
+            for source_file_name in list(records):
+                if source_file_name not in keep:
+                    del records[source_file_name]
+                    self.changed = True
+
+    def add_sprint_weekends(self, sprint_weekends):
+        """save season and round pairs of sprint weekends"""
+        if self.sprint_weekends is None:
+            self.sprint_weekends = set()
+            self.changed = True
+        if not self.sprint_weekends.issuperset(sprint_weekends):
+            self.sprint_weekends.update(sprint_weekends)
+            self.changed = True
+
+    @staticmethod
+    def in_weekends(race: dict, weekends, race_series: str) -> bool:
+        """True if saved race fields are of a series in the given season and
+        round pairs"""
+        return (
+            race["race_series"] == race_series
+            and (race["race_season"], race["race_round"]) in weekends
+        )
+
+    def invalidate_weekends(self, weekends, race_series: str) -> list:
+        """mark entries of a series in the given season and round pairs as
+        changed so they are sorted again, returns their source files. Failed
+        files of those weekends are parsed again too"""
+        if not weekends:
+            return []
+        for source_file_name, failure in list(self.failed.items()):
+            if self.in_weekends(failure["race"], weekends, race_series):
+                del self.failed[source_file_name]
+                self.changed = True
+        invalidated = []
+        for source_file_name, entry in self.entries.items():
+            if self.in_weekends(entry["race"], weekends, race_series):
+                entry["signature"] = None
+                invalidated.append(source_file_name)
+                self.changed = True
+        return sorted(invalidated)
@@ -0,0 +1,91 @@
+#!/usr/bin/python
+"""motorsort tokenizer.py"""
+
+import os
+import re
+from typing import NamedTuple
+
+# first four digit year in a file name, e.g. 2024
+YEAR_PATTERN = re.compile("(20|19)[0-9][0-9]")
+# round number, e.g. Round07 or Round.07
+ROUND_PATTERN = re.compile("Round.?[0-9][0-9]")
+# country some race series add to the race name, removed once
+NAME_NOISE = {"Formula 1": "Usa", "World Endurance Championship": "France"}
+
+
+class RaceTokens(NamedTuple):
+    """the race fields of one file name"""
+
+    race_series: str | None  # None if no series prefix matched
+    race_season: str
+    race_round: str
+    race_session: str  # session_map value, e.g. Qualifying
+    race_name: str
+    race_info: str
+    file_extension: str
+
+
+def cut(text: str, start: int, end: int) -> str:
+    """text without text[start:end], stripped"""
+    return (text[:start] + text[end:]).strip()
+
+
+def split_year(race_info: str) -> tuple:
+    """returns the season, 1970 if none is found, and race_info without it"""
+    race_year = YEAR_PATTERN.search(race_info)
+    if race_year is None:
+        return "1970", race_info
+    return race_year.group(), cut(race_info, *race_year.span())
+
+
+def split_round(race_info: str) -> tuple:
+    """returns the round, 00 if none is found, and race_info without it"""
+    race_round = ROUND_PATTERN.search(race_info)
+    if race_round is None:
+        return "00", race_info
+    return race_round.group()[-2:], cut(race_info, *race_round.span())
+
+
+def split_series(race_info: str, series_matcher) -> tuple:
+    """returns the race series, None if no prefix matches, and race_info
+    without the prefix"""
+    found = series_matcher.match(race_info)
+    if found is None:
+        return None, race_info
+    return found[1], race_info[len(found[0]) :].strip()
+
+
+class FileNameTokenizer:
+    """splits a file name into race fields with the compiled series and
+    session lookups. Each field is cut from one local string in the order
+    the original find_race_* chain used, so names do not change"""
+
+    # disable too few public methods - pylint: disable=R0903
+
+    def __init__(self, series_matcher, session_matcher):
+        self.series_matcher = series_matcher
+        self.session_matcher = session_matcher
+
+    def tokenize(self, file_name: str) -> RaceTokens:
+        """returns the race fields of a file name"""
+        file_name_path, file_extension = os.path.splitext(file_name)
+        race_info = os.path.basename(file_name_path).strip()
+
+        race_season, race_info = split_year(race_info)
+        race_series, race_info = split_series(race_info, self.series_matcher)
+        race_round, race_info = split_round(race_info)
+        race_name, race_session, race_info = self.session_matcher.match(race_info)
+
+        race_name = race_name.strip()
+        if race_series in NAME_NOISE:
+            race_name = race_name.replace(NAME_NOISE[race_series], "", 1).strip()
+
+        return RaceTokens(
+            race_series,
+            race_season,
+            race_round,
+            race_session.strip(),
+            race_name,
+            race_info.strip(),
+            file_extension.strip(),
+        )
@@ -0,0 +1,271 @@
+#!/usr/bin/python
+"""watch the source path for new files and sort them as they arrive"""
+
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+from motorsort import (
+    load_settings,
+    get_file_list,
+    is_source_file,
+    process_files,
+    refresh_images,
+    sort_source_path,
+    start_metrics,
+    report_metrics,
+    save_state,
+)
+from metrics import METRICS
+from config_cache import ConfigCache
+from state_index import StateIndex
+
+# inotify event flags, from linux/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+# writes are not watched, a download fires one per block written. The
+# debouncer checks the size of created files until it stops changing
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """report changed files under a path using linux inotify"""
+
+    def __init__(self, source_path):
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+        self.overflowed = False
+        for root, _, _ in os.walk(source_path):
+            self.add_watch(root)
+
+    def add_watch(self, path):
+        """watch a directory for file events"""
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            # directory removed before the watch was added
+            if err == errno.ENOENT:
+                return
+            raise OSError(err, "inotify_add_watch failed: " + path)
+        self.watches[wd] = path
+
+    def changes(self, timeout: float) -> set:
+        """wait up to timeout seconds, return paths of changed files"""
+        changed = set()
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return changed
+
+        buffer = os.read(self.fd, 65536)
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(buffer[offset : offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                self.overflowed = True
+                continue
+            if wd not in self.watches:
+                continue
+
+            path = os.path.join(self.watches[wd], name)
+            if mask & IN_ISDIR:
+                # watch new directories and pick up files already inside
+                for root, _, files in os.walk(path):
+                    self.add_watch(root)
+                    changed.update(os.path.join(root, file) for file in files)
+            else:
+                changed.add(path)
+        return changed
+
+    def close(self):
+        """stop watching"""
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """report changed files under a path by comparing directory walks"""
+
+    def __init__(self, source_path, interval: float):
+        self.source_path = source_path
+        self.interval = interval
+        self.overflowed = False
+        self.snapshot = self.scan()
+
+    def scan(self) -> dict:
+        """returns size and mtime of every file under the source path"""
+        snapshot = {}
+        for root, _, files in os.walk(self.source_path):
+            for file in files:
+                path = os.path.join(root, file)
+                try:
+                    source_stat = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (source_stat.st_size, source_stat.st_mtime_ns)
+        return snapshot
+
+    def changes(self, timeout: float) -> set:
+        """wait up to timeout seconds, return paths of changed files"""
+        time.sleep(min(timeout, self.interval))
+        snapshot = self.scan()
+        changed = {
+            path
+            for path, signature in snapshot.items()
+            if self.snapshot.get(path) != signature
+        }
+        self.snapshot = snapshot
+        return changed
+
+    def close(self):
+        """stop watching"""
+        self.snapshot = {}
+
+
+class Debouncer:
+    """hold changed files until they stop growing"""
+
+    def __init__(self, settle_seconds: float):
+        self.settle_seconds = settle_seconds
+        self.pending = {}
+
+    def touch(self, path: str, now: float):
+        """record activity on a file, restarting its settle time"""
+        self.pending[path] = (now, self.file_size(path))
+
+    @staticmethod
+    def file_size(path: str) -> int:
+        """returns the file size, or -1 if it is gone"""
+        try:
+            return os.stat(path).st_size
+        except OSError:
+            return -1
+
+    def ready(self, now: float) -> list:
+        """returns files with no activity for settle_seconds and a stable size"""
+        ready = []
+        for path, (last_seen, size) in list(self.pending.items()):
+            if now - last_seen < self.settle_seconds:
+                continue
+            current_size = self.file_size(path)
+            if current_size < 0:
+                del self.pending[path]
+            elif current_size != size:
+                # still being written without events, wait another period
+                self.pending[path] = (now, current_size)
+            else:
+                del self.pending[path]
+                ready.append(path)
+        return sorted(ready)
+
+
+def make_watcher(source_path, interval: float):
+    """use inotify when available, otherwise fall back to polling"""
+    if os.getenv("WATCH_POLLING", "False") != "True":
+        try:
+            return InotifyWatcher(source_path)
+        except (OSError, AttributeError) as err:
+            print(f"WARNING: inotify unavailable, polling instead: {err}")
+    return PollingWatcher(source_path, interval)
+
+
+def report_errors(errors: list):
+    """print the count of failed renders and copies, each was printed as it
+    failed. Watching goes on, failed files are retried when next touched"""
+    if errors:
+        print(f"ERROR: {len(errors)} image renders or copies failed.")
+
+
+def rescan(settings: dict, state_index, debouncer: Debouncer):
+    """touch every source file, and drop the state index entries of files
+    that are gone. The state index skips files already sorted"""
+    source_file_names = get_file_list(
+        settings["source_path"],
+        settings["file_prefix"],
+        settings["file_types"],
+        settings["ignore_pattern"],
+    )
+    state_index.prune(source_file_names)
+    for path in source_file_names:
+        debouncer.touch(path, time.monotonic())
+
+
+def sort_ready(ready: list, settings: dict, state_index):
+    """sort settled files, render images again where their inputs changed,
+    and save the state index"""
+    with METRICS.timer("run"):
+        errors = process_files([ready], settings, state_index)
+        with METRICS.timer("refresh_images"):
+            errors += refresh_images(settings, state_index)
+        save_state(settings, state_index)
+    # counters keep running totals across batches for scrapes
+    report_metrics(settings)
+    report_errors(errors)
+
+
+def main():
+    """sort the full source path once, then sort new files as they settle"""
+
+    config = ConfigCache(load_settings)
+    settings = config.get()
+    settle_seconds = float(os.getenv("WATCH_SETTLE_SECONDS", "30"))
+    poll_seconds = float(os.getenv("WATCH_POLL_SECONDS", "60"))
+    rescan_seconds = float(os.getenv("WATCH_RESCAN_SECONDS", "86400"))
+
+    if not os.path.isdir(str(settings["source_path"])):
+        raise SystemExit("ERROR, can't find source path: " + settings["source_path"])
+
+    watcher = make_watcher(settings["source_path"], poll_seconds)
+    debouncer = Debouncer(settle_seconds)
+    state_index = StateIndex(settings["state_index"]).load()
+    start_metrics(settings)
+
+    # catch up on anything that arrived while we were not watching
+    with METRICS.timer("run"):
+        errors = sort_source_path(settings, state_index)
+    report_metrics(settings)
+    report_errors(errors)
+    print(f"Watching: {settings['source_path']}")
+    next_rescan = time.monotonic() + rescan_seconds
+
+    while True:
+        changes = watcher.changes(min(settle_seconds, poll_seconds))
+        # config.ini or a json file edited while watching
+        lookup_version = settings["lookup_version"]
+        settings = config.get()
+        if settings["lookup_version"] != lookup_version:
+            # new lookups may match files that failed before, rescan for them
+            watcher.overflowed = True
+        for path in changes:
+            if is_source_file(path, settings):
+                debouncer.touch(path, time.monotonic())
+
+        if watcher.overflowed or time.monotonic() >= next_rescan:
+            # events were dropped, lookups changed, or files were deleted,
+            # which is not watched
+            watcher.overflowed = False
+            next_rescan = time.monotonic() + rescan_seconds
+            rescan(settings, state_index, debouncer)
+
+        ready = debouncer.ready(time.monotonic())
+        if ready:
+            sort_ready(ready, settings, state_index)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/python
+"""motorsort watermark.py"""
+
+import os
+import json
+import time
+import hashlib
+
+
+def directory_mtimes(source_path: str, ignore=None) -> dict:
+    """the mtime of every directory under source_path, None if missing.
+    Adding, removing, or renaming a file changes the mtime of its
+    directory, so files are not stat'ed. Ignored and symlinked directories
+    are skipped the way iter_file_batches skips them"""
+    mtimes = {}
+    directories = [source_path]
+    while directories:
+        directory = directories.pop()
+        try:
+            mtimes[directory] = os.stat(directory).st_mtime_ns
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if ignore is not None and ignore.match(entry.name):
+                        continue
+                    if entry.is_dir() and not entry.is_symlink():
+                        directories.append(entry.path)
+        except OSError:
+            mtimes[directory] = None
+    return mtimes
+
+
+def directories_changed(mtimes: dict) -> bool:
+    """True if a directory saved by directory_mtimes has a new mtime. A new
+    or removed subdirectory changes the mtime of its parent, so only the
+    saved directories are stat'ed, none are listed"""
+    for directory, mtime in mtimes.items():
+        try:
+            if os.stat(directory).st_mtime_ns != mtime:
+                return True
+        except OSError:
+            if mtime is not None:
+                return True
+    return False
+
+
+def file_stats(paths) -> str:
+    """hash of the size and mtime of each file, and of every file under
+    each directory, in the given paths"""
+    digest = hashlib.sha1()
+    paths = sorted(paths, reverse=True)
+    while paths:
+        path = paths.pop()
+        try:
+            if os.path.isdir(path):
+                with os.scandir(path) as entries:
+                    paths.extend(
+                        sorted((entry.path for entry in entries), reverse=True)
+                    )
+                continue
+            stat = os.stat(path)
+            digest.update(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode())
+        except OSError:
+            digest.update(f"{path}\0missing\0".encode())
+    return digest.hexdigest()
+
+
+def asset_paths(settings: dict) -> list:
+    """the custom images, track maps, flags, and fonts images are made from"""
+    return [
+        settings["image_path"],
+        settings["track_path"],
+        settings["flag_path"],
+        settings["font_path"],
+    ]
+
+
+def render_inputs(settings: dict) -> str:
+    """hash of what the images of every folder are made from: the assets,
+    config files, and render settings"""
+    return hashlib.sha1(
+        "\0".join(
+            [
+                file_stats(asset_paths(settings)),
+                file_stats(settings["config_files"]),
+                settings["render_backend"],
+                settings["poster_encoding"],
+                settings["background_encoding"],
+            ]
+        ).encode()
+    ).hexdigest()
+
+
+def settings_hash(settings: dict) -> str:
+    """hash of the plain settings, e.g. paths and flags from config.ini or
+    the environment. The json lookups are covered by their file stats"""
+    plain = sorted(
+        (key, value)
+        for key, value in settings.items()
+        if isinstance(value, (str, int, float, bool, list, tuple))
+    )
+    return hashlib.sha1(repr(plain).encode()).hexdigest()
+
+
+class Watermark:
+    """signature of what a run reads, saved after a run that finished
+    cleanly. A run that finds the same signature exits before it loads the
+    state index or walks the source files"""
+
+    # files modified this recently may still be written, run again
+    settle_seconds = 60
+
+    def __init__(self, watermark_file):
+        self.watermark_file = watermark_file
+        self.inputs = None
+
+    @staticmethod
+    def input_signature(settings: dict, source: dict = None) -> dict:
+        """source directory mtimes, custom images, fonts, and config. Taken
+        before a run, so changes made while it sorts start the next one.
+        The source directories are listed again unless source, the saved
+        mtimes of the same source_path, is still current"""
+        if (
+            not isinstance(source, dict)
+            or settings["source_path"] not in source
+            or directories_changed(source)
+        ):
+            source = directory_mtimes(
+                settings["source_path"], settings["ignore_pattern"]
+            )
+        return {
+            "source": source,
+            "assets": file_stats(asset_paths(settings)),
+            "config": file_stats(settings["config_files"]),
+            "settings": settings_hash(settings),
+        }
+
+    @staticmethod
+    def output_signature(settings: dict) -> dict:
+        """state index and series folders. Taken after a run, so only
+        changes made by something else start the next one"""
+        folders = [
+            settings["destination_path"] + "/" + series_name
+            for series_name in sorted(set(settings["series_prefix"].values()))
+        ]
+        return {
+            "state_index": file_stats([settings["state_index"]]),
+            "folders": hashlib.sha1(
+                "\0".join(
+                    f"{folder}\0{os.stat(folder).st_mtime_ns}"
+                    for folder in folders
+                    if os.path.isdir(folder)
+                ).encode()
+            ).hexdigest(),
+        }
+
+    def load(self) -> dict:
+        """the saved signature, empty if missing or unreadable"""
+        try:
+            with open(self.watermark_file, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def check(self, settings: dict) -> bool:
+        """True if nothing a run reads changed since the saved signature"""
+        saved = self.load()
+        self.inputs = self.input_signature(
+            settings, saved.get("inputs", {}).get("source")
+        )
+        return saved.get("inputs") == self.inputs and saved.get(
+            "outputs"
+        ) == self.output_signature(settings)
+
+    def is_settled(self, state_index) -> bool:
+        """False if a sorted file is still to be renamed or was modified
+        within settle_seconds, e.g. a download still being written"""
+        settled = time.time_ns() - self.settle_seconds * 1_000_000_000
+        for entry in state_index.entries.values():
+            if entry["signature"] is None or entry["signature"][2] > settled:
+                return False
+        return True
+
+    def update(self, settings: dict, state_index, errors: list):
+        """save the signature taken by check after a run without errors,
+        otherwise remove it so the next run sorts again"""
+        if errors or self.inputs is None or not self.is_settled(state_index):
+            self.clear()
+            return
+
+        temp_file = self.watermark_file + ".tmp"
+        try:
+            with open(temp_file, "w", encoding="utf-8") as file:
+                json.dump(
+                    {
+                        "inputs": self.inputs,
+                        "outputs": self.output_signature(settings),
+                    },
+                    file,
+                )
+            os.replace(temp_file, self.watermark_file)
+        except OSError as err:
+            raise SystemExit("ERROR: Can't write watermark: ") from err
+
+    def clear(self):
+        """remove the saved signature"""
+        try:
+            os.remove(self.watermark_file)
+        except FileNotFoundError:
+            pass
+        except OSError as err:
+            raise SystemExit("ERROR: Can't remove watermark: ") from err
@@ -1,87 +1,171 @@
 #!/usr/bin/python
 """motorsort weekend.py"""
 
-import glob
+import os
+import threading
+
+
+class DestinationIndex:
+    """event folders found in each series folder, listed once and shared by
+    every Weekend so the partial path search does not glob for each call"""
+
+    def __init__(self, read_destination=True):
+        self.read_destination = read_destination
+        self.series_folders = {}
+        self.lock = threading.Lock()
+        # changes when folders are added or forgotten, so cached folders of
+        # each Weekend are looked up again
+        self.generation = 0
+
+    @staticmethod
+    def round_key(folder_name: str) -> str:
+        """the season-round part of a folder name, e.g. 2024-07"""
+        return folder_name.split(" ", 1)[0]
+
+    def find(self, series_path: str, race_round: str):
+        """returns the existing folder for a season-round, or None"""
+        with self.lock:
+            if series_path not in self.series_folders:
+                try:
+                    folder_names = (
+                        sorted(os.listdir(series_path)) if self.read_destination else []
+                    )
+                except OSError:
+                    folder_names = []
+                folders = {}
+                for folder_name in folder_names:
+                    folders.setdefault(self.round_key(folder_name), folder_name)
+                self.series_folders[series_path] = folders
+            folder_name = self.series_folders[series_path].get(race_round)
+        if folder_name is None:
+            return None
+        return series_path + "/" + folder_name
+
+    def set_folders(self, series_path: str, folder_names):
+        """use a listing of a series folder made elsewhere"""
+        folders = {}
+        for folder_name in sorted(folder_names):
+            folders.setdefault(self.round_key(folder_name), folder_name)
+        with self.lock:
+            self.series_folders[series_path] = folders
+            self.generation += 1
+
+    def add(self, destination_folder: str):
+        """record a newly created event folder"""
+        series_path, folder_name = os.path.split(destination_folder)
+        with self.lock:
+            folders = self.series_folders.get(series_path)
+            if folders is not None and self.round_key(folder_name) not in folders:
+                folders[self.round_key(folder_name)] = folder_name
+                self.generation += 1
+
+    def clear(self):
+        """forget all folders, the next lookup lists the destination again"""
+        with self.lock:
+            self.series_folders = {}
+            self.generation += 1
+
+
+DESTINATION_INDEX = DestinationIndex()
 
 
 class Weekend:
-    """race weekend"""
+    """race weekend, a slotted record of the fields parsed from a file name.
+    The final file name and destination folder are built on first use and
+    kept until a field or the destination index changes"""
 
-    def __init__(self, destination_path):
-        self.event = {
-            "destination_path": destination_path,
-        }
+    # disable too many instance attributes - pylint: disable=R0902
+
+    # fields parsed from the file name, in the order they are saved
+    fields = (
+        "race_series",
+        "race_season",
+        "race_round",
+        "race_name",
+        "race_session",
+        "race_info",
+        "weekend_order",
+        "file_extension",
+    )
+
+    # built from the fields, not set by callers
+    derived = ("final_file_name", "destination_folder", "destination_generation")
+
+    __slots__ = fields + ("destination_path", "destination_index") + derived
+
+    def __init__(self, destination_path: str, destination_index=None):
+        self.destination_path = destination_path
+        self.destination_index: DestinationIndex = (
+            destination_index or DESTINATION_INDEX
+        )
+        # None until parsed from the file name
+        self.race_series: str | None = None
+        self.race_season: str | None = None
+        self.race_round: str | None = None
+        self.race_name: str | None = None
+        self.race_session: str | None = None
+        self.race_info: str | None = None
+        self.weekend_order: str | None = None
+        self.file_extension: str | None = None
+        self.final_file_name: str | None = None
+        self.destination_folder: str | None = None
+        self.destination_generation = 0
 
     def set_kv(self, key: str, value: str):
-        """set key value pairs for a race event"""
-        self.event[key] = value.strip()
+        """set key value pairs for a race event, derived names are built again
+        after any field changes"""
+        setattr(self, key, value.strip())
+        self.final_file_name = None
+        self.destination_folder = None
 
     def get_kv(self, key: str) -> str:
-        """returns the value of a key"""
-        return self.event[key]
+        """returns the value of a key, KeyError if it was not set"""
+        value = getattr(self, key)
+        if value is None:
+            raise KeyError(key)
+        return value
 
-    def get_race_name(self):
+    def get_race_name(self) -> str:
         """get race name"""
-        if self.event["race_series"] == "Formula 1":
-            return f'{self.event["race_name"]} GP'
-        return self.event["race_name"]
+        if self.race_series == "Formula 1":
+            return f"{self.race_name} GP"
+        return self.race_name
 
-    def get_final_file_name(self):
+    def get_final_file_name(self) -> str:
         """build final file name"""
-        return str(
-            self.get_race_name()
-            + " - S"
-            + self.event["race_round"]
-            + "E"
-            + self.event["weekend_order"]
-            + " - "
-            + self.event["race_session"]
-            + " ["
-            + self.event["race_info"].replace(".", " ").strip(" ")
-            + "]"
-            + self.event["file_extension"]
-        )
+        if self.final_file_name is None:
+            race_info = self.race_info.replace(".", " ").strip(" ")
+            self.final_file_name = (
+                f"{self.get_race_name()} - S{self.race_round}E{self.weekend_order}"
+                f" - {self.race_session} [{race_info}]{self.file_extension}"
+            )
+        return self.final_file_name
 
-    def get_destination_folder(self):
+    def get_destination_folder(self) -> str:
         """use an existing race_season + race_round directory even if race_name differs"""
+        if (
+            self.destination_folder is not None
+            and self.destination_generation == self.destination_index.generation
+        ):
+            return self.destination_folder
+        self.destination_generation = self.destination_index.generation
 
         # this is a partial path search to see if the race already exists with
         # a slightly different name. The Imola/Italian GP problem.
-        self.event["race_round_path"] = str(
-            self.event["destination_path"]
-            + "/"
-            + self.event["race_series"]
-            + "/"
-            + self.event["race_season"]
-            + "-"
-            + self.event["race_round"]
-        )
-        self.event["race_round_path_found"] = glob.glob(
-            self.event["race_round_path"] + "*"
-        )
+        series_path = f"{self.destination_path}/{self.race_series}"
+        race_round = f"{self.race_season}-{self.race_round}"
+        race_round_path_found = self.destination_index.find(series_path, race_round)
 
         # if a partial match is found use it, otherwise return the build up
         # path name.
-        if self.event["race_round_path_found"]:
-            self.event["destination_folder"] = str(
-                self.event["race_round_path_found"][0]
-            )
-            # print('Found existing race directory: ' + self.event["destination_folder"])
+        if race_round_path_found:
+            self.destination_folder = race_round_path_found
         else:
-            self.event["destination_folder"] = str(
-                self.event["destination_path"]
-                + "/"
-                + self.event["race_series"]
-                + "/"
-                + self.event["race_season"]
-                + "-"
-                + self.event["race_round"]
-                + " - "
-                + self.get_race_name()
+            self.destination_folder = (
+                f"{series_path}/{race_round} - {self.get_race_name()}"
             )
-            # print('Creating destination directory.')
-        return self.event["destination_folder"]
+        return self.destination_folder
 
-    def get_destination_full_path(self):
+    def get_destination_full_path(self) -> str:
         """get full path for destination files"""
-        return str(self.get_destination_folder() + "/" + self.get_final_file_name())
+        return f"{self.get_destination_folder()}/{self.get_final_file_name()}"
@@ -1,8 +1,60 @@
 """pytest conftest.py"""
 
 import os
+import re
+import json
+import pytest
+from config_cache import compile_lookups
 
 os.environ["MEDIA_SOURCE_PATH"] = "media/source_files/complete"
 os.environ["MEDIA_DESTINATION_PATH"] = "media/"
 os.environ["COPY_FILES"] = "False"
 os.environ["CONFIG_PATH"] = "config"
+
+
+@pytest.fixture(name="make_spec")
+def fixture_make_spec():
+    """builds an image spec, a base image resized to a destination. Other
+    spec keys are given as keyword arguments"""
+
+    def make_spec(destination, base_image="config/images/background.jpg", **spec):
+        return {
+            "base_image": base_image,
+            "size": (600, 900),
+            "blur": None,
+            "overlays": [],
+            "annotations": [],
+            "destination": destination,
+            **spec,
+        }
+
+    return make_spec
+
+
+@pytest.fixture(name="make_settings")
+def fixture_make_settings(tmp_path):
+    """builds settings with the lookups from config/ and paths in tmp_path.
+    Other settings are given as keyword arguments"""
+
+    def make_settings(**overrides):
+        settings = {
+            "source_path": f"{tmp_path}/source",
+            "destination_path": f"{tmp_path}/motorsort",
+            "sprint_weekends": ["2024-05"],
+            "file_types": (".mkv",),
+            "ignore_pattern": re.compile(r"\..*"),
+            "image_path": f"{tmp_path}/images",
+            "track_path": f"{tmp_path}/tracks",
+            "flag_path": f"{tmp_path}/flags",
+            "font_path": f"{tmp_path}/fonts",
+            "config_files": [f"{tmp_path}/config.ini"],
+            "state_index": f"{tmp_path}/state_index.json",
+            "copy_files": False,
+        }
+        for key in ("series_prefix", "weekend_order", "session_map"):
+            with open(f"config/{key}.json", encoding="utf-8") as file:
+                settings[key] = json.load(file)
+        settings.update(overrides)
+        return compile_lookups(settings)
+
+    return make_settings
@@ -0,0 +1,155 @@
+"""measure files per second for each parsing and path resolution stage
+
+run from the project root:
+    python -m tests.benchmarks.benchmark_parsing --sizes 10000 100000 1000000
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "app"))
+
+# pylint: disable=wrong-import-position
+from motorsort import get_file_list, find_sprint_weekends, parse_race
+from config_cache import compile_lookups
+from weekend import Weekend, DestinationIndex
+from tests.benchmarks.corpus import (
+    synthetic_names,
+    write_source_tree,
+    write_destination_tree,
+)
+
+
+def benchmark_settings(destination_path: str) -> dict:
+    """lookup tables from the default config directory"""
+    settings = {
+        "destination_path": destination_path,
+        "sprint_weekends": ["2024-05", "2024-06", "2024-11"],
+        "file_prefix": ("Formula1", "WEC", "LeMans24"),
+        "file_types": (".mkv", ".mp4"),
+    }
+    for key in ("series_prefix", "weekend_order", "session_map"):
+        with open(f"config/{key}.json", encoding="utf-8") as file:
+            settings[key] = json.load(file)
+    compile_lookups(settings)
+    return settings
+
+
+def stage_result(stage: str, files: int, seconds: float) -> dict:
+    """one line of the report"""
+    return {
+        "stage": stage,
+        "files": files,
+        "seconds": round(seconds, 4),
+        "files_per_sec": round(files / seconds) if seconds else 0,
+    }
+
+
+def run_benchmarks(names: list, work_path: str, tree_limit: int) -> list:
+    """time each stage over names, returns a list of stage results"""
+    settings = benchmark_settings(f"{work_path}/destination")
+    write_destination_tree(settings["destination_path"])
+    results = []
+
+    # walking is limited by how many empty files are worth creating
+    tree_names = names[:tree_limit]
+    write_source_tree(f"{work_path}/source", tree_names)
+    start = perf_counter()
+    source_file_names = get_file_list(
+        f"{work_path}/source", settings["file_prefix"], settings["file_types"]
+    )
+    results.append(
+        stage_result("get_file_list", len(source_file_names), perf_counter() - start)
+    )
+
+    start = perf_counter()
+    sprint_weekends = find_sprint_weekends(names, settings["sprint_weekends"])
+    results.append(
+        stage_result("find_sprint_weekends", len(names), perf_counter() - start)
+    )
+
+    destination_index = DestinationIndex()
+    timings = {"parse": 0.0, "get_final_file_name": 0.0, "get_destination_folder": 0.0}
+    parsed = 0
+    for name in names:
+        race = Weekend(settings["destination_path"], destination_index)
+        start = perf_counter()
+        try:
+            parse_race(race, settings, sprint_weekends, name)
+        except (ValueError, KeyError):
+            timings["parse"] += perf_counter() - start
+            continue
+        finished_parse = perf_counter()
+        race.get_final_file_name()
+        finished_name = perf_counter()
+        race.get_destination_folder()
+        finished = perf_counter()
+        timings["parse"] += finished_parse - start
+        timings["get_final_file_name"] += finished_name - finished_parse
+        timings["get_destination_folder"] += finished - finished_name
+        parsed += 1
+
+    results.append(stage_result("parse", len(names), timings["parse"]))
+    results.append(
+        stage_result("get_final_file_name", parsed, timings["get_final_file_name"])
+    )
+    results.append(
+        stage_result(
+            "get_destination_folder", parsed, timings["get_destination_folder"]
+        )
+    )
+    return results
+
+
+def print_report(size: int, results: list):
+    """print a files per second table for one corpus size"""
+    print(f"\n{size} files")
+    print(f"{'stage':<24}{'files':>10}{'seconds':>10}{'files/sec':>12}")
+    for result in results:
+        print(
+            f"{result['stage']:<24}{result['files']:>10}"
+            f"{result['seconds']:>10.3f}{result['files_per_sec']:>12}"
+        )
+
+
+def main(argv=None):
+    """run the benchmark for each size and print or save the report"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument(
+        "--names", metavar="FILE", help="benchmark real file names, one per line"
+    )
+    parser.add_argument(
+        "--tree-limit",
+        type=int,
+        default=100000,
+        help="most source files to create for the get_file_list stage",
+    )
+    parser.add_argument("--json", metavar="FILE", help="also save results as json")
+    args = parser.parse_args(argv)
+
+    if args.names:
+        with open(args.names, encoding="utf-8") as file:
+            corpora = {"names": [line.strip() for line in file if line.strip()]}
+    else:
+        corpora = {size: synthetic_names(size) for size in args.sizes}
+
+    report = {}
+    for label, names in corpora.items():
+        with tempfile.TemporaryDirectory() as work_path:
+            results = run_benchmarks(names, work_path, args.tree_limit)
+        print_report(len(names), results)
+        report[str(label)] = results
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
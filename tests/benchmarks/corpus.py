@@ -0,0 +1,56 @@
+"""synthetic release names and destination trees for benchmarks"""
+
+import os
+import json
+import random
+
+SERIES_PREFIXES = ("Formula1", "WEC", "LeMans24")
+RACE_NAMES = sorted(
+    os.path.splitext(file)[0].replace(" ", ".") for file in os.listdir("config/tracks")
+)
+TAILS = (
+    "FastChannelHD.1080p.50fps.X264.Multi-AOA11",
+    "WEB.1080p.h264.Multi-AOA11",
+    "SkyF1HD.1080p50",
+    "F1TV.2160p.HEVC",
+)
+
+with open("config/session_map.json", encoding="utf-8") as file:
+    SESSION_KEYS = list(json.load(file))
+
+
+def synthetic_names(count: int, seed: int = 1) -> list:
+    """release names across series, seasons, rounds and sessions"""
+    rng = random.Random(seed)
+    names = []
+    for _ in range(count):
+        session = rng.choice(SESSION_KEYS).replace(" ", ".").title()
+        names.append(
+            f"{rng.choice(SERIES_PREFIXES)}.{rng.randint(2018, 2025)}"
+            f".Round{rng.randint(1, 24):02}.{rng.choice(RACE_NAMES)}"
+            f".{session}.{rng.choice(TAILS)}.mkv"
+        )
+    return names
+
+
+def write_source_tree(source_path: str, names: list, per_folder: int = 500):
+    """create empty source files, split into download folders"""
+    for index, name in enumerate(names):
+        folder = f"{source_path}/batch{index // per_folder:05}"
+        if index % per_folder == 0:
+            os.makedirs(folder, exist_ok=True)
+        with open(f"{folder}/{name}", "w", encoding="utf-8"):
+            pass
+
+
+def write_destination_tree(destination_path: str, seed: int = 1):
+    """create existing event folders for every series, season and round"""
+    rng = random.Random(seed)
+    for series in ("Formula 1", "World Endurance Championship", "24 Hours of Le Mans"):
+        for season in range(2018, 2026):
+            for race_round in range(1, 25):
+                race_name = rng.choice(RACE_NAMES).replace(".", " ")
+                os.makedirs(
+                    f"{destination_path}/{series}/{season}-{race_round:02} - {race_name}",
+                    exist_ok=True,
+                )
@@ -0,0 +1,77 @@
+"""pytest test_asset_index.py"""
+
+import os
+import json
+from app.asset_index import AssetIndex
+from app.weekend import Weekend
+
+
+def make_race(race_name, race_season="2024"):
+
+    race = Weekend("motorsort")
+    race.set_kv("race_name", race_name)
+    race.set_kv("race_season", race_season)
+    return race
+
+
+def test_asset_index_image_fallback(tmp_path):
+
+    for file in ("imola-Poster.jpg", "2023-poster.jpg", "poster.jpg"):
+        (tmp_path / file).write_text("image")
+    asset_index = AssetIndex()
+
+    assert asset_index.find_image(str(tmp_path), make_race("Imola"), "poster") == (
+        f"{tmp_path}/imola-Poster.jpg"
+    )
+    assert asset_index.find_image(
+        str(tmp_path), make_race("Monza", "2023"), "poster"
+    ) == (f"{tmp_path}/2023-poster.jpg")
+    assert asset_index.find_image(str(tmp_path), make_race("Monza"), "poster") == (
+        f"{tmp_path}/poster.jpg"
+    )
+    assert asset_index.find_image(str(tmp_path), make_race("Monza"), "background") == (
+        f"{tmp_path}/background.jpg"
+    )
+
+
+def test_asset_index_refresh_on_directory_change(tmp_path):
+
+    asset_index = AssetIndex()
+
+    assert asset_index.find_track(str(tmp_path), make_race("Spa Francorchamps")) is None
+
+    (tmp_path / "Spa-Francorchamps.png").write_text("track")
+    os.utime(tmp_path, ns=(0, 0))
+    asset_index.refresh()
+
+    assert asset_index.find_track(str(tmp_path), make_race("Spa Francorchamps")) == (
+        f"{tmp_path}/Spa-Francorchamps.png"
+    )
+
+
+def test_asset_index_flag_aliases(tmp_path):
+
+    (tmp_path / "nl.png").write_text("flag")
+    (tmp_path / "us.png").write_text("flag")
+    (tmp_path / "great britain.png").write_text("flag")
+    (tmp_path / "country.json").write_text(
+        json.dumps(
+            [
+                {"capital": "Amsterdam", "code": "nl", "name": "Netherlands"},
+                {"capital": "Washington, D.C.", "code": "us", "name": "USA"},
+                {"capital": "Washington, D.C.", "code": "um", "name": "Islands"},
+            ]
+        )
+    )
+    asset_index = AssetIndex()
+
+    assert asset_index.find_flag(str(tmp_path), make_race("Great Britain")) == (
+        f"{tmp_path}/great britain.png"
+    )
+    assert asset_index.find_flag(str(tmp_path), make_race("Netherlands")) == (
+        f"{tmp_path}/nl.png"
+    )
+    assert asset_index.find_flag(str(tmp_path), make_race("Amsterdam")) == (
+        f"{tmp_path}/nl.png"
+    )
+    assert asset_index.find_flag(str(tmp_path), make_race("Washington DC")) is None
@@ -0,0 +1,25 @@
+"""pytest test_benchmark.py"""
+
+from tests.benchmarks.corpus import synthetic_names
+from tests.benchmarks.benchmark_parsing import run_benchmarks
+
+
+def test_synthetic_names_are_repeatable():
+
+    assert synthetic_names(50) == synthetic_names(50)
+    assert synthetic_names(50) != synthetic_names(50, seed=2)
+
+
+def test_run_benchmarks_reports_every_stage(tmp_path):
+
+    results = run_benchmarks(synthetic_names(200), str(tmp_path), 100)
+
+    assert [result["stage"] for result in results] == [
+        "get_file_list",
+        "find_sprint_weekends",
+        "parse",
+        "get_final_file_name",
+        "get_destination_folder",
+    ]
+    assert results[0]["files"] <= 100
+    assert results[1]["files"] == 200
@@ -0,0 +1,120 @@
+"""pytest test_config_cache.py"""
+
+import os
+import json
+import pytest
+from app.config_cache import (
+    SeriesMatcher,
+    WeekendOrderIndex,
+    ConfigCache,
+    validate_lookups,
+    validate_settings,
+)
+
+
+def test_series_matcher_uses_first_matching_prefix():
+
+    series_matcher = SeriesMatcher(
+        {"Formula1": "Formula 1", "Le Mans": "24 Hours of Le Mans", "Le": "Other"}
+    )
+
+    assert series_matcher.match("Formula1.2024.Round07") == ("Formula1", "Formula 1")
+    assert series_matcher.match("Le Mans.2024") == ("Le Mans", "24 Hours of Le Mans")
+    assert series_matcher.match("Le.Mans.2024") == ("Le", "Other")
+    assert series_matcher.match("WEC.2024") is None
+
+
+def test_weekend_order_index():
+
+    weekend_order_index = WeekendOrderIndex(
+        {"regular_order": ["Free Practice 1", "Qualifying", "Race"]}
+    )
+
+    assert weekend_order_index.position("regular_order", "Race") == 3
+    with pytest.raises(ValueError):
+        weekend_order_index.position("regular_order", "Sprint")
+
+
+def test_validate_lookups():
+
+    with open("config/weekend_order.json") as file:
+        weekend_order = json.load(file)
+    settings = {
+        "series_prefix": {"Formula1": "Formula 1"},
+        "session_map": {"fp1": "Free Practice 1"},
+        "fonts": {"title": "Titillium-Web-Bold"},
+        "weekend_order": weekend_order,
+    }
+
+    assert validate_lookups(settings) == []
+
+    settings["session_map"] = ["fp1"]
+    settings["weekend_order"] = {
+        "sprint_order": ["Race", "Race"],
+        "regular_order": ["Race"],
+    }
+
+    assert validate_lookups(settings) == [
+        "session_map must be a JSON object",
+        "weekend_order sprint_order lists a session twice",
+        "weekend_order is missing the sportscar_order list",
+    ]
+
+
+def test_config_cache_reloads_changed_files(tmp_path):
+
+    config_file = tmp_path / "config.ini"
+    config_file.write_text("1")
+    loads = []
+
+    def load():
+        if config_file.read_text() == "bad":
+            raise SystemExit("ERROR: Bad config:")
+        loads.append(config_file.read_text())
+        return {"config_files": [str(config_file)], "value": loads[-1]}
+
+    config = ConfigCache(load)
+
+    assert config.get()["value"] == "1"
+    assert config.get()["value"] == "1"
+    assert loads == ["1"]
+
+    config_file.write_text("bad")
+    os.utime(config_file, ns=(1, 1))
+
+    assert config.get()["value"] == "1"
+
+    config_file.write_text("2")
+    os.utime(config_file, ns=(2, 2))
+
+    assert config.get()["value"] == "2"
+    assert loads == ["1", "2"]
+
+
+def test_validate_settings_refuses_caches_over_the_media(make_settings):
+
+    settings = make_settings(
+        copy_workers=2,
+        pipeline_workers=0,
+        render_workers=4,
+        render_batch=0,
+        render_backend="imagemagick",
+        poster_encoding="png",
+        background_encoding="jpg",
+        fonts={"title": "Titillium-Web-Bold"},
+    )
+    settings["render_cache"] = settings["destination_path"] + "/.motorsort/render_cache"
+    settings["layer_cache"] = settings["destination_path"] + "/.motorsort/layer_cache"
+
+    assert validate_settings(settings) == []
+
+    # the default layout keeps the sources under the destination
+    settings["source_path"] = settings["destination_path"] + "/source_files"
+    settings["render_cache"] = settings["destination_path"] + "/"
+    settings["layer_cache"] = settings["destination_path"]
+    assert validate_settings(settings) == [
+        "render_cache can't be or contain destination_path",
+        "render_cache can't be or contain source_path",
+        "layer_cache can't be or contain destination_path",
+        "layer_cache can't be or contain source_path",
+    ]
@@ -0,0 +1,68 @@
+"""pytest test_copier.py"""
+
+import os
+import errno
+from app import copier
+from app.copier import copy_file, partial_name
+
+
+def write_source(tmp_path, size=3 * 1024 * 1024):
+
+    source = tmp_path / "Formula1.2022.Round00.Example.Race.mkv"
+    source.write_bytes(os.urandom(size))
+    return source
+
+
+def test_copy_file(tmp_path):
+
+    source = write_source(tmp_path)
+    destination = tmp_path / "Example GP - S00E09 - Race.mkv"
+
+    copied = copy_file(str(source), str(destination), verify=True)
+
+    assert copied == source.stat().st_size
+    assert destination.read_bytes() == source.read_bytes()
+    assert destination.stat().st_mtime_ns == source.stat().st_mtime_ns
+    assert not os.path.exists(partial_name(str(destination)))
+
+
+def test_copy_file_resumes_partial_copy(tmp_path):
+
+    source = write_source(tmp_path)
+    destination = tmp_path / "Example GP - S00E09 - Race.mkv"
+    with open(partial_name(str(destination)), "wb") as file:
+        file.write(source.read_bytes()[: 2 * 1024 * 1024])
+
+    copied = copy_file(str(source), str(destination))
+
+    assert copied == 1024 * 1024
+    assert destination.read_bytes() == source.read_bytes()
+
+
+def test_copy_file_restarts_mismatched_partial_copy(tmp_path):
+
+    source = write_source(tmp_path)
+    destination = tmp_path / "Example GP - S00E09 - Race.mkv"
+    with open(partial_name(str(destination)), "wb") as file:
+        file.write(b"\0" * 1024)
+
+    copied = copy_file(str(source), str(destination))
+
+    assert copied == source.stat().st_size
+    assert destination.read_bytes() == source.read_bytes()
+
+
+def test_copy_file_falls_back_to_read_write(tmp_path, monkeypatch):
+
+    def unsupported(*_):
+        raise OSError(errno.EXDEV, "cross device")
+
+    monkeypatch.setattr(copier, "reflink", lambda *_: False)
+    monkeypatch.setattr(copier.os, "copy_file_range", unsupported)
+    monkeypatch.setattr(copier.os, "sendfile", unsupported)
+    source = write_source(tmp_path)
+    destination = tmp_path / "Example GP - S00E09 - Race.mkv"
+
+    copy_file(str(source), str(destination))
+
+    assert destination.read_bytes() == source.read_bytes()
@@ -0,0 +1,66 @@
+"""pytest test_image_encoding.py"""
+
+import pytest
+from app.image_encoding import (
+    parse_encoding,
+    convert_options,
+    pillow_save_options,
+    remove_other_formats,
+)
+
+
+def test_parse_encoding():
+
+    assert parse_encoding("png") == {"format": "png"}
+    assert parse_encoding("WEBP quality=80 strip") == {
+        "format": "webp",
+        "quality": 80,
+        "strip": True,
+    }
+    for text in ("", "gif", "jpg quality=101", "jpg strip=1", "png level=9"):
+        with pytest.raises(ValueError):
+            parse_encoding(text)
+
+
+def test_encoding_options_per_format():
+
+    encoding = {"quality": 80, "progressive": True, "strip": True, "compress_level": 9}
+
+    assert convert_options({"encoding": encoding, "destination": "a/show.jpg"}) == [
+        "-quality",
+        "80",
+        "-interlace",
+        "Plane",
+        "-strip",
+    ]
+    assert convert_options({"encoding": encoding, "destination": "a/show.png"}) == [
+        "-define",
+        "png:compression-level=9",
+        "-strip",
+    ]
+    assert convert_options({"destination": "a/show.png"}) == []
+
+    assert pillow_save_options({"destination": "a/background.jpg"}) == {
+        "quality": 92,
+        "progressive": False,
+    }
+    assert pillow_save_options(
+        {"encoding": encoding, "destination": "a/show.webp"}
+    ) == {
+        "quality": 80,
+        "icc_profile": None,
+        "exif": b"",
+    }
+
+
+def test_remove_other_formats(tmp_path):
+
+    for name in ("show.png", "show.jpg", "background.jpg", "show.webp"):
+        (tmp_path / name).write_text("")
+
+    remove_other_formats(f"{tmp_path}/show.webp")
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "background.jpg",
+        "show.webp",
+    ]
@@ -0,0 +1,63 @@
+"""pytest test_metrics.py"""
+
+from urllib.request import urlopen
+from app.metrics import Metrics, serve_metrics
+
+
+def test_metrics_counters_and_summary():
+
+    metrics = Metrics()
+    metrics.count("files_seen")
+    metrics.count("files_seen")
+    metrics.count("bytes_copied", 1024)
+    metrics.observe("parse", 0.002)
+    metrics.observe("parse", 0.004)
+
+    summary = metrics.summary().splitlines()
+
+    assert summary[0] == "Summary: bytes_copied=1024 files_seen=2"
+    assert summary[1] == "Stage parse: count=2 total=0.006s mean=0.0030s max=0.0040s"
+
+
+def test_metrics_timer_records_on_error():
+
+    metrics = Metrics()
+    try:
+        with metrics.timer("link"):
+            raise OSError("link failed")
+    except OSError:
+        pass
+
+    assert metrics.stages["link"]["count"] == 1
+
+
+def test_metrics_prometheus_histogram_is_cumulative(tmp_path):
+
+    metrics = Metrics()
+    metrics.count("files_parsed", 3)
+    metrics.observe("render_pillow", 0.05)
+    metrics.observe("render_pillow", 2.0)
+    metrics.observe("render_pillow", 1000.0)
+
+    metrics.write_prometheus(f"{tmp_path}/motorsort.prom")
+    with open(f"{tmp_path}/motorsort.prom", "r", encoding="utf-8") as file:
+        lines = file.read().splitlines()
+
+    assert "motorsort_files_parsed_total 3" in lines
+    assert 'motorsort_stage_seconds_bucket{stage="render_pillow",le="0.1"} 1' in lines
+    assert 'motorsort_stage_seconds_bucket{stage="render_pillow",le="5.0"} 2' in lines
+    assert 'motorsort_stage_seconds_bucket{stage="render_pillow",le="+Inf"} 3' in lines
+    assert 'motorsort_stage_seconds_count{stage="render_pillow"} 3' in lines
+
+
+def test_serve_metrics():
+
+    server = serve_metrics(0)
+    try:
+        with urlopen(f"http://127.0.0.1:{server.server_port}/metrics") as response:
+            body = response.read().decode("utf-8")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert "# TYPE motorsort_stage_seconds histogram" in body
@@ -8,12 +8,21 @@ import pytest
 from app.motorsort import (
     main,
     get_file_list,
+    iter_file_batches,
+    ignore_pattern,
+    is_source_file,
     find_sprint_weekends,
+    update_sprint_weekends,
     build_images,
     link_files,
+    wait_for_renders,
+    read_ahead,
+    read_config,
+    sort_file,
 )
-from app.weekend import Weekend
-
+from concurrent.futures import ThreadPoolExecutor
+from app.weekend import Weekend, DestinationIndex
+from app.state_index import StateIndex
 
 config = ConfigParser()
 config.read("config/config.ini")
@@ -81,6 +90,83 @@ def test_get_destination_folder_partial_path_match(tmp_path):
     )
 
 
+def test_destination_index_lists_series_folder_once(tmp_path):
+
+    destination_index = DestinationIndex()
+    os.makedirs(f"{tmp_path}/motorsort/Formula 1/2024-07 - Imola GP")
+
+    race = Weekend(f"{tmp_path}/motorsort", destination_index)
+    race.set_kv("race_series", "Formula 1")
+    race.set_kv("race_name", "Italian")
+    race.set_kv("race_season", "2024")
+    race.set_kv("race_round", "07")
+
+    assert (
+        race.get_destination_folder()
+        == f"{tmp_path}/motorsort/Formula 1/2024-07 - Imola GP"
+    )
+
+    # folders created outside motorsort are seen after the index is cleared
+    os.makedirs(f"{tmp_path}/motorsort/Formula 1/2024-08 - Monaco GP")
+    race.set_kv("race_round", "08")
+    assert (
+        race.get_destination_folder()
+        == f"{tmp_path}/motorsort/Formula 1/2024-08 - Italian GP"
+    )
+    destination_index.clear()
+    assert (
+        race.get_destination_folder()
+        == f"{tmp_path}/motorsort/Formula 1/2024-08 - Monaco GP"
+    )
+
+
+def test_destination_index_add(tmp_path):
+
+    destination_index = DestinationIndex()
+    os.makedirs(f"{tmp_path}/motorsort/Formula 1")
+
+    race = Weekend(f"{tmp_path}/motorsort", destination_index)
+    race.set_kv("race_series", "Formula 1")
+    race.set_kv("race_name", "Imola")
+    race.set_kv("race_season", "2024")
+    race.set_kv("race_round", "07")
+    destination_index.add(race.get_destination_folder())
+    race.set_kv("race_name", "Italian")
+
+    assert (
+        race.get_destination_folder()
+        == f"{tmp_path}/motorsort/Formula 1/2024-07 - Imola GP"
+    )
+
+
+def test_weekend_builds_names_again_after_set_kv(tmp_path):
+
+    race = Weekend(f"{tmp_path}/motorsort", DestinationIndex())
+    for key, value in (
+        ("race_series", "Formula 1"),
+        ("race_season", "2024"),
+        ("race_round", "07"),
+        ("race_name", "Imola"),
+        ("race_session", "Race"),
+        ("race_info", ".WEB.1080p."),
+        ("weekend_order", "09"),
+        ("file_extension", ".mkv"),
+    ):
+        race.set_kv(key, value)
+
+    assert race.get_final_file_name() == "Imola GP - S07E09 - Race [WEB 1080p].mkv"
+    assert race.get_final_file_name() is race.get_final_file_name()
+
+    race.set_kv("race_session", " Sprint ")
+
+    assert race.get_destination_full_path() == (
+        f"{tmp_path}/motorsort/Formula 1/2024-07 - Imola GP/"
+        "Imola GP - S07E09 - Sprint [WEB 1080p].mkv"
+    )
+    with pytest.raises(KeyError):
+        Weekend(f"{tmp_path}/motorsort").get_kv("race_series")
+
+
 # def test_parse_file_name_formula_1_regular_weekend(tmp_path):
 #
 #     race = Weekend(f'{tmp_path}/motorsort')
@@ -186,6 +272,47 @@ def test_get_file_list(tmp_path):
     ]
 
 
+def test_iter_file_batches_prunes_ignored_paths(tmp_path):
+
+    for folder in ("b", "a", "a/Sample", "a/.hidden"):
+        os.makedirs(f"{tmp_path}/source/{folder}")
+    for name in (
+        "b/Formula1.2022.Round01.Race.mkv",
+        "a/Formula1.2022.Round00.Race.mkv",
+        "a/Formula1.2022.Round00.FP1.mkv",
+        "a/Formula1.2022.Round00.FP1.mkv.part",
+        "a/Sample/Formula1.2022.Round00.Race.mkv",
+        "a/.hidden/Formula1.2022.Round00.Race.mkv",
+        "a/notes.txt",
+    ):
+        open(f"{tmp_path}/source/{name}", "w").close()
+    ignore = ignore_pattern([".*", "sample", "*.part"])
+
+    assert list(
+        iter_file_batches(f"{tmp_path}/source", "Formula1", ".mkv", ignore)
+    ) == [
+        [
+            f"{tmp_path}/source/a/Formula1.2022.Round00.FP1.mkv",
+            f"{tmp_path}/source/a/Formula1.2022.Round00.Race.mkv",
+        ],
+        [f"{tmp_path}/source/b/Formula1.2022.Round01.Race.mkv"],
+    ]
+
+
+def test_is_source_file(tmp_path):
+
+    settings = {
+        "source_path": f"{tmp_path}/source",
+        "file_prefix": ("Formula1",),
+        "file_types": (".mkv",),
+        "ignore_pattern": ignore_pattern(["sample"]),
+    }
+
+    assert is_source_file(f"{tmp_path}/source/a/Formula1.Race.mkv", settings)
+    assert not is_source_file(f"{tmp_path}/source/Sample/Formula1.Race.mkv", settings)
+    assert not is_source_file(f"{tmp_path}/source/a/Formula1.Race.txt", settings)
+
+
 def test_find_sprint_weekends(tmp_path):
 
     source_file_names = [
@@ -206,15 +333,46 @@ def test_find_sprint_weekends(tmp_path):
         f"{tmp_path}/source/complete/Formula1.2022.Round00.Example.Teds.Sprint.Notebook.FastChannelHD.1080p.50fps.X264.Multi-AOA11.mkv",
     ]
 
-    assert find_sprint_weekends(source_file_names, weekends) == [
-        ("2025", "05"),
-        ("2025", "06"),
-        ("2025", "11"),
-        ("2025", "19"),
-        ("2025", "21"),
-        ("2025", "23"),
+    assert find_sprint_weekends(source_file_names, weekends) == {
+        ("2024", "05"),
+        ("2024", "06"),
+        ("2024", "11"),
+        ("2024", "19"),
+        ("2024", "21"),
+        ("2024", "23"),
         ("2022", "00"),
-    ]
+    }
+
+
+def test_update_sprint_weekends_resorts_new_sprint_weekend(tmp_path):
+
+    source_file = tmp_path / "Formula1.2022.Round00.Example.FP1.mkv"
+    source_file.write_text("video")
+    sprint_file = f"{tmp_path}/Formula1.2022.Round00.Example.Sprint.mkv"
+    race = Weekend(f"{tmp_path}/motorsort")
+    for key, value in (
+        ("race_series", "Formula 1"),
+        ("race_season", "2022"),
+        ("race_round", "00"),
+        ("race_name", "Example"),
+        ("race_session", "Free Practice 1"),
+        ("race_info", ""),
+        ("weekend_order", "01"),
+        ("file_extension", ".mkv"),
+    ):
+        race.set_kv(key, value)
+    state_index = StateIndex(f"{tmp_path}/state_index.json")
+    state_index.record(str(source_file), os.stat(source_file), race)
+    settings = {"sprint_weekends": ["2024-05"]}
+
+    sprint_weekends, resort = update_sprint_weekends(
+        [str(source_file), sprint_file], settings, state_index
+    )
+
+    assert sprint_weekends == {("2024", "05"), ("2022", "00")}
+    assert resort == [str(source_file)]
+    # already known, nothing to sort again
+    assert update_sprint_weekends([sprint_file], settings, state_index)[1] == []
 
 
 def test_build_images(tmp_path):
@@ -235,6 +393,24 @@ def test_build_images(tmp_path):
     )
 
 
+def test_wait_for_renders_collects_every_error():
+
+    def failed_render():
+        raise SystemExit("ERROR Imagemagic exit code: ")
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        renders = {
+            "dest/Formula 1/2024-01 - Bahrain GP": pool.submit(failed_render),
+            "dest/Formula 1/2024-02 - Saudi Arabia GP": pool.submit(lambda: None),
+            "dest/Formula 1/2024-03 - Australia GP": pool.submit(failed_render),
+        }
+
+    assert wait_for_renders(renders) == [
+        "ERROR: Can't create images for 2024-01 - Bahrain GP: ERROR Imagemagic exit code:",
+        "ERROR: Can't create images for 2024-03 - Australia GP: ERROR Imagemagic exit code:",
+    ]
+
+
 # def test_link_files(tmp_path):
 #
 #    race = Weekend(f'{tmp_path}/motorsort')
@@ -249,3 +425,86 @@ def test_build_images(tmp_path):
 #    link_files(race, source_file_name, copy_files)
 #
 #    assert os.path.exists(f'{tmp_path}/motorsort/Formula 1/2022-00 - Example GP/Example GP - S00E01 - Free Practice 1 [FastChannelHD 1080p 50fps X264 Multi-AOA11].mkv')
+
+
+def test_read_ahead_keeps_order_and_raises():
+
+    def batches():
+        yield ["a"]
+        yield ["b", "c"]
+        raise OSError("source path gone")
+
+    items = read_ahead(batches(), 1)
+
+    assert next(items) == ["a"]
+    assert next(items) == ["b", "c"]
+    with pytest.raises(OSError):
+        next(items)
+
+
+# the config.ini of the first release, before options were added
+FIRST_CONFIG = """
+[config]
+copy_files = False
+sprint_weekends = 2024-05
+file_types = .mkv,.mp4
+file_prefix = Formula1,WEC
+
+[paths]
+source_path = /mnt/media/source_files/complete
+destination_path = /mnt/media
+image_path = /custom/images
+track_path = /custom/tracks
+flag_path = /custom/flags
+font_path = /usr/local/share/fonts
+"""
+
+
+def test_read_config_without_newer_options():
+
+    old_config = ConfigParser()
+    old_config.read_string(FIRST_CONFIG)
+
+    settings = read_config(old_config)
+
+    assert settings["render_backend"] == "imagemagick"
+    assert settings["copy_workers"] == 2
+    assert settings["state_index"] == "/custom/state_index.json"
+    assert settings["render_cache"] == os.path.join(
+        settings["destination_path"], ".motorsort/render_cache"
+    )
+    assert settings["poster_encoding"] == "png"
+
+
+def test_read_config_empty_values_turn_features_off():
+
+    config = ConfigParser()
+    config.read_string(FIRST_CONFIG)
+    # render_cache = in config.ini
+    config.set("config", "render_cache", "")
+    config.set("config", "layer_cache", " ")
+    config.set("config", "watermark", "")
+    settings = read_config(config)
+
+    assert settings["render_cache"] == ""
+    assert settings["layer_cache"] == ""
+    assert settings["watermark"] == ""
+
+
+def test_sort_file_links_a_deleted_destination_again(tmp_path, make_settings):
+
+    settings = make_settings()
+    os.makedirs(settings["source_path"])
+    source_file = f"{settings['source_path']}/Formula1.2022.Round00.Example.FP1.mkv"
+    open(source_file, "w").close()
+    # the folder and its images exist, nothing is rendered
+    os.makedirs(f"{settings['destination_path']}/Formula 1/2022-00 - Example GP")
+    state_index = StateIndex(settings["state_index"])
+    queues = {"renders": {}, "copies": {}, "sprint_weekends": set()}
+
+    sort_file(source_file, settings, state_index, queues)
+    destination = state_index.get_entry(source_file)["destination"]
+    os.remove(destination)
+    sort_file(source_file, settings, state_index, queues)
+
+    assert os.path.samefile(source_file, destination)
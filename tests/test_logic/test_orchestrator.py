@@ -0,0 +1,93 @@
+"""pytest test_orchestrator.py"""
+
+import os
+import asyncio
+import pytest
+from app import orchestrator
+from app.orchestrator import AsyncImageMagickRenderer
+
+
+def make_convert(tmp_path, monkeypatch, exit_code=0):
+
+    convert = tmp_path / "bin" / "convert"
+    convert.parent.mkdir()
+    # write the destination, the last argument
+    convert.write_text(
+        f'#!/bin/sh\nfor a; do :; done\necho "$*" > "$a"\nexit {exit_code}\n'
+    )
+    convert.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{convert.parent}:{os.environ['PATH']}")
+
+
+def test_async_renderer_runs_convert_from_threads(tmp_path, monkeypatch, make_spec):
+
+    make_convert(tmp_path, monkeypatch)
+
+    async def render_all():
+        renderer = AsyncImageMagickRenderer(asyncio.get_running_loop(), 2)
+        await asyncio.gather(
+            *(
+                asyncio.to_thread(
+                    renderer.render,
+                    make_spec(f"{tmp_path}/{n}.jpg", f"{tmp_path}/background.jpg"),
+                )
+                for n in range(4)
+            )
+        )
+
+    asyncio.run(render_all())
+
+    for n in range(4):
+        assert (
+            (tmp_path / f"{n}.jpg")
+            .read_text()
+            .startswith(f"{tmp_path}/background.jpg -resize 600x900!")
+        )
+
+
+def test_async_renderer_raises_on_convert_error(tmp_path, monkeypatch, make_spec):
+
+    make_convert(tmp_path, monkeypatch, exit_code=1)
+
+    async def render():
+        renderer = AsyncImageMagickRenderer(asyncio.get_running_loop(), 1)
+        await renderer.render_async(
+            make_spec(f"{tmp_path}/poster.jpg", f"{tmp_path}/background.jpg")
+        )
+
+    with pytest.raises(SystemExit):
+        asyncio.run(render())
+
+
+def test_run_once_returns_errors_that_stop_the_sort(monkeypatch):
+
+    def bad_config():
+        raise SystemExit("ERROR: Bad config.ini:")
+
+    monkeypatch.setattr(orchestrator, "load_settings", bad_config)
+
+    assert asyncio.run(orchestrator.run_once()) == ["ERROR: Bad config.ini:"]
+
+
+def test_use_async_renderer_checks_convert_and_keeps_batches(tmp_path, monkeypatch):
+
+    settings = {
+        "render_backend": "imagemagick",
+        "render_workers": 2,
+        "render_batch": 0,
+        "render_cache": "",
+        "layer_cache": "",
+    }
+    monkeypatch.setenv("PATH", str(tmp_path))
+    with pytest.raises(SystemExit):
+        orchestrator.use_async_renderer(settings, None)
+
+    make_convert(tmp_path, monkeypatch)
+    batched = {**settings, "render_batch": 4}
+    orchestrator.use_async_renderer(batched, None)
+    orchestrator.use_async_renderer(settings, None)
+
+    # batches are drawn by the renderer get_renderer makes
+    assert "renderer" not in batched
+
+    assert isinstance(settings["renderer"], AsyncImageMagickRenderer)
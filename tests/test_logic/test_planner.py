@@ -0,0 +1,85 @@
+"""pytest test_planner.py"""
+
+import io
+import os
+import json
+from app.planner import parse_many, write_plan
+
+
+def test_parse_many(tmp_path, make_settings):
+
+    names = [
+        "Formula1.2022.Round04.Example.FP1.FastChannelHD.1080p.mkv",
+        "Formula1.2023.Round21.Example.FP2.FastChannelHD.1080p.mkv",
+        "Formula1.2023.Round21.Example.Sprint.FastChannelHD.1080p.mkv",
+        "WEC.2022.Round04.France.Example.Race.WEB.1080p.mkv",
+    ]
+
+    plan = parse_many(names, make_settings())
+
+    assert [parsed_race.final_file_name for parsed_race in plan] == [
+        "Example GP - S04E01 - Free Practice 1 [FASTCHANNELHD 1080P].mkv",
+        "Example GP - S21E06 - Free Practice 2 [FASTCHANNELHD 1080P].mkv",
+        "Example GP - S21E08 - Sprint [FASTCHANNELHD 1080P].mkv",
+        "Example - S04E08 - Race [WEB 1080P].mkv",
+    ]
+    assert plan[3].destination_folder == (
+        f"{tmp_path}/motorsort/World Endurance Championship/2022-04 - Example"
+    )
+    assert not os.path.exists(f"{tmp_path}/motorsort")
+
+
+def test_parse_many_reports_errors(make_settings):
+
+    plan = parse_many(
+        [
+            "Formula1.2022.Round04.Example.Unknown.Session.mkv",
+            "Other.2022.Round04.Example.Race.mkv",
+        ],
+        make_settings(),
+    )
+
+    assert [parsed_race.error for parsed_race in plan] == [
+        "session not found in weekend order",
+        "race series not found",
+    ]
+    assert plan[0].destination == ""
+
+
+def test_parse_many_shares_round_folder(tmp_path, make_settings):
+
+    plan = parse_many(
+        [
+            "Formula1.2024.Round07.Imola.FP1.mkv",
+            "Formula1.2024.Round07.Italian.Race.mkv",
+        ],
+        make_settings(),
+    )
+
+    assert plan[1].destination_folder == (
+        f"{tmp_path}/motorsort/Formula 1/2024-07 - Imola GP"
+    )
+
+
+def test_write_plan_csv(make_settings):
+
+    plan = parse_many(
+        ["Formula1.2022.Round04.Example.FP1.mkv"],
+        make_settings(),
+    )
+    output = io.StringIO()
+
+    assert write_plan(plan, output, "csv") == 1
+    assert output.getvalue().splitlines()[0].startswith("source,race_series,")
+
+
+def test_write_plan_jsonl(make_settings):
+
+    plan = parse_many(
+        ["Formula1.2022.Round04.Example.FP1.mkv"],
+        make_settings(),
+    )
+    output = io.StringIO()
+
+    assert write_plan(plan, output, "jsonl") == 1
+    assert json.loads(output.getvalue())["race_session"] == "Free Practice 1"
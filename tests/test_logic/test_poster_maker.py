@@ -3,10 +3,22 @@
 import pytest
 import os
 import shutil
+import subprocess
 import json
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
-from poster_maker import create_poster_image, create_background_image
+from shutil import which
+from poster_maker import (
+    create_poster_image,
+    create_background_image,
+    ImageMagickRenderer,
+    BatchImageMagickRenderer,
+    PillowRenderer,
+    LayerCache,
+    LayeredRenderer,
+)
 from app.weekend import Weekend
+from app.image_encoding import parse_encoding
 
 config = ConfigParser()
 config.read("config/config.ini")
@@ -223,3 +235,326 @@ def test_poster_maker_create_poster_image_with_default_poster_bkg_image(tmp_path
 
     assert os.path.isfile(f"{str(tmp_path)}/Le Mans/2222-01 - race_name/show.png")
     # assert 0  # uncomment to see tmp_paths
+
+
+def test_poster_maker_imagemagick_background_command(tmp_path):
+
+    race = Weekend(f"{tmp_path}")
+    race.set_kv("race_series", "Race Series")
+    race.set_kv("race_season", "2024")
+    race.set_kv("race_round", "01")
+    race.set_kv("race_name", "race_name")
+    renderer = ImageMagickRenderer()
+    commands = []
+    renderer.render = lambda spec: commands.append(renderer.command(spec))
+
+    create_background_image(race, font_list, image_path, renderer)
+
+    assert commands == [
+        [
+            "convert",
+            "config/images/background.jpg",
+            "-resize",
+            "1920x1080!",
+            "-gravity",
+            "NorthEast",
+            "-font",
+            "Titillium-Web-Bold",
+            "-pointsize",
+            "280",
+            "-fill",
+            "none",
+            "-stroke",
+            "white",
+            "-strokewidth",
+            "14",
+            "-annotate",
+            "+160+160",
+            "01",
+            f"{tmp_path}/Race Series/2024-01 - race_name/background.jpg",
+        ]
+    ]
+
+
+def test_poster_maker_background_encoding(tmp_path):
+
+    race = Weekend(f"{tmp_path}")
+    race.set_kv("race_series", "Race Series")
+    race.set_kv("race_season", "2024")
+    race.set_kv("race_round", "01")
+    race.set_kv("race_name", "race_name")
+    folder = f"{tmp_path}/Race Series/2024-01 - race_name"
+    os.makedirs(folder)
+    open(f"{folder}/background.jpg", "w").close()
+    renderer = ImageMagickRenderer()
+    commands = []
+    renderer.render = lambda spec: commands.append(renderer.command(spec))
+
+    create_background_image(
+        race, font_list, image_path, renderer, parse_encoding("webp quality=75")
+    )
+
+    assert commands[0][-3:] == ["-quality", "75", f"{folder}/background.webp"]
+    # the image in its old format is replaced
+    assert not os.path.exists(f"{folder}/background.jpg")
+
+
+def test_batch_command_reads_shared_inputs_once(make_spec):
+
+    command = BatchImageMagickRenderer.batch_command(
+        [
+            make_spec("a/show.png"),
+            make_spec("b/show.png"),
+            make_spec("c/show.png", "config/images/poster.jpg"),
+        ]
+    )
+
+    # the shared background is read once, the poster used once is not kept
+    assert command == [
+        "convert",
+        "-respect-parentheses",
+        "config/images/background.jpg",
+        "-write",
+        "mpr:input0",
+        "+delete",
+        "(",
+        "mpr:input0",
+        "-resize",
+        "600x900!",
+        ")",
+        "-write",
+        "a/show.png",
+        "+delete",
+        "(",
+        "mpr:input0",
+        "-resize",
+        "600x900!",
+        ")",
+        "-write",
+        "b/show.png",
+        "+delete",
+        "(",
+        "config/images/poster.jpg",
+        "-resize",
+        "600x900!",
+        ")",
+        "c/show.png",
+    ]
+
+
+def test_batch_command_encodes_each_spec(make_spec):
+
+    spec = make_spec("a/show.jpg")
+    spec["encoding"] = {"quality": 80, "progressive": True}
+
+    command = BatchImageMagickRenderer.batch_command([spec, make_spec("b/show.jpg")])
+
+    # encoding settings follow the parentheses and are reset for the next spec
+    assert command[6:] == [
+        "(",
+        "mpr:input0",
+        "-resize",
+        "600x900!",
+        ")",
+        "-quality",
+        "80",
+        "-interlace",
+        "Plane",
+        "+define",
+        "png:compression-level",
+        "-write",
+        "a/show.jpg",
+        "+delete",
+        "(",
+        "mpr:input0",
+        "-resize",
+        "600x900!",
+        ")",
+        "+quality",
+        "+interlace",
+        "+define",
+        "png:compression-level",
+        "b/show.jpg",
+    ]
+
+
+def test_batch_renderer_reports_each_error(tmp_path, monkeypatch, make_spec):
+
+    convert = tmp_path / "bin" / "convert"
+    convert.parent.mkdir()
+    # write each -write file and the last argument, fail on missing.jpg
+    convert.write_text(
+        "#!/bin/sh\n"
+        'for a; do case "$a" in missing.jpg) exit 1;; esac; done\n'
+        'w=""; for a; do [ -n "$w" ] && echo x > "$a"; [ "$a" = -write ]'
+        ' && w=1 || w=""; done\n'
+        'echo x > "$a"\n'
+    )
+    convert.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{convert.parent}:{os.environ['PATH']}")
+    renderer = BatchImageMagickRenderer(4, batch_wait=1)
+    specs = [make_spec(f"{tmp_path}/{n}.png") for n in range(3)]
+    specs.append(make_spec(f"{tmp_path}/bad.png", "missing.jpg"))
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        renders = [pool.submit(renderer.render, spec) for spec in specs]
+
+    for n in range(3):
+        assert renders[n].result() is None
+        assert (tmp_path / f"{n}.png").exists()
+    with pytest.raises(SystemExit):
+        renders[3].result()
+
+
+def test_poster_maker_pillow_renderer(tmp_path):
+
+    image = pytest.importorskip("PIL.Image")
+    race = Weekend(f"{tmp_path}")
+    race.set_kv("race_round", "01")
+    race.set_kv("race_season", "2023")
+    race.set_kv("race_name", "COTA")
+    race.set_kv("race_series", "Formula 1")
+    renderer = PillowRenderer(font_path)
+
+    create_poster_image(race, font_list, track_path, flag_path, image_path, renderer)
+    create_background_image(race, font_list, image_path, renderer)
+
+    with image.open(f"{tmp_path}/Formula 1/2023-01 - COTA GP/show.png") as poster:
+        assert poster.size == (600, 900)
+    with image.open(f"{tmp_path}/Formula 1/2023-01 - COTA GP/background.jpg") as bkg:
+        assert bkg.size == (1920, 1080)
+
+
+def test_poster_maker_pillow_matches_imagemagick(tmp_path):
+
+    image = pytest.importorskip("PIL.Image")
+    image_stat = pytest.importorskip("PIL.ImageStat")
+    image_chops = pytest.importorskip("PIL.ImageChops")
+    if not which("convert"):
+        pytest.skip("imagemagick convert not found in path")
+
+    for renderer in (ImageMagickRenderer(), PillowRenderer(font_path)):
+        race = Weekend(f"{tmp_path}/{renderer.name}")
+        race.set_kv("race_round", "01")
+        race.set_kv("race_season", "2023")
+        race.set_kv("race_name", "COTA")
+        race.set_kv("race_series", "Formula 1")
+        create_poster_image(
+            race, font_list, track_path, flag_path, image_path, renderer
+        )
+        create_background_image(race, font_list, image_path, renderer)
+
+    for file_name in ("show.png", "background.jpg"):
+        with image.open(
+            f"{tmp_path}/imagemagick/Formula 1/2023-01 - COTA GP/{file_name}"
+        ) as expected, image.open(
+            f"{tmp_path}/pillow/Formula 1/2023-01 - COTA GP/{file_name}"
+        ) as actual:
+            difference = image_chops.difference(
+                expected.convert("RGB"), actual.convert("RGB")
+            )
+            # text rasterization differs slightly, the layout must not
+            assert max(image_stat.Stat(difference).mean) < 8
+
+
+class RecordingRenderer:
+    """records each spec and writes an empty destination"""
+
+    name = "recording"
+
+    def __init__(self):
+        self.specs = []
+
+    def render(self, spec):
+        self.specs.append(spec)
+        with open(spec["destination"], "w", encoding="utf-8"):
+            pass
+
+
+def test_layered_renderer_reuses_layers(tmp_path, make_spec):
+
+    backend = RecordingRenderer()
+    renderer = LayeredRenderer(backend, LayerCache(f"{tmp_path}/layers"))
+    spec = make_spec(f"{tmp_path}/show.png")
+    spec["blur"] = "0x4"
+    spec["overlays"].append(
+        {"image": "config/tracks/Austria.png", "gravity": "Center", "geometry": "+0"}
+    )
+
+    renderer.render({**spec, "annotations": [{"text": "01"}]})
+    renderer.render({**spec, "annotations": [{"text": "02"}]})
+
+    # the layer is rendered once without annotations, then only annotated
+    layer, first, second = backend.specs
+    assert layer["annotations"] == [] and layer["blur"] == "0x4"
+    assert layer["encoding"] == {"compress_level": 1}
+    for final in (first, second):
+        assert final["base_image"].startswith(f"{tmp_path}/layers/")
+        assert os.path.isfile(final["base_image"])
+        assert (final["size"], final["blur"], final["overlays"]) == (None, None, [])
+        assert ImageMagickRenderer.operations({**final, "annotations": []}) == [
+            final["base_image"]
+        ]
+    assert second["annotations"] == [{"text": "02"}]
+
+
+class FailingRenderer(RecordingRenderer):
+    """writes part of the destination, then fails"""
+
+    def render(self, spec):
+        super().render(spec)
+        raise SystemExit("ERROR Imagemagic exit code: ")
+
+
+def test_layer_cache_removes_failed_and_unused_layers(tmp_path, make_spec):
+
+    layer_cache = LayerCache(f"{tmp_path}/layers")
+    spec = make_spec(f"{tmp_path}/show.png")
+    spec["blur"] = "0x4"
+
+    with pytest.raises(SystemExit):
+        layer_cache.apply(spec, FailingRenderer())
+    for _, _, files in os.walk(f"{tmp_path}/layers"):
+        assert files == []
+
+    layer = layer_cache.apply(spec, RecordingRenderer())["base_image"]
+    unused = layer_cache.layer_file("00" * 16)
+    os.makedirs(os.path.dirname(unused))
+    shutil.copy(layer, unused)
+    killed = f"{unused}.1234.tmp.png"
+    shutil.copy(layer, killed)
+    # old media that found its way into the cache directory is left alone
+    foreign = [f"{tmp_path}/layers/Example.mkv", f"{tmp_path}/layers/00/Example.png"]
+    for path in foreign:
+        shutil.copy(layer, path)
+    old = os.stat(layer).st_mtime - 31 * 86400
+    for path in [layer, unused, killed, *foreign]:
+        os.utime(path, (old, old))
+    # a new cache, as in the next run, marks the layer used again
+    LayerCache(f"{tmp_path}/layers").apply(spec, RecordingRenderer())
+    layer_cache.prune()
+
+    assert os.path.isfile(layer)
+    assert not os.path.exists(unused) and not os.path.exists(killed)
+    for path in foreign:
+        assert os.path.isfile(path)
+
+
+def test_batch_renderer_reports_os_errors(tmp_path, monkeypatch, make_spec):
+
+    def missing_convert(*args, **kwargs):
+        raise FileNotFoundError("convert")
+
+    monkeypatch.setattr(subprocess, "check_output", missing_convert)
+    renderer = BatchImageMagickRenderer(2, batch_wait=1)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        renders = [
+            pool.submit(renderer.render, make_spec(f"{tmp_path}/{n}.png"))
+            for n in range(2)
+        ]
+
+    # each worker gets the error instead of waiting for its batch forever
+    for render in renders:
+        with pytest.raises(FileNotFoundError):
+            render.result(timeout=5)
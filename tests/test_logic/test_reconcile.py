@@ -0,0 +1,109 @@
+"""pytest test_reconcile.py"""
+
+import os
+from app.reconcile import (
+    scan_destination,
+    stat_sources,
+    make_plan,
+    reconcile,
+    apply_renames,
+)
+from app.state_index import StateIndex
+
+
+def test_reconcile_diff(tmp_path, make_settings):
+
+    os.makedirs(f"{tmp_path}/source")
+    folder = f"{tmp_path}/motorsort/Formula 1/2022-00 - Example GP"
+    os.makedirs(folder)
+    sources = [
+        f"{tmp_path}/source/Formula1.2022.Round00.Example.FP1.mkv",
+        f"{tmp_path}/source/Formula1.2022.Round00.Example.Race.mkv",
+        f"{tmp_path}/source/Formula1.2022.Round00.Example.Qualifying.mkv",
+    ]
+    for source in sources:
+        open(source, "w").close()
+    # current, under an old name plus a leftover link, and not linked
+    os.link(sources[0], f"{folder}/Example GP - S00E01 - Free Practice 1 [].mkv")
+    os.link(sources[1], f"{folder}/Example GP - S00E08 - Race [].mkv")
+    os.link(sources[1], f"{folder}/Example GP - S00E07 - Race [].mkv")
+    open(f"{folder}/Extra.mkv", "w").close()
+    os.makedirs(f"{tmp_path}/motorsort/Formula 1/2021-01 - Old GP")
+    open(f"{tmp_path}/motorsort/Formula 1/2021-01 - Old GP/show.png", "w").close()
+    settings = make_settings()
+    source_stats = stat_sources(sources)
+    scan = scan_destination(settings)
+    plan, duplicates = make_plan(settings, source_stats, scan)
+
+    result = reconcile(
+        plan,
+        source_stats,
+        scan,
+        StateIndex(f"{tmp_path}/state_index.json"),
+        False,
+        duplicates,
+    )
+
+    assert result.current == [f"{folder}/Example GP - S00E01 - Free Practice 1 [].mkv"]
+    assert result.renames == [
+        (
+            f"{folder}/Example GP - S00E07 - Race [].mkv",
+            f"{folder}/Example GP - S00E09 - Race [].mkv",
+        )
+    ]
+    assert result.stale == [f"{folder}/Example GP - S00E08 - Race [].mkv"]
+    assert result.missing == [f"{folder}/Example GP - S00E05 - Qualifying [].mkv"]
+    assert result.untracked == [f"{folder}/Extra.mkv"]
+    assert not result.conflicts
+    assert result.orphaned_images == [
+        f"{tmp_path}/motorsort/Formula 1/2021-01 - Old GP/show.png"
+    ]
+
+
+def test_reconcile_reports_sources_with_the_same_destination(tmp_path, make_settings):
+
+    sources = [
+        f"{tmp_path}/source/{folder}/Formula1.2022.Round00.Example.Race.mkv"
+        for folder in ("one", "two")
+    ]
+    for source in sources:
+        os.makedirs(os.path.dirname(source))
+        open(source, "w").close()
+    settings = make_settings()
+    source_stats = stat_sources(sources)
+    scan = scan_destination(settings)
+    plan, duplicates = make_plan(settings, source_stats, scan)
+
+    result = reconcile(
+        plan,
+        source_stats,
+        scan,
+        StateIndex(f"{tmp_path}/state_index.json"),
+        False,
+        duplicates,
+    )
+
+    destination = (
+        f"{tmp_path}/motorsort/Formula 1/2022-00 - Example GP/"
+        "Example GP - S00E09 - Race [].mkv"
+    )
+    assert not plan
+    assert result.conflicts == [destination]
+    assert not result.missing
+
+
+def test_apply_renames_swaps_names(tmp_path):
+
+    (tmp_path / "a.mkv").write_text("a")
+    (tmp_path / "b.mkv").write_text("b")
+
+    apply_renames(
+        [
+            (f"{tmp_path}/a.mkv", f"{tmp_path}/b.mkv"),
+            (f"{tmp_path}/b.mkv", f"{tmp_path}/a.mkv"),
+        ]
+    )
+
+    assert (tmp_path / "a.mkv").read_text() == "b"
+    assert (tmp_path / "b.mkv").read_text() == "a"
+    assert sorted(os.listdir(tmp_path)) == ["a.mkv", "b.mkv"]
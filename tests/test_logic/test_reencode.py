@@ -0,0 +1,54 @@
+"""pytest test_reencode.py"""
+
+import os
+import shutil
+import pytest
+from app.reencode import find_images, compare, reencode
+from app.poster_maker import PillowRenderer
+
+
+def make_folders(tmp_path, image):
+
+    folders = [
+        f"{tmp_path}/motorsort/Formula 1/2023-01 - COTA GP",
+        f"{tmp_path}/motorsort/Formula 1/2023-02 - Miami GP",
+    ]
+    for folder in folders:
+        os.makedirs(folder)
+    image.new("RGB", (60, 90), "red").save(f"{folders[0]}/show.png")
+    # the render cache hardlinks identical images
+    os.link(f"{folders[0]}/show.png", f"{folders[1]}/show.png")
+    shutil.copy("config/images/2023-background.jpg", f"{folders[0]}/background.jpg")
+    return folders
+
+
+def test_reencode_hardlinked_images_once(tmp_path, make_settings):
+
+    image = pytest.importorskip("PIL.Image")
+    folders = make_folders(tmp_path, image)
+    settings = make_settings()
+    renderer = PillowRenderer("fonts")
+    images = find_images(settings)
+
+    assert len(images["show"]) == 1 and len(images["show"][0]) == 2
+    assert len(images["background"]) == 1
+
+    result = compare(renderer, "show", images["show"], "webp quality=80")
+    assert result.files == 1 and result.bytes_after > 0
+    assert os.path.isfile(f"{folders[0]}/show.png")
+
+    result, changed = reencode(renderer, "show", images["show"], "webp quality=80")
+
+    assert result.bytes_before > 0
+    assert result.bytes_after == os.path.getsize(f"{folders[0]}/show.webp")
+    for folder in folders:
+        assert not os.path.exists(f"{folder}/show.png")
+        assert f"{folder}/show.webp" in changed
+    assert (
+        os.stat(f"{folders[0]}/show.webp").st_ino
+        == os.stat(f"{folders[1]}/show.webp").st_ino
+    )
+
+    images = find_images(settings)
+    result, changed = reencode(renderer, "show", images["show"], "webp quality=60")
+    assert result.files == 0 and not changed
@@ -0,0 +1,172 @@
+"""pytest test_render_cache.py"""
+
+import os
+import shutil
+import pytest
+from app.render_cache import RenderCache, CachedRenderer
+
+
+class CountingRenderer:
+    """writes the spec text instead of an image"""
+
+    name = "counting"
+
+    def __init__(self):
+        self.renders = 0
+
+    def render(self, spec):
+        self.renders += 1
+        with open(spec["destination"], "w", encoding="utf-8") as file:
+            file.write(spec["annotations"][0]["text"])
+
+
+def make_renderer(tmp_path):
+
+    renderer = CachedRenderer(
+        RenderCache(f"{tmp_path}/render_cache").load(), "counting", "fonts"
+    )
+    renderer.backend_renderer = CountingRenderer()
+    return renderer
+
+
+def folder_spec(make_spec, tmp_path, folder, text="00"):
+
+    os.makedirs(f"{tmp_path}/{folder}", exist_ok=True)
+    return make_spec(
+        f"{tmp_path}/{folder}/background.jpg",
+        f"{tmp_path}/background.jpg",
+        annotations=[{"text": text}],
+    )
+
+
+def test_cached_renderer_renders_identical_images_once(tmp_path, make_spec):
+
+    (tmp_path / "background.jpg").write_text("base")
+    renderer = make_renderer(tmp_path)
+
+    assert renderer.render(
+        folder_spec(make_spec, tmp_path, "Formula 1/2022-00 - Example GP")
+    )
+    assert renderer.render(folder_spec(make_spec, tmp_path, "WEC/2022-00 - Example"))
+
+    assert renderer.backend_renderer.renders == 1
+    assert (
+        os.stat(f"{tmp_path}/Formula 1/2022-00 - Example GP/background.jpg").st_ino
+        == os.stat(f"{tmp_path}/WEC/2022-00 - Example/background.jpg").st_ino
+    )
+
+
+def test_cached_renderer_renders_again_when_inputs_change(tmp_path, make_spec):
+
+    (tmp_path / "background.jpg").write_text("base")
+    renderer = make_renderer(tmp_path)
+    spec = folder_spec(make_spec, tmp_path, "Formula 1/2022-00 - Example GP")
+    renderer.render(spec)
+
+    assert not renderer.render(spec)
+
+    (tmp_path / "background.jpg").write_text("a new base image")
+
+    assert renderer.render(spec)
+    assert renderer.backend_renderer.renders == 2
+
+
+def test_cached_renderer_keeps_existing_images(tmp_path, make_spec):
+
+    (tmp_path / "background.jpg").write_text("base")
+    renderer = make_renderer(tmp_path)
+    spec = folder_spec(make_spec, tmp_path, "Formula 1/2022-00 - Example GP")
+    with open(spec["destination"], "w", encoding="utf-8") as file:
+        file.write("made before the cache")
+
+    assert not renderer.render(spec)
+    assert renderer.render_cache.manifest[spec["destination"]]
+
+
+def test_render_cache_manifest_reload_and_prune(tmp_path, make_spec):
+
+    (tmp_path / "background.jpg").write_text("base")
+    renderer = make_renderer(tmp_path)
+    spec = folder_spec(make_spec, tmp_path, "Formula 1/2022-00 - Example GP")
+    renderer.render(spec)
+    old_store_file = renderer.render_cache.store_file(
+        renderer.render_cache.manifest[spec["destination"]], spec["destination"]
+    )
+    renderer.render(
+        folder_spec(make_spec, tmp_path, "Formula 1/2022-00 - Example GP", "01")
+    )
+    renderer.render_cache.prune()
+    renderer.render_cache.save()
+
+    reloaded = RenderCache(f"{tmp_path}/render_cache").load()
+
+    assert reloaded.manifest == renderer.render_cache.manifest
+    assert not os.path.exists(old_store_file)
+
+
+def test_render_cache_inputs(tmp_path):
+
+    render_cache = RenderCache(f"{tmp_path}/render_cache")
+
+    assert not render_cache.inputs_current("a")
+    render_cache.record_inputs("a")
+    assert render_cache.inputs_current("a")
+    assert not render_cache.inputs_current("b")
+    render_cache.prune()
+    assert render_cache.inputs_current("a")
+
+
+def test_render_cache_prunes_only_its_own_files(tmp_path, make_spec):
+
+    (tmp_path / "background.jpg").write_text("base")
+    renderer = make_renderer(tmp_path)
+    spec = folder_spec(make_spec, tmp_path, "Formula 1/2022-00 - Example GP")
+    renderer.render(spec)
+    store_file = renderer.render_cache.store_file(
+        renderer.render_cache.manifest[spec["destination"]], spec["destination"]
+    )
+    # media that found its way into the cache directory is left alone
+    foreign = [
+        f"{tmp_path}/render_cache/Example.mkv",
+        f"{tmp_path}/render_cache/ab/Example.mkv",
+        f"{tmp_path}/render_cache/ab/{'cd' * 16}.png",
+        f"{tmp_path}/render_cache/Formula 1/{'ab' * 16}.png",
+    ]
+    for path in foreign:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "w").close()
+    unused = f"{tmp_path}/render_cache/ab/{'ab' * 16}.jpg"
+    open(unused, "w").close()
+
+    renderer.render_cache.prune()
+
+    assert os.path.isfile(store_file)
+    assert not os.path.exists(unused)
+    for path in foreign:
+        assert os.path.isfile(path)
+
+
+def test_cached_renderer_keys_fonts_under_imagemagick(tmp_path, make_spec):
+
+    pytest.importorskip("PIL.ImageFont")
+    os.makedirs(f"{tmp_path}/fonts")
+    font_file = f"{tmp_path}/fonts/TitilliumWeb-Bold.ttf"
+    shutil.copy("fonts/TitilliumWeb-Bold.ttf", font_file)
+    renderer = CachedRenderer(
+        RenderCache(f"{tmp_path}/render_cache"), "imagemagick", f"{tmp_path}/fonts"
+    )
+    spec = make_spec(
+        f"{tmp_path}/show.png",
+        annotations=[{"text": "00", "font": "Titillium-Web-Bold"}],
+    )
+
+    font_files = renderer.font_files(spec)
+    key = renderer.render_cache.input_key(spec, "imagemagick", font_files)
+    assert font_files == [font_file]
+
+    with open(font_file, "ab") as file:
+        file.write(b"\0")
+
+    assert key != renderer.render_cache.input_key(
+        spec, "imagemagick", renderer.font_files(spec)
+    )
@@ -0,0 +1,87 @@
+"""pytest test_session_matcher.py"""
+
+import os
+import re
+import json
+from app.session_matcher import SessionMatcher, trie_pattern
+
+with open("config/session_map.json") as file:
+    session_map = json.load(file)
+
+
+def legacy_find_race_session(race_info, session_map):
+    """the linear session_map search SessionMatcher replaces"""
+    race_name = ""
+    race_session = ""
+    info = ""
+    for key in session_map.keys():
+        if key in race_info.replace(".", " ").lower():
+            if len(race_session) <= len(key):
+                race_session = session_map[key]
+                race_details = re.split(
+                    key, race_info.replace(".", " ").lower(), flags=re.IGNORECASE
+                )
+                race_name = race_details[0].title()
+                info = race_details[-1].upper()
+    return race_name, race_session, info
+
+
+def release_names():
+    """real release names plus synthetic ones for every session key"""
+    names = [
+        os.path.splitext(file)[0] for file in os.listdir("media/source_files/complete")
+    ]
+    race_names = [os.path.splitext(file)[0] for file in os.listdir("config/tracks")]
+    tails = [
+        "FastChannelHD.1080p.50fps.X264.Multi-AOA11",
+        "WEB.1080p.h264.Multi-AOA11",
+        "SkyF1HD.1080p50",
+        "",
+    ]
+    keys = list(session_map)
+    for index, key in enumerate(keys):
+        race_name = race_names[index % len(race_names)].replace(" ", ".")
+        session = key.replace(" ", ".")
+        for tail in tails:
+            names.append(f"{race_name}.{session.title()}.{tail}")
+            names.append(f"{race_name} {session.upper()} {tail}")
+            # two sessions in one name, e.g. a notebook after a race
+            other = keys[(index * 7) % len(keys)].replace(" ", ".")
+            names.append(f"{race_name}.{session}.{other}.{tail}")
+    names.append("Example.No.Session.FastChannelHD")
+    return names
+
+
+def test_session_matcher_matches_legacy_search():
+
+    session_matcher = SessionMatcher(session_map)
+
+    for name in release_names():
+        assert session_matcher.match(name) == legacy_find_race_session(
+            name, session_map
+        ), name
+
+
+def test_session_matcher_prefers_longest_key():
+
+    session_matcher = SessionMatcher(session_map)
+
+    assert session_matcher.match("Example.Quali.Analysis.WEB") == (
+        "Example ",
+        "Quali Analysis",
+        " WEB",
+    )
+
+
+def test_session_matcher_no_session():
+
+    assert SessionMatcher(session_map).match("Example.WEB") == ("", "", "")
+
+
+def test_trie_pattern_finds_longest_key():
+
+    pattern = re.compile(trie_pattern(["race", "race analysis", "pre race"]))
+
+    assert pattern.match("race analysis").group() == "race analysis"
+    assert pattern.match("race build").group() == "race"
+    assert pattern.match("pre race").group() == "pre race"
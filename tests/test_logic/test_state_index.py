@@ -0,0 +1,151 @@
+"""pytest test_state_index.py"""
+
+import os
+from app.state_index import StateIndex
+from app.weekend import Weekend
+
+
+def make_race(tmp_path):
+
+    race = Weekend(f"{tmp_path}/motorsort")
+    race.set_kv("race_series", "Formula 1")
+    race.set_kv("race_season", "2022")
+    race.set_kv("race_round", "00")
+    race.set_kv("race_name", "Example")
+    race.set_kv("race_session", "Free Practice 1")
+    race.set_kv("race_info", "FastChannelHD")
+    race.set_kv("weekend_order", "01")
+    race.set_kv("file_extension", ".mkv")
+    return race
+
+
+def test_state_index_missing_file_loads_empty(tmp_path):
+
+    state_index = StateIndex(f"{tmp_path}/state_index.json").load()
+
+    assert state_index.entries == {}
+
+
+def test_state_index_record_and_reload(tmp_path):
+
+    source_file = tmp_path / "Formula1.2022.Round00.Example.FP1.mkv"
+    source_file.write_text("video")
+    source_stat = os.stat(source_file)
+
+    race = make_race(tmp_path)
+    os.makedirs(race.get_destination_folder())
+    os.link(source_file, race.get_destination_full_path())
+    state_index = StateIndex(f"{tmp_path}/state_index.json").load()
+    state_index.record(str(source_file), source_stat, race)
+    state_index.save()
+
+    reloaded = StateIndex(f"{tmp_path}/state_index.json").load()
+
+    assert reloaded.is_current(str(source_file), source_stat)
+    assert reloaded.get_entry(str(source_file))["destination"] == (
+        f"{tmp_path}/motorsort/Formula 1/2022-00 - Example GP/"
+        "Example GP - S00E01 - Free Practice 1 [FastChannelHD].mkv"
+    )
+
+
+def test_state_index_changed_file_is_not_current(tmp_path):
+
+    source_file = tmp_path / "Formula1.2022.Round00.Example.FP1.mkv"
+    source_file.write_text("video")
+
+    state_index = StateIndex(f"{tmp_path}/state_index.json")
+    state_index.record(str(source_file), os.stat(source_file), make_race(tmp_path))
+    source_file.write_text("a longer video")
+
+    assert not state_index.is_current(str(source_file), os.stat(source_file))
+
+
+def test_state_index_prune(tmp_path):
+
+    source_file = tmp_path / "Formula1.2022.Round00.Example.FP1.mkv"
+    source_file.write_text("video")
+
+    state_index = StateIndex(f"{tmp_path}/state_index.json")
+    state_index.record(str(source_file), os.stat(source_file), make_race(tmp_path))
+    state_index.prune([])
+
+    assert state_index.entries == {}
+
+
+def test_state_index_unreadable_file_loads_empty(tmp_path):
+
+    (tmp_path / "state_index.json").write_text("not json")
+
+    state_index = StateIndex(f"{tmp_path}/state_index.json").load()
+
+    assert state_index.entries == {}
+
+
+def test_state_index_sprint_weekends_reload(tmp_path):
+
+    state_index = StateIndex(f"{tmp_path}/state_index.json").load()
+    state_index.add_sprint_weekends({("2024", "05"), ("2023", "21")})
+    state_index.save()
+
+    reloaded = StateIndex(f"{tmp_path}/state_index.json").load()
+
+    assert reloaded.sprint_weekends == {("2024", "05"), ("2023", "21")}
+
+
+def test_state_index_loads_entries_only_file(tmp_path):
+
+    (tmp_path / "state_index.json").write_text('{"Formula1.mkv": {}}')
+
+    state_index = StateIndex(f"{tmp_path}/state_index.json").load()
+
+    assert state_index.entries == {"Formula1.mkv": {}}
+    assert state_index.sprint_weekends is None
+
+
+def test_state_index_invalidate_weekends(tmp_path):
+
+    source_file = tmp_path / "Formula1.2022.Round00.Example.FP1.mkv"
+    source_file.write_text("video")
+
+    state_index = StateIndex(f"{tmp_path}/state_index.json")
+    state_index.record(str(source_file), os.stat(source_file), make_race(tmp_path))
+
+    assert state_index.invalidate_weekends({("2022", "01")}, "Formula 1") == []
+    assert state_index.invalidate_weekends({("2022", "00")}, "Formula 1") == [
+        str(source_file)
+    ]
+    assert not state_index.is_current(str(source_file), os.stat(source_file))
+
+
+def test_state_index_failed_files(tmp_path):
+
+    source_file = tmp_path / "Formula1.2022.Round00.Example.Extra.mkv"
+    source_file.write_text("video")
+    race = Weekend(f"{tmp_path}/motorsort")
+    race.set_kv("race_series", "Formula 1")
+    race.set_kv("race_season", "2022")
+    race.set_kv("race_round", "00")
+
+    state_index = StateIndex(f"{tmp_path}/state_index.json").load()
+    state_index.record_failure(
+        str(source_file), os.stat(source_file), "v1", race, "race series not found"
+    )
+    state_index.save()
+    reloaded = StateIndex(f"{tmp_path}/state_index.json").load()
+
+    assert reloaded.is_failed(str(source_file), os.stat(source_file), "v1")
+    assert not reloaded.is_failed(str(source_file), os.stat(source_file), "v2")
+    assert reloaded.failed_by_reason() == {"race series not found": [str(source_file)]}
+
+    # parsed again once its weekend becomes a sprint weekend
+    reloaded.invalidate_weekends({("2022", "00")}, "Formula 1")
+    assert not reloaded.is_failed(str(source_file), os.stat(source_file), "v1")
+
+    reloaded.record_failure(
+        str(source_file), os.stat(source_file), "v1", race, "race series not found"
+    )
+    source_file.write_text("a longer video")
+    assert not reloaded.is_failed(str(source_file), os.stat(source_file), "v1")
+
+    reloaded.prune([])
+    assert reloaded.failed == {}
@@ -0,0 +1,89 @@
+"""pytest test_tokenizer.py"""
+
+import os
+import re
+import json
+from app.tokenizer import FileNameTokenizer, RaceTokens
+from app.session_matcher import SessionMatcher
+from app.config_cache import SeriesMatcher
+
+with open("config/session_map.json") as file:
+    session_map = json.load(file)
+with open("config/series_prefix.json") as file:
+    series_prefix = json.load(file)
+
+
+def legacy_tokenize(file_name):
+    """the find_race_year, series, round and session chain the tokenizer
+    replaces, each step stripping race_info again"""
+    file_name_path, file_extension = os.path.splitext(file_name)
+    race_info = os.path.basename(file_name_path).strip()
+    race_season = "1970"
+    race_year = re.search("(20|19)[0-9][0-9]", race_info)
+    if race_year:
+        race_season = race_year.group()
+        race_info = race_info.replace(race_year.group(), "", 1).strip()
+    race_series = None
+    for prefix, series in series_prefix.items():
+        if race_info.startswith(prefix):
+            race_series = series
+            race_info = race_info[len(prefix) :].strip()
+            break
+    race_round = "00"
+    found_round = re.search("Round.?[0-9][0-9]", race_info)
+    if found_round:
+        race_round = found_round.group()[-2:]
+        race_info = race_info.replace(found_round.group(), "", 1).strip()
+    race_name, race_session, race_info = SessionMatcher(session_map).match(race_info)
+    race_name = race_name.strip()
+    if race_series == "Formula 1":
+        race_name = race_name.replace("Usa", "", 1).strip()
+    if race_series == "World Endurance Championship":
+        race_name = race_name.replace("France", "", 1).strip()
+    return RaceTokens(
+        race_series,
+        race_season,
+        race_round,
+        race_session.strip(),
+        race_name,
+        race_info.strip(),
+        file_extension,
+    )
+
+
+def test_tokenize():
+
+    tokenizer = FileNameTokenizer(
+        SeriesMatcher(series_prefix), SessionMatcher(session_map)
+    )
+
+    assert tokenizer.tokenize(
+        "/source/Formula1.2024.Round06.Usa.Miami.Sprint.F1TV.1080p.mkv"
+    ) == RaceTokens(
+        "Formula 1",
+        "2024",
+        "06",
+        "Sprint",
+        "Miami",
+        "F1TV 1080P",
+        ".mkv",
+    )
+    assert tokenizer.tokenize("Example.Race.mkv").race_series is None
+
+
+def test_tokenize_matches_legacy_chain():
+
+    tokenizer = FileNameTokenizer(
+        SeriesMatcher(series_prefix), SessionMatcher(session_map)
+    )
+    names = os.listdir("media/source_files/complete") + [
+        "Formula1.Round07.2024.Race.mkv",
+        "Formula1 2023 Round.22 Abu.Dhabi Qualifying SkyF1HD.mp4",
+        "WEC.2024.Round2024.France.Le.Mans.Hyperpole.mkv",
+        "LeMans24.1999.Race.Hour.Twentyfour",
+        " Formula.1.2022.Round05.Race.Notebook.WEB.mkv",
+        "2024.Formula1.Round03.Race.mkv",
+    ]
+
+    for name in names:
+        assert tokenizer.tokenize(name) == legacy_tokenize(name), name
@@ -0,0 +1,92 @@
+"""pytest test_watcher.py"""
+
+import os
+import time
+import pytest
+from app.watcher import Debouncer, InotifyWatcher, PollingWatcher, rescan
+from app.state_index import StateIndex
+
+
+def test_debouncer_waits_for_settle_time(tmp_path):
+
+    source_file = tmp_path / "Formula1.2022.Round00.Example.FP1.mkv"
+    source_file.write_text("video")
+    debouncer = Debouncer(10)
+    debouncer.touch(str(source_file), 100)
+
+    assert debouncer.ready(105) == []
+    assert debouncer.ready(110) == [str(source_file)]
+    assert debouncer.ready(120) == []
+
+
+def test_debouncer_holds_growing_file(tmp_path):
+
+    source_file = tmp_path / "Formula1.2022.Round00.Example.FP1.mkv"
+    source_file.write_text("video")
+    debouncer = Debouncer(10)
+    debouncer.touch(str(source_file), 100)
+    source_file.write_text("more video")
+
+    assert debouncer.ready(110) == []
+    assert debouncer.ready(120) == [str(source_file)]
+
+
+def test_debouncer_drops_removed_file(tmp_path):
+
+    source_file = tmp_path / "Formula1.2022.Round00.Example.FP1.mkv"
+    source_file.write_text("video")
+    debouncer = Debouncer(10)
+    debouncer.touch(str(source_file), 100)
+    os.remove(source_file)
+
+    assert debouncer.ready(110) == []
+    assert debouncer.pending == {}
+
+
+def test_polling_watcher_changes(tmp_path):
+
+    os.makedirs(f"{tmp_path}/complete")
+    (tmp_path / "complete" / "old.mkv").write_text("video")
+    watcher = PollingWatcher(str(tmp_path / "complete"), 0)
+    (tmp_path / "complete" / "new.mkv").write_text("video")
+
+    assert watcher.changes(0) == {f"{tmp_path}/complete/new.mkv"}
+    assert watcher.changes(0) == set()
+
+
+def test_inotify_watcher_changes(tmp_path):
+
+    try:
+        watcher = InotifyWatcher(str(tmp_path))
+    except (OSError, AttributeError):
+        pytest.skip("inotify not available")
+
+    os.makedirs(f"{tmp_path}/season")
+    (tmp_path / "season" / "new.mkv").write_text("video")
+    (tmp_path / "top.mkv").write_text("video")
+
+    changed = set()
+    for _ in range(5):
+        changed |= watcher.changes(0.2)
+    changed |= watcher.changes(0.2)
+    watcher.close()
+
+    assert f"{tmp_path}/top.mkv" in changed
+    assert f"{tmp_path}/season/new.mkv" in changed
+
+
+def test_rescan_touches_files_and_prunes_deleted_ones(tmp_path, make_settings):
+
+    settings = make_settings(file_prefix=("Formula1",))
+    os.makedirs(settings["source_path"])
+    source_file = f"{settings['source_path']}/Formula1.2024.Round01.Race.mkv"
+    open(source_file, "w").close()
+    state_index = StateIndex(settings["state_index"])
+    state_index.entries[source_file] = {"signature": [0, 0, 0]}
+    state_index.entries[f"{settings['source_path']}/Formula1.Deleted.mkv"] = {}
+    debouncer = Debouncer(0)
+
+    rescan(settings, state_index, debouncer)
+
+    assert list(state_index.entries) == [source_file]
+    assert debouncer.ready(time.monotonic()) == [source_file]
@@ -0,0 +1,74 @@
+"""pytest test_watermark.py"""
+
+import os
+from app.watermark import Watermark
+from app.state_index import StateIndex
+
+
+def make_source(tmp_path):
+
+    for path in ("source/2024", "source/.hidden", "images", "motorsort"):
+        os.makedirs(tmp_path / path)
+    (tmp_path / "config.ini").write_text("[config]")
+
+
+def test_watermark_skips_unchanged_runs(tmp_path, make_settings):
+
+    make_source(tmp_path)
+    settings = make_settings()
+    state_index = StateIndex(settings["state_index"])
+    watermark = Watermark(f"{tmp_path}/watermark.json")
+
+    assert not watermark.check(settings)
+    watermark.update(settings, state_index, [])
+    assert watermark.check(settings)
+
+    # ignored directories are not part of the signature
+    (tmp_path / "source/.hidden/Formula1.2024.Round01.Race.mkv").write_text("")
+    assert watermark.check(settings)
+
+    (tmp_path / "source/2024/Formula1.2024.Round01.Race.mkv").write_text("")
+    assert not watermark.check(settings)
+    watermark.update(settings, state_index, [])
+
+    # a new directory changes its parent, then is saved and stat'ed itself
+    os.makedirs(tmp_path / "source/2025")
+    assert not watermark.check(settings)
+    watermark.update(settings, state_index, [])
+    assert f"{tmp_path}/source/2025" in watermark.load()["inputs"]["source"]
+    (tmp_path / "source/2025/Formula1.2025.Round01.Race.mkv").write_text("")
+    assert not watermark.check(settings)
+    watermark.update(settings, state_index, [])
+
+    (tmp_path / "images/poster.jpg").write_text("")
+    assert not watermark.check(settings)
+    watermark.update(settings, state_index, [])
+
+    settings["copy_files"] = True
+    assert not watermark.check(settings)
+    watermark.update(settings, state_index, [])
+    assert watermark.check(settings)
+
+    watermark.update(settings, state_index, ["ERROR: Can't copy"])
+    assert not os.path.exists(f"{tmp_path}/watermark.json")
+
+
+def test_watermark_not_saved_for_recent_files(tmp_path, make_settings):
+
+    make_source(tmp_path)
+    settings = make_settings()
+    state_index = StateIndex(settings["state_index"])
+    state_index.entries["Formula1.2024.Round01.Race.mkv"] = {
+        "signature": [1, 0, os.stat(tmp_path).st_mtime_ns]
+    }
+    watermark = Watermark(f"{tmp_path}/watermark.json")
+
+    watermark.check(settings)
+    watermark.update(settings, state_index, [])
+
+    assert not watermark.check(settings)
+
+    state_index.entries["Formula1.2024.Round01.Race.mkv"]["signature"] = [1, 0, 0]
+    watermark.update(settings, state_index, [])
+
+    assert watermark.check(settings)